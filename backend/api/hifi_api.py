@@ -1,30 +1,30 @@
-from urllib.parse import urljoin
+from functools import partial
+from urllib.parse import urljoin, urlparse
 import requests
 import time
 
-from utils.utils import json_from_base64
+from api import httpclient
+from core.bandwidth import bandwidth
+from core.hedge import hedger
+from core.pacer import pacer, parse_retry_after
+from core.quota import ledger
+from core.constructor import (
+    TrackSlotsFromSearchResponse,
+    AlbumSlotFromResponse,
+    TrackInfoSlotFromResponse,
+)
 from models.models import (
     TrackItemSlot,
-    ArtistSubSlot,
-    AlbumSubSlot,
     AlbumItemSlot,
     TrackInfoSlot,
 )
 
 
-def _artist_subslot(artistItem):
-    return ArtistSubSlot(
-        id=artistItem["id"], name=artistItem["name"], picture=artistItem["picture"]
-    )
-
-
-def _album_subslot(albumItem):
-    return AlbumSubSlot(
-        id=albumItem["id"], title=albumItem["title"], cover=albumItem["cover"]
-    )
-
-
 class AudioHifiAPI:
+    # optional limiter shared across processes, set by worker nodes
+    rateLimiter = None
+    provider = "hifi"
+
     def __init__(self):
         self.api_urls = [
             "https://triton.squid.wtf",
@@ -40,15 +40,66 @@ class AudioHifiAPI:
         self.info_path = "/info/"
         self.recommendations_path = "/recommendations/"
 
-        self.session = None
-        self.session = requests.Session()
+        # pooled keep-alive connections shared with every other run
+        self.session = httpclient.get_session()
+
+    def _paced_get(self, url, sent=None, **kwargs) -> requests.Response:
+        """
+        GET paced per host, the response adjusts the host request rate.
+        sent is called once the pacing wait is over and the request goes out.
+        """
+        hostPacer = pacer.get(urlparse(url).netloc, self.provider)
+        if self.rateLimiter is not None:
+            # workers share the slots, spaced by the adaptive interval of this node
+            # with the limiter interval as floor
+            hostPacer.wait_unblocked()
+            self.rateLimiter.acquire(
+                hostPacer.host,
+                interval=max(hostPacer.interval, self.rateLimiter.interval),
+            )
+        else:
+            hostPacer.acquire()
+        if sent is not None:
+            sent()
+        started = time.monotonic()
+        try:
+            response = self.session.get(url, **kwargs)
+        except requests.RequestException:
+            ledger.record(self.provider)
+            hostPacer.feedback(None)
+            raise
+        # streamed bodies are counted by the caller once read
+        ledger.record(
+            self.provider, 1, 0 if kwargs.get("stream") else len(response.content)
+        )
+        hostPacer.feedback(
+            response.status_code,
+            time.monotonic() - started,
+            parse_retry_after(response.headers.get("Retry-After")),
+        )
+        return response
 
-    def _make_request(self, path_url, params):
-        for u in self.api_urls:
-            time.sleep(2)
-            response = self.session.get(urljoin(u, path_url), params=params)
-            if response.ok:
-                return response.json()
+    def _mirror_request(self, baseUrl, path_url, params, sent=None) -> bytes:
+        response = self._paced_get(urljoin(baseUrl, path_url), sent, params=params)
+        if not response.ok:
+            raise ConnectionError(f"{baseUrl} answered {response.status_code}")
+        return response.content
+
+    def _make_request(self, path_url, params) -> bytes:
+        # idle mirrors first, mirrors backing off or paused by Retry-After last
+        mirrors = sorted(
+            self.api_urls,
+            key=lambda u: pacer.get(urlparse(u).netloc, self.provider).ready_at(),
+        )
+        if hedger.enabled:
+            return hedger.run(
+                [partial(self._mirror_request, u, path_url, params) for u in mirrors]
+            )
+        for u in mirrors:
+            try:
+                return self._mirror_request(u, path_url, params)
+            except (requests.RequestException, ConnectionError):
+                continue
         raise ConnectionError
 
     def search_track(self, prompt, mode="s") -> list[TrackItemSlot]:
@@ -56,46 +107,13 @@ class AudioHifiAPI:
             mode: prompt,
         }
         response = self._make_request(self.search_path, params)
-
-        resultTracks = []
-        for responseItem in response["data"]["items"]:
-            resultTracks.append(
-                TrackItemSlot(
-                    id=responseItem["id"],
-                    title=responseItem["title"],
-                    duration=responseItem["duration"],
-                    replayGain=responseItem["replayGain"],
-                    trackNumber=responseItem["trackNumber"],
-                    volumeNumber=responseItem["volumeNumber"],
-                    popularity=responseItem["popularity"],
-                    copyright=responseItem["copyright"],
-                    url=responseItem["url"],
-                    isrc=responseItem["isrc"],
-                    explicit=responseItem["explicit"],
-                    audioQuality=responseItem["audioQuality"],
-                    artist=_artist_subslot(responseItem["artist"]),
-                    artists=[_artist_subslot(i) for i in responseItem["artists"]],
-                    album=_album_subslot(responseItem["album"]),
-                )
-            )
-        return resultTracks
+        return TrackSlotsFromSearchResponse(response)
 
     def get_track_manifest(self, track_id, quality="LOSSLESS") -> TrackInfoSlot:
         params = {"id": track_id, "quality": quality}
 
         response = self._make_request(self.track_path, params)
-        decodedManifest = json_from_base64(response["data"]["manifest"])
-
-        trackInfoSlot = TrackInfoSlot(
-            trackId=response["data"]["trackId"],
-            trackReplayGain=response["data"]["trackReplayGain"],
-            albumReplayGain=response["data"]["albumReplayGain"],
-            bitDepth=response["data"]["bitDepth"],
-            sampleRate=response["data"]["sampleRate"],
-            manifest=response["data"]["manifest"],
-            codec=decodedManifest["codecs"],
-            url=decodedManifest["urls"][0],
-        )
+        trackInfoSlot = TrackInfoSlotFromResponse(response)
 
         if trackInfoSlot.url != "":
             return trackInfoSlot
@@ -105,28 +123,22 @@ class AudioHifiAPI:
         params = {"id": album_id}
 
         response = self._make_request(self.album_path, params)
-        responseData = response["data"]
-        return AlbumItemSlot(
-            id=responseData["id"],
-            title=responseData["title"],
-            duration=responseData["duration"],
-            cover=responseData["cover"],
-            date=responseData["releaseDate"],
-            numberOfTracks=responseData["numberOfTracks"],
-            numberOfVolumes=responseData["numberOfVolumes"],
-            popularity=responseData["popularity"],
-            copyright=responseData["copyright"],
-            url=responseData["url"],
-            upc=responseData["upc"],
-            explicit=responseData["explicit"],
-            audioQuality=responseData["audioQuality"],
-            artist=_artist_subslot(responseData["artist"]),
-            artists=[_artist_subslot(i) for i in responseData["artists"]],
-        )
+        return AlbumSlotFromResponse(response)
 
-    def get_track_file(self, url) -> bytes:
-        response = self.session.get(url)
-        return response.content
+    def get_track_file(self, url, progress=None, chunkSize=64 * 1024) -> bytes:
+        """
+        Downloads the track file, progress(done, total) is called for every chunk.
+        """
+        with self._paced_get(url, stream=True) as response:
+            total = int(response.headers.get("Content-Length") or 0)
+            data = bytearray()
+            for chunk in response.iter_content(chunkSize):
+                bandwidth.consume(len(chunk))
+                data += chunk
+                if progress is not None:
+                    progress(len(data), total)
+        ledger.record(self.provider, 0, len(data))
+        return bytes(data)
 
     def get_album_art(self, uuid) -> bytes:
         """
@@ -148,5 +160,5 @@ class AudioHifiAPI:
             "xl": f"{baseUrl}/1080x1080.jpg",
             "xxl": f"{baseUrl}/1280x1280.jpg",
         }
-        response = self.session.get(images["lg"])
+        response = self._paced_get(images["lg"])
         return response.content
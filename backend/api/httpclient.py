@@ -0,0 +1,80 @@
+# pylint: disable=invalid-name
+"""
+Process wide HTTP client, shared by every provider and run.
+
+Connections are kept alive per host in a pool, so mirror and artwork TLS handshakes
+happen once per process instead of once per run, and every request gets explicit
+connect/read timeouts unless the caller passes its own.
+"""
+
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULTS = {
+    "connectTimeout": 5.0,
+    "readTimeout": 30.0,
+    "poolConnections": 16,  # hosts kept in the pool
+    "poolMaxsize": 16,  # connections kept per host
+}
+
+
+class TimeoutSession(requests.Session):
+    """
+    Session with a default (connect, read) timeout on every request.
+    """
+
+    def __init__(self, timeout):
+        super().__init__()
+        self.timeout = timeout
+
+    def request(self, method, url, *args, **kwargs):  # pylint: disable=arguments-differ
+        kwargs.setdefault("timeout", self.timeout)
+        return super().request(method, url, *args, **kwargs)
+
+
+_settings = dict(DEFAULTS)
+_session: TimeoutSession | None = None
+_lock = threading.Lock()
+
+
+def _build_session() -> TimeoutSession:
+    session = TimeoutSession((_settings["connectTimeout"], _settings["readTimeout"]))
+    # retries are left to the callers, they know which mirror to try next
+    adapter = HTTPAdapter(
+        pool_connections=_settings["poolConnections"],
+        pool_maxsize=_settings["poolMaxsize"],
+        max_retries=0,
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def configure(httpConfig):
+    """
+    Applies the "http" config, the current pool is closed and rebuilt on next use
+    """
+    global _settings, _session  # pylint: disable=global-statement
+    with _lock:
+        _settings = {**DEFAULTS, **httpConfig}
+        if _session is not None:
+            _session.close()
+            _session = None
+
+
+def get_session() -> TimeoutSession:
+    global _session  # pylint: disable=global-statement
+    with _lock:
+        if _session is None:
+            _session = _build_session()
+        return _session
+
+
+def close():
+    global _session  # pylint: disable=global-statement
+    with _lock:
+        if _session is not None:
+            _session.close()
+            _session = None
@@ -1,15 +1,94 @@
-# pylint: disable=invalid-name
+# pylint: disable=invalid-name,broad-exception-caught
 # mypy: disable-error-code="import-untyped"
+import hashlib
 import logging
+import sqlite3
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from os import makedirs, path
 
 import liblistenbrainz
 from fastapi import HTTPException
 
+from core.singleflight import inflight
 from models.models import CandidateTrack
+from utils import jsoncodec
 
 logger = logging.getLogger("Runner")
 
+RECORDING_URL = "musicbrainz.org/recording/"
+
+RADIO_DEFAULTS = {
+    "path": "data/cache/radio.sqlite",
+    "ttl": 3600,  # seconds a generated radio is reused
+    "lead": 15,  # minutes ahead of a scheduled run its radio is generated
+    "interval": 5,  # minutes between pre-generation passes
+    "workers": 4,  # radios generated at once
+}
+
+
+def radio_key(prompt, mode, token=None) -> str:
+    # the token is part of the key without being stored
+    return hashlib.sha256(jsoncodec.dumps_canonical([prompt, mode, token])).hexdigest()
+
+
+class RadioCache:
+    """
+    LB radio responses kept on disk for ttl seconds,
+    blueprints sharing a prompt and mode share a generation.
+    """
+
+    def __init__(self):
+        self.settings = dict(RADIO_DEFAULTS)
+        self.dbPath = None
+        self._lock = threading.Lock()
+
+    def configure(self, cacheConfig):
+        self.settings = {**RADIO_DEFAULTS, **cacheConfig}
+        self.dbPath = path.abspath(self.settings["path"])
+        makedirs(path.dirname(self.dbPath), exist_ok=True)
+        with self._connect() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS radio ("
+                "key TEXT PRIMARY KEY, response TEXT NOT NULL, fetchedAt REAL NOT NULL)"
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.dbPath, timeout=30)
+
+    def get(self, key) -> dict | None:
+        if self.dbPath is None or self.settings["ttl"] <= 0:
+            return None
+        with self._lock, self._connect() as db:
+            row = db.execute(
+                "SELECT response FROM radio WHERE key = ? AND fetchedAt > ?",
+                (key, time.time() - self.settings["ttl"]),
+            ).fetchone()
+        return None if row is None else jsoncodec.loads(row[0])
+
+    def set(self, key, response):
+        if self.dbPath is None or self.settings["ttl"] <= 0:
+            return
+        with self._lock, self._connect() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO radio (key, response, fetchedAt) VALUES (?, ?, ?)",
+                (key, jsoncodec.dumps(response).decode(), time.time()),
+            )
+
+    def prune(self) -> int:
+        if self.dbPath is None:
+            return 0
+        with self._lock, self._connect() as db:
+            return db.execute(
+                "DELETE FROM radio WHERE fetchedAt <= ?",
+                (time.time() - self.settings["ttl"],),
+            ).rowcount
+
+
+# shared by every run in the process, the sqlite file by every process
+radioCache = RadioCache()
+
 
 class MetaLBZAPI:
     def __init__(self, token=None):
@@ -22,23 +101,86 @@ class MetaLBZAPI:
         self.client.set_auth_token(self.token)
 
     def _get_radio_json(self, prompt, mode="easy"):
-        response = self.client.get_lb_radio(prompt, mode)
+        key = radio_key(prompt, mode, self.token)
+        response = radioCache.get(key)
+        if response is not None:
+            logger.info("Radio for %s (%s) served from cache", prompt, mode)
+            return response
+        # identical concurrent requests wait for one generation
+        return inflight.do(("lbz-radio", key), self._generate_radio, key, prompt, mode)
+
+    def _generate_radio(self, key, prompt, mode):
+        # a generation that just finished elsewhere is already cached
+        response = radioCache.get(key)
+        if response is None:
+            started = time.monotonic()
+            response = self.client.get_lb_radio(prompt, mode)
+            logger.info(
+                "Generated radio for %s (%s) in %.1fs",
+                prompt,
+                mode,
+                time.monotonic() - started,
+            )
+            radioCache.set(key, response)
         return response
 
+    @staticmethod
+    def _get_identifiers(jspfTrack) -> list[str]:
+        identifiers = jspfTrack.get("identifier") or []
+        if isinstance(identifiers, str):
+            identifiers = [identifiers]
+        return list(identifiers)
+
+    @staticmethod
+    def _get_recording_mbid(identifiers) -> str | None:
+        for identifier in identifiers:
+            if RECORDING_URL in identifier:
+                return identifier.rstrip("/").rsplit("/", 1)[-1]
+        return None
+
     def get_candidates(self, playlist) -> list[CandidateTrack]:
         response = self._get_radio_json(playlist["prompt"], playlist["mode"])
         tracklist: list[CandidateTrack] = []
 
         for i in response["payload"]["jspf"]["playlist"]["track"]:
+            identifiers = self._get_identifiers(i)
             candidateTrack = CandidateTrack(
                 title=i["title"],
                 artist=i["creator"],
+                album=i.get("album"),
                 id=None,
+                mbid=self._get_recording_mbid(identifiers),
+                identifiers=identifiers,
             )
-            logging.info(
-                "Appending Item: Title: %s - Artist: %s",
+            logger.debug(
+                "Appending Item: Title: %s - Artist: %s - MBID: %s",
                 candidateTrack.title,
                 candidateTrack.artist,
+                candidateTrack.mbid,
             )
             tracklist.append(candidateTrack)
         return tracklist
+
+
+def warm_radios(pairs, token=None) -> int:
+    """
+    Generates the radios of (prompt, mode) pairs concurrently ahead of their runs,
+    returns how many are ready in the cache.
+    """
+    pairs = list(dict.fromkeys(pairs))
+    if not pairs:
+        return 0
+
+    def warm(pair):
+        try:
+            # a client per thread, generations run side by side
+            MetaLBZAPI(token)._get_radio_json(*pair)  # pylint: disable=protected-access
+            return True
+        except Exception as e:
+            logger.error("Error generating radio for %s: %s", pair[0], e)
+            return False
+
+    with ThreadPoolExecutor(
+        max_workers=radioCache.settings["workers"], thread_name_prefix="radio"
+    ) as pool:
+        return sum(pool.map(warm, pairs))
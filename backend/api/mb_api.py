@@ -0,0 +1,150 @@
+# pylint: disable=invalid-name,broad-exception-caught
+# mypy: disable-error-code="import-untyped"
+import logging
+import sqlite3
+import threading
+import time
+import json
+from os import makedirs, path
+
+import musicbrainzngs
+
+from api.metaindex import MetaIndex
+from models.models import CandidateTrack
+
+logger = logging.getLogger("Runner")
+
+musicbrainzngs.set_useragent(
+    "terabithia", "0.1.0", "https://github.com/moddroid94/terabithia"
+)
+
+
+class IsrcCache:
+    """
+    Local sqlite stand-in for the recording -> ISRC lookup,
+    answers repeated candidates without touching MusicBrainz.
+    """
+
+    def __init__(self, dbPath="data/cache/isrc.sqlite", ttl=30 * 24 * 3600):
+        self.dbPath = path.abspath(dbPath)
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        makedirs(path.dirname(self.dbPath), exist_ok=True)
+        with self._connect() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS isrc ("
+                "mbid TEXT PRIMARY KEY, isrcs TEXT NOT NULL, fetchedAt REAL NOT NULL)"
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.dbPath, timeout=30)
+
+    def get_many(self, mbids) -> dict[str, list[str]]:
+        found: dict[str, list[str]] = {}
+        if not mbids:
+            return found
+        oldest = time.time() - self.ttl
+        with self._lock, self._connect() as db:
+            for mbid in mbids:
+                row = db.execute(
+                    "SELECT isrcs FROM isrc WHERE mbid = ? AND fetchedAt > ?",
+                    (mbid, oldest),
+                ).fetchone()
+                if row is not None:
+                    found[mbid] = json.loads(row[0])
+        return found
+
+    def set_many(self, isrcMap: dict[str, list[str]]):
+        now = time.time()
+        with self._lock, self._connect() as db:
+            db.executemany(
+                "INSERT OR REPLACE INTO isrc (mbid, isrcs, fetchedAt) VALUES (?, ?, ?)",
+                [(mbid, json.dumps(isrcs), now) for mbid, isrcs in isrcMap.items()],
+            )
+
+
+class MetaMBAPI:
+    """
+    Resolves candidates to ISRCs: offline index first, then the cache
+    and MusicBrainz in batches unless offline.
+    """
+
+    def __init__(
+        self,
+        cache: IsrcCache | None = None,
+        batchSize=25,
+        index: MetaIndex | None = None,
+        offline=False,
+    ):
+        self.cache = cache or IsrcCache()
+        self.batchSize = batchSize
+        self.index = index
+        self.offline = offline
+
+    def _search_isrcs(self, mbids) -> dict[str, list[str]]:
+        query = " OR ".join(f"rid:{mbid}" for mbid in mbids)
+        response = musicbrainzngs.search_recordings(query=query, limit=len(mbids))
+        isrcMap: dict[str, list[str]] = {}
+        for recording in response.get("recording-list", []):
+            if recording["id"] in mbids:
+                isrcMap[recording["id"]] = recording.get("isrc-list", [])
+        return isrcMap
+
+    def get_isrcs(self, mbids) -> dict[str, list[str]]:
+        mbids = list(dict.fromkeys(m for m in mbids if m))
+        isrcMap = self.cache.get_many(mbids)
+        missing = [m for m in mbids if m not in isrcMap]
+
+        for i in range(0, len(missing), self.batchSize):
+            batch = missing[i : i + self.batchSize]
+            try:
+                found = self._search_isrcs(batch)
+            except musicbrainzngs.WebServiceError as e:
+                logger.error("Error resolving ISRCs from MusicBrainz %s", e)
+                continue
+            # cache misses too, recordings without ISRC won't grow one overnight
+            for mbid in batch:
+                found.setdefault(mbid, [])
+            self.cache.set_many(found)
+            isrcMap.update(found)
+        return isrcMap
+
+    def _resolve_local(self, candidates: list[CandidateTrack]) -> int:
+        """
+        Resolves candidates through the offline index, by mbid or by title and artist
+        """
+        resolved = 0
+        for c in candidates:
+            isrcs = self.index.by_mbid(c.mbid) if c.mbid else None
+            if isrcs is None:
+                found = self.index.lookup(c.title, c.artist)
+                if found is None:
+                    continue
+                c.mbid = c.mbid or found[0]
+                isrcs = found[1]
+            c.isrcs = isrcs
+            resolved += 1
+        return resolved
+
+    def resolve_candidates(self, candidates: list[CandidateTrack]):
+        """
+        Fills the isrcs (and missing recording mbids) of the candidates.
+        """
+        local = 0
+        pending = candidates
+        if self.index is not None:
+            try:
+                local = self._resolve_local(candidates)
+            except sqlite3.Error as e:
+                logger.error("Error querying the metadata index %s", e)
+            pending = [c for c in candidates if not c.isrcs]
+        if not self.offline:
+            isrcMap = self.get_isrcs(c.mbid for c in pending)
+            for c in pending:
+                c.isrcs = isrcMap.get(c.mbid, [])
+        logger.info(
+            "Resolved ISRCs for %d of %d candidates (%d from the offline index)",
+            sum(1 for c in candidates if c.isrcs),
+            len(candidates),
+            local,
+        )
@@ -0,0 +1,271 @@
+# pylint: disable=invalid-name,broad-exception-caught
+"""
+Offline recording metadata index.
+
+A local sqlite FTS5 index of recordings (mbid, title, artist credit, ISRCs) built from a
+MusicBrainz style JSON lines dump, one recording per line, plain or .gz/.bz2/.xz:
+
+    {"id": "...", "title": "...", "artist-credit": [{"name": "...", "joinphrase": ""}],
+     "isrcs": ["..."], "length": 215000}
+
+Imports stream the dump in batches and remember how far they got, so an interrupted
+import resumes and a newer dump only upserts. Candidates then resolve to recordings
+and ISRCs with a local query, no network needed.
+
+    uv run python -m api.metaindex import recordings.jsonl.xz
+"""
+
+import argparse
+import bz2
+import gzip
+import json
+import logging
+import lzma
+import os
+import re
+import sqlite3
+import threading
+from os import path
+
+logger = logging.getLogger("Runner")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS recordings (
+    id INTEGER PRIMARY KEY,
+    mbid TEXT NOT NULL UNIQUE,
+    title TEXT NOT NULL,
+    artist TEXT NOT NULL,
+    isrcs TEXT NOT NULL DEFAULT '[]',
+    length INTEGER
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS recordings_fts USING fts5 (
+    title, artist, content='recordings', content_rowid='id',
+    tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS recordings_ai AFTER INSERT ON recordings BEGIN
+    INSERT INTO recordings_fts (rowid, title, artist)
+    VALUES (new.id, new.title, new.artist);
+END;
+CREATE TRIGGER IF NOT EXISTS recordings_ad AFTER DELETE ON recordings BEGIN
+    INSERT INTO recordings_fts (recordings_fts, rowid, title, artist)
+    VALUES ('delete', old.id, old.title, old.artist);
+END;
+CREATE TRIGGER IF NOT EXISTS recordings_au AFTER UPDATE ON recordings BEGIN
+    INSERT INTO recordings_fts (recordings_fts, rowid, title, artist)
+    VALUES ('delete', old.id, old.title, old.artist);
+    INSERT INTO recordings_fts (rowid, title, artist)
+    VALUES (new.id, new.title, new.artist);
+END;
+CREATE TABLE IF NOT EXISTS imports (
+    source TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    offset INTEGER NOT NULL,
+    done INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+BATCH_SIZE = 5000
+_WORD = re.compile(r"\w+", re.UNICODE)
+# trailing (feat. x), [remastered], - live ... parts that differ between catalogues
+_DECORATION = re.compile(r"\s*[\(\[].*?[\)\]]|\s+-\s+.*$")
+
+
+def _open_dump(dumpPath):
+    if dumpPath.endswith(".gz"):
+        return gzip.open(dumpPath, "rb")
+    if dumpPath.endswith(".bz2"):
+        return bz2.open(dumpPath, "rb")
+    if dumpPath.endswith(".xz"):
+        return lzma.open(dumpPath, "rb")
+    return open(dumpPath, "rb")
+
+
+def _artist_credit(recording) -> str:
+    credits = recording.get("artist-credit")
+    if not credits:
+        return recording.get("artist", "")
+    return "".join(
+        (c.get("name") or c.get("artist", {}).get("name", "")) + c.get("joinphrase", "")
+        for c in credits
+    )
+
+
+def _normalize(text) -> str:
+    return " ".join(_WORD.findall(_DECORATION.sub("", text).casefold()))
+
+
+def _fts_terms(text) -> str:
+    # every word quoted, so user text can't inject FTS syntax
+    return " ".join(f'"{w}"' for w in _WORD.findall(text.casefold()))
+
+
+class MetaIndex:
+    def __init__(self, dbPath="data/metaindex.sqlite"):
+        self.dbPath = path.abspath(dbPath)
+        self._local = threading.local()
+        os.makedirs(path.dirname(self.dbPath), exist_ok=True)
+        with self._connect() as db:
+            db.executescript(SCHEMA)
+
+    def _connect(self):
+        return sqlite3.connect(self.dbPath, timeout=30)
+
+    @property
+    def _db(self):
+        # lookups run on the pipeline threads, one read connection each
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = self._local.db = self._connect()
+        return db
+
+    def import_dump(self, dumpPath, batchSize=BATCH_SIZE) -> int:
+        """
+        Streams a dump into the index, resuming where the last import of it stopped.
+        Returns the recordings written.
+        """
+        dumpPath = path.abspath(dumpPath)
+        stat = os.stat(dumpPath)
+        db = self._connect()
+        db.execute("PRAGMA journal_mode=WAL")
+        try:
+            row = db.execute(
+                "SELECT size, mtime, offset, done FROM imports WHERE source = ?",
+                (dumpPath,),
+            ).fetchone()
+            offset = 0
+            if row is not None and row[0] == stat.st_size and row[1] == stat.st_mtime:
+                if row[3]:
+                    logger.info("Dump %s already imported", dumpPath)
+                    return 0
+                offset = row[2]  # same dump, interrupted import
+            written = 0
+            with _open_dump(dumpPath) as dump:
+                position = 0
+                batch = []
+                for line in dump:
+                    position += len(line)
+                    if position <= offset:
+                        continue
+                    entry = self._parse(line)
+                    if entry is not None:
+                        batch.append(entry)
+                    if len(batch) >= batchSize:
+                        written += self._write(db, batch, dumpPath, stat, position)
+                        batch = []
+                written += self._write(db, batch, dumpPath, stat, position, done=True)
+            logger.info("Imported %d recordings from %s", written, dumpPath)
+            return written
+        finally:
+            db.close()
+
+    @staticmethod
+    def _parse(line):
+        try:
+            recording = json.loads(line)
+            return (
+                recording["id"],
+                recording["title"],
+                _artist_credit(recording),
+                json.dumps(recording.get("isrcs") or []),
+                recording.get("length"),
+            )
+        except (ValueError, KeyError, TypeError):
+            return None  # broken or foreign line, skipped
+
+    @staticmethod
+    def _write(db, batch, dumpPath, stat, position, done=False) -> int:
+        # the batch and the resume offset commit together
+        with db:
+            db.executemany(
+                "INSERT INTO recordings (mbid, title, artist, isrcs, length) "
+                "VALUES (?, ?, ?, ?, ?) ON CONFLICT(mbid) DO UPDATE SET "
+                "title = excluded.title, artist = excluded.artist, "
+                "isrcs = excluded.isrcs, length = excluded.length",
+                batch,
+            )
+            db.execute(
+                "INSERT OR REPLACE INTO imports (source, size, mtime, offset, done) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (dumpPath, stat.st_size, stat.st_mtime, position, int(done)),
+            )
+        return len(batch)
+
+    def by_mbid(self, mbid) -> list[str] | None:
+        row = self._db.execute(
+            "SELECT isrcs FROM recordings WHERE mbid = ?", (mbid,)
+        ).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def lookup(self, title, artist, limit=10) -> tuple[str, list[str]] | None:
+        """
+        Best recording for a title/artist pair as (mbid, isrcs), None without a confident match
+        """
+        wantedTitle, wantedArtist = _normalize(title), _normalize(artist)
+        # searched without decorations too, "- Remastered 2011" needn't be indexed
+        titleTerms, artistTerms = _fts_terms(wantedTitle), _fts_terms(wantedArtist)
+        if not titleTerms or not artistTerms:
+            return None
+        rows = self._db.execute(
+            "SELECT r.mbid, r.title, r.artist, r.isrcs FROM recordings_fts "
+            "JOIN recordings r ON r.id = recordings_fts.rowid "
+            "WHERE recordings_fts MATCH ? ORDER BY bm25(recordings_fts) LIMIT ?",
+            (f"title:({titleTerms}) AND artist:({artistTerms})", limit),
+        ).fetchall()
+        fallback = None
+        for mbid, foundTitle, foundArtist, isrcs in rows:
+            if _normalize(foundTitle) != wantedTitle:
+                continue
+            foundArtist = _normalize(foundArtist)
+            # credits differ in featured artists, one has to contain the other
+            if wantedArtist not in foundArtist and foundArtist not in wantedArtist:
+                continue
+            isrcList = json.loads(isrcs)
+            if isrcList:
+                return mbid, isrcList
+            fallback = fallback or (mbid, isrcList)
+        return fallback
+
+    def status(self) -> dict:
+        with self._connect() as db:
+            count = db.execute("SELECT COUNT(*) FROM recordings").fetchone()[0]
+            imports = [
+                {"source": r[0], "offset": r[1], "done": bool(r[2])}
+                for r in db.execute("SELECT source, offset, done FROM imports")
+            ]
+        return {"recordings": count, "imports": imports}
+
+
+_index: MetaIndex | None = None
+_indexLock = threading.Lock()
+
+
+def get_index(dbPath="data/metaindex.sqlite") -> MetaIndex | None:
+    """
+    Process wide index, None until something has been imported
+    """
+    global _index  # pylint: disable=global-statement
+    with _indexLock:
+        if _index is None and path.exists(path.abspath(dbPath)):
+            _index = MetaIndex(dbPath)
+        return _index
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline metadata index")
+    commands = parser.add_subparsers(dest="command", required=True)
+    importParser = commands.add_parser("import", help="import a JSON lines dump")
+    importParser.add_argument("dump")
+    importParser.add_argument("--index", default="data/metaindex.sqlite")
+    lookupParser = commands.add_parser("lookup", help="resolve a title and artist")
+    lookupParser.add_argument("title")
+    lookupParser.add_argument("artist")
+    lookupParser.add_argument("--index", default="data/metaindex.sqlite")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    index = MetaIndex(args.index)
+    if args.command == "import":
+        index.import_dump(args.dump)
+    else:
+        print(index.lookup(args.title, args.artist))
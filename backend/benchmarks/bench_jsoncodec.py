@@ -0,0 +1,81 @@
+# pylint: disable=invalid-name
+"""
+Benchmark for the JSON codec backends.
+
+Run from the backend folder:
+    python benchmarks/bench_jsoncodec.py
+"""
+
+import base64
+import os
+import sys
+import timeit
+from os import path
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+from utils import jsoncodec  # noqa: E402 pylint: disable=wrong-import-position
+
+
+def search_response(items=50):
+    artist = {"id": 1, "name": "Some Artist", "picture": "a-b-c-d", "type": "MAIN"}
+    item = {
+        "id": 123456,
+        "title": "Some Track (Remastered)",
+        "duration": 245,
+        "replayGain": -7.2,
+        "trackNumber": 3,
+        "volumeNumber": 1,
+        "popularity": 42,
+        "copyright": "(P) 2024 Some Label",
+        "url": "http://www.tidal.com/track/123456",
+        "isrc": "USABC1234567",
+        "explicit": False,
+        "audioQuality": "LOSSLESS",
+        "artist": artist,
+        "artists": [artist, artist],
+        "album": {"id": 654321, "title": "Some Album", "cover": "e-f-g-h"},
+    }
+    return {"version": "2.0", "data": {"limit": items, "items": [item] * items}}
+
+
+def report(tracks=15, artworkSize=200_000):
+    artwork = base64.b64encode(os.urandom(artworkSize)).decode()
+    track = {
+        "title": ["Some Track"],
+        "artist": ["Some Artist"],
+        "album": ["Some Album"],
+        "LENGTH": 245.3,
+        "ARTWORK": artwork,
+    }
+    return {
+        "name": "weekly",
+        "runnedAt": "2026-01-01 05:00:00.000000",
+        "blueprint": {"name": "weekly", "prompt": "artist:(Some Artist)"},
+        "tracklist": [track] * tracks,
+    }
+
+
+def bench(label, func, number):
+    best = min(timeit.repeat(func, number=number, repeat=5)) / number
+    print(f"  {label:<28} {best * 1e3:9.3f} ms")
+
+
+def main():
+    searchObj = search_response()
+    reportObj = report()
+    print(f"search response: {len(jsoncodec.dumps(searchObj)) / 1024:.1f} KiB")
+    print(f"report: {len(jsoncodec.dumps(reportObj)) / 1024 / 1024:.1f} MiB")
+
+    for name in jsoncodec.CODECS:
+        jsoncodec.set_codec(name)
+        searchRaw = jsoncodec.dumps(searchObj)
+        reportRaw = jsoncodec.dumps(reportObj)
+        print(f"\n{name}:")
+        bench("decode search response", lambda: jsoncodec.loads(searchRaw), 500)
+        bench("encode report", lambda: jsoncodec.dumps(reportObj), 20)
+        bench("decode report", lambda: jsoncodec.loads(reportRaw), 20)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+# pylint: disable=invalid-name
+"""
+Download bandwidth scheduling and blueprint quality policies.
+
+Every downloaded chunk takes tokens from a process wide bucket refilled at the current
+limit: the global one or the one of the time window we're in (ex. lower during the day).
+Blueprints pick a max quality and may fall back down the ladder when the bucket is
+throttling hard or the provider byte budget is tight.
+"""
+
+import collections
+import datetime
+import threading
+import time
+
+# hifi qualities, best first, HI_RES_LOSSLESS only comes as DASH and isn't supported
+QUALITY_LADDER = ("LOSSLESS", "HIGH", "LOW")
+
+DEFAULTS = {
+    "limit": 0,  # bytes per second, 0 is unlimited
+    "burst": 1024 * 1024,  # bytes that can go at once after an idle period
+    "windows": [],  # [{"from": "08:00", "to": "20:00", "limit": 1500000}]
+    "congestion": 0.3,  # share of time spent throttled that counts as pressure
+}
+
+# seconds of throttling history looked at for congestion
+CONGESTION_SPAN = 60
+
+
+def _minutes(hhmm) -> int:
+    hours, minutes = hhmm.split(":")
+    return int(hours) * 60 + int(minutes)
+
+
+class BandwidthScheduler:
+    def __init__(self):
+        self.settings = dict(DEFAULTS)
+        self.tokens = float(DEFAULTS["burst"])
+        self.updatedAt = time.monotonic()
+        self._waits: collections.deque = collections.deque()
+        self._lock = threading.Lock()
+
+    def configure(self, bandwidthConfig):
+        with self._lock:
+            self.settings = {**DEFAULTS, **bandwidthConfig}
+            self.tokens = float(self.settings["burst"])
+
+    def current_limit(self, now=None) -> int:
+        """
+        Bytes per second allowed right now, 0 for unlimited
+        """
+        now = now or datetime.datetime.now()
+        minute = now.hour * 60 + now.minute
+        for window in self.settings["windows"]:
+            start, end = _minutes(window["from"]), _minutes(window["to"])
+            # windows can wrap around midnight, ex. 22:00 - 06:00
+            inside = (
+                start <= minute < end if start <= end else not end <= minute < start
+            )
+            if inside:
+                return window["limit"]
+        return self.settings["limit"]
+
+    def consume(self, nbytes):
+        """
+        Blocks until nbytes fit in the current limit
+        """
+        limit = self.current_limit()
+        if not limit:
+            return
+        with self._lock:
+            now = time.monotonic()
+            burst = max(self.settings["burst"], nbytes)
+            self.tokens = min(self.tokens + (now - self.updatedAt) * limit, burst)
+            self.updatedAt = now
+            self.tokens -= nbytes
+            # a negative balance is paid back by waiting, later callers queue behind it
+            wait = -self.tokens / limit if self.tokens < 0 else 0.0
+            if wait:
+                self._waits.append((now, wait))
+        if wait:
+            time.sleep(wait)
+
+    def congested(self) -> bool:
+        """
+        True when downloads spent more than the congestion share of the last minute throttled
+        """
+        with self._lock:
+            now = time.monotonic()
+            while self._waits and self._waits[0][0] < now - CONGESTION_SPAN:
+                self._waits.popleft()
+            waited = sum(w for _, w in self._waits)
+        return waited > CONGESTION_SPAN * self.settings["congestion"]
+
+    def status(self) -> dict:
+        return {
+            "limit": self.current_limit(),
+            "congested": self.congested(),
+            **self.settings,
+        }
+
+
+bandwidth = BandwidthScheduler()
+
+
+def quality_ladder(playlistEntry, trackQuality=None, pressure=False) -> list[str]:
+    """
+    Qualities to request for a track, best first.
+    Starts at the lowest of the blueprint max and what the track offers,
+    one step lower under pressure when the blueprint allows fallback.
+    """
+    maxQuality = playlistEntry.get("quality", "LOSSLESS")
+    start = QUALITY_LADDER.index(maxQuality) if maxQuality in QUALITY_LADDER else 0
+    if trackQuality in QUALITY_LADDER:
+        start = max(start, QUALITY_LADDER.index(trackQuality))
+    if not playlistEntry.get("qualityFallback", True):
+        return [QUALITY_LADDER[start]]
+    if pressure:
+        start = min(start + 1, len(QUALITY_LADDER) - 1)
+    return list(QUALITY_LADDER[start:])
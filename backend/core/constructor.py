@@ -1,3 +1,10 @@
+# pylint: disable=invalid-name
+"""
+Shared decoders building the slot models straight from provider responses
+"""
+
+from utils import jsoncodec
+from utils.utils import json_from_base64
 from models.models import (
     TrackItemSlot,
     ArtistSubSlot,
@@ -8,6 +15,15 @@ from models.models import (
 )
 
 
+def decode_json(raw):
+    """
+    Decodes a response body, accepts bytes or an already decoded object.
+    """
+    if isinstance(raw, (bytes, bytearray, memoryview, str)):
+        return jsoncodec.loads(raw)
+    return raw
+
+
 def _artist_subslot(artistItem):
     return ArtistSubSlot(
         id=artistItem["id"], name=artistItem["name"], picture=artistItem["picture"]
@@ -20,6 +36,11 @@ def _album_subslot(albumItem):
     )
 
 
+def _artists_builder(artistItems):
+    # artists are only needed for matched tracks and fallback matching, built on first access
+    return lambda: [_artist_subslot(i) for i in artistItems]
+
+
 def TrackSlotFromResponseItem(responseItem) -> TrackItemSlot:
     return TrackItemSlot(
         id=responseItem["id"],
@@ -35,7 +56,7 @@ def TrackSlotFromResponseItem(responseItem) -> TrackItemSlot:
         explicit=responseItem["explicit"],
         audioQuality=responseItem["audioQuality"],
         artist=_artist_subslot(responseItem["artist"]),
-        artists=[_artist_subslot(i) for i in responseItem["artists"]],
+        artists=_artists_builder(responseItem["artists"]),
         album=_album_subslot(responseItem["album"]),
     )
 
@@ -56,11 +77,12 @@ def AlbumSlotFromResponseData(responseData) -> AlbumItemSlot:
         explicit=responseData["explicit"],
         audioQuality=responseData["audioQuality"],
         artist=_artist_subslot(responseData["artist"]),
-        artists=[_artist_subslot(i) for i in responseData["artists"]],
+        artists=_artists_builder(responseData["artists"]),
     )
 
 
 def TrackInfoSlotFromResponseData(responseData) -> TrackInfoSlot:
+    decodedManifest = json_from_base64(responseData["manifest"])
     return TrackInfoSlot(
         trackId=responseData["trackId"],
         trackReplayGain=responseData["trackReplayGain"],
@@ -68,6 +90,62 @@ def TrackInfoSlotFromResponseData(responseData) -> TrackInfoSlot:
         bitDepth=responseData["bitDepth"],
         sampleRate=responseData["sampleRate"],
         manifest=responseData["manifest"],
+        codec=decodedManifest["codecs"],
+        url=decodedManifest["urls"][0],
+    )
+
+
+## hifi responses ##
+def TrackSlotsFromSearchResponse(raw) -> list[TrackItemSlot]:
+    response = decode_json(raw)
+    return [TrackSlotFromResponseItem(i) for i in response["data"]["items"]]
+
+
+def AlbumSlotFromResponse(raw) -> AlbumItemSlot:
+    return AlbumSlotFromResponseData(decode_json(raw)["data"])
+
+
+def TrackInfoSlotFromResponse(raw) -> TrackInfoSlot:
+    return TrackInfoSlotFromResponseData(decode_json(raw)["data"])
+
+
+## yt-dlp info dicts ##
+def _scl_artist_subslot(artistName):
+    return ArtistSubSlot(id="", name=artistName, picture="")
+
+
+def _scl_album_title(infoItem):
+    if infoItem.get("album") is not None:
+        return infoItem["album"]
+    if infoItem.get("playlist") is not None:
+        return infoItem["playlist"]
+    return infoItem.get("genre")
+
+
+def SclTrackInfoSlotFromInfo(infoItem) -> TrackInfoSlot:
+    return TrackInfoSlot(
+        trackId=infoItem["id"],
+        codec="mp3",  # hardcoded because is hardcoded in postprocessor so the final files will be mp3
+        url=infoItem["url"],
+    )
+
+
+def SclTrackSlotFromInfo(infoItem, url) -> TrackItemSlot:
+    artistList = infoItem.get("artists") or []
+    if artistList:
+        artistName = artistList[0]
+    else:
+        artistName = infoItem.get("artist") or "unknown"
+    return TrackItemSlot(
+        id=infoItem["id"],
+        title=infoItem["title"],
+        duration=infoItem["duration"],
+        url=url,
+        artist=_scl_artist_subslot(artistName),
+        artists=[_scl_artist_subslot(i) for i in artistList or [artistName]],
+        album=AlbumSubSlot(id="", title=_scl_album_title(infoItem), cover=""),
+        thumbnail=infoItem["thumbnail"],
+        trackinfoslot=SclTrackInfoSlotFromInfo(infoItem),
     )
 
 
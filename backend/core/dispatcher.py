@@ -0,0 +1,208 @@
+# pylint: disable=invalid-name,broad-exception-caught
+"""
+Run dispatcher between APScheduler and fetch.
+
+Scheduled jobs only submit here, runs are then started by priority with a random
+jitter, a minimum stagger between starts on the same provider and a per provider
+concurrency limit, so a burst of due jobs gets spread out instead of hitting the
+mirrors all at once.
+"""
+
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+
+logger = logging.getLogger("Terabithia")
+
+
+class _Entry:
+    __slots__ = ("name", "provider", "priority", "readyAt")
+
+    def __init__(self, name, provider, priority, readyAt):
+        self.name = name
+        self.provider = provider
+        self.priority = priority
+        self.readyAt = readyAt
+
+
+class Dispatcher:
+    """
+    config keys (all optional):
+        workers: max runs executing at the same time
+        jitter: max random delay in seconds added to every submitted run
+        stagger: min seconds between two run starts on the same provider
+        providerConcurrency: {"hifi": 1, "scl": 1} max concurrent runs per provider
+
+    admit: optional callable(name) returning seconds a ready run has to wait, ex. for quota
+    """
+
+    def __init__(self, runner, config=None, admit=None):
+        config = config or {}
+        self.runner = runner
+        self.admit = admit
+        self.workers = config.get("workers", 2)
+        self.jitter = config.get("jitter", 0)
+        self.stagger = config.get("stagger", 0)
+        self.providerConcurrency = config.get("providerConcurrency", {})
+        self.defaultConcurrency = config.get("defaultConcurrency", 1)
+
+        self._cond = threading.Condition()
+        self._heap: list = []
+        self._seq = itertools.count()
+        self._queued: dict[str, _Entry] = {}
+        self._running: dict[str, str] = {}  # name -> provider
+        self._admitting: set[str] = (
+            set()
+        )  # names being checked by admit, outside the lock
+        self._lastStart: dict[str, float] = {}
+        self._threads: list[threading.Thread] = []
+        self._stopped = False
+
+    def start(self):
+        for n in range(self.workers):
+            t = threading.Thread(target=self._work, name=f"dispatcher-{n}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+
+    def submit(self, name, provider, priority=0, delay=0.0) -> bool:
+        """
+        Queues a run, higher priority runs start first.
+        A run already queued or executing is coalesced and returns False.
+        """
+        with self._cond:
+            if name in self._queued or name in self._running:
+                logger.info("Run %s already queued or running, coalesced", name)
+                return False
+            readyAt = time.time() + delay + random.uniform(0, self.jitter)
+            entry = _Entry(name, provider, priority, readyAt)
+            self._queued[name] = entry
+            heapq.heappush(self._heap, (-priority, readyAt, next(self._seq), entry))
+            self._cond.notify_all()
+        logger.info(
+            "Run %s queued, priority %s, starting in %.0fs",
+            name,
+            priority,
+            readyAt - time.time(),
+        )
+        return True
+
+    def _limit(self, provider):
+        return self.providerConcurrency.get(provider, self.defaultConcurrency)
+
+    def _startable_at(self, entry: _Entry, now) -> float | None:
+        """
+        Returns when the entry may start, None if its provider is at its limit.
+        """
+        busy = sum(1 for p in self._running.values() if p == entry.provider)
+        if busy >= self._limit(entry.provider):
+            return None
+        return max(entry.readyAt, self._lastStart.get(entry.provider, 0) + self.stagger)
+
+    def _pick(self, now):
+        """
+        Returns (first heap item startable now or None, when to look again)
+        """
+        wakeAt = None
+        # heap order is priority first, the first startable entry wins
+        for item in sorted(self._heap):
+            entry = item[3]
+            if entry.name in self._admitting:
+                continue
+            startAt = self._startable_at(entry, now)
+            if startAt is None:
+                continue
+            if startAt <= now:
+                return item, None
+            wakeAt = startAt if wakeAt is None else min(wakeAt, startAt)
+        return None, wakeAt
+
+    def _start(self, item, now) -> _Entry:
+        entry = item[3]
+        self._heap.remove(item)
+        heapq.heapify(self._heap)
+        del self._queued[entry.name]
+        self._running[entry.name] = entry.provider
+        self._lastStart[entry.provider] = now
+        return entry
+
+    def _next(self) -> _Entry | None:
+        while True:
+            with self._cond:
+                item = None
+                while not self._stopped:
+                    now = time.time()
+                    item, wakeAt = self._pick(now)
+                    if item is not None:
+                        break
+                    self._cond.wait(None if wakeAt is None else wakeAt - now)
+                if self._stopped:
+                    return None
+                if self.admit is None:
+                    return self._start(item, now)
+                entry = item[3]
+                self._admitting.add(entry.name)
+
+            # the admission check does sqlite and file I/O, submit and status don't wait for it
+            try:
+                deferFor = self.admit(entry.name)
+            except Exception as e:
+                logger.error("Error admitting run %s: %s", entry.name, e, exc_info=True)
+                deferFor = 0
+
+            with self._cond:
+                self._admitting.discard(entry.name)
+                now = time.time()
+                if deferFor > 0:
+                    # re-queued under its new start time, heap order and status stay true
+                    self._heap.remove(item)
+                    heapq.heapify(self._heap)
+                    entry.readyAt = now + deferFor
+                    heapq.heappush(
+                        self._heap,
+                        (item[0], entry.readyAt, next(self._seq), entry),
+                    )
+                    self._cond.notify_all()
+                    continue
+                # another worker may have filled the provider meanwhile
+                startAt = self._startable_at(entry, now)
+                if startAt is not None and startAt <= now:
+                    return self._start(item, now)
+                self._cond.notify_all()
+
+    def _work(self):
+        while True:
+            entry = self._next()
+            if entry is None:
+                return
+            try:
+                logger.info("Dispatching run %s", entry.name)
+                self.runner(entry.name)
+            except Exception as e:
+                logger.error("Error in run %s: %s", entry.name, e, exc_info=True)
+            finally:
+                with self._cond:
+                    self._running.pop(entry.name, None)
+                    self._cond.notify_all()
+
+    def status(self) -> dict:
+        with self._cond:
+            return {
+                "running": dict(self._running),
+                "queued": [
+                    {
+                        "name": item[3].name,
+                        "provider": item[3].provider,
+                        "priority": item[3].priority,
+                        "readyAt": item[3].readyAt,
+                    }
+                    for item in sorted(self._heap)
+                ],
+            }
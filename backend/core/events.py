@@ -0,0 +1,149 @@
+# pylint: disable=invalid-name
+"""
+In-process run progress events, pushed to the SSE endpoint subscribers.
+"""
+
+import asyncio
+import threading
+import time
+
+# events that end a run
+FINAL_EVENTS = ("done", "failed")
+# events counted in the run state
+COUNTED_EVENTS = ("matched", "unmatched", "tagged", "track")
+
+
+class EventBus:
+    """
+    Fan-out of run events from worker threads to asyncio subscribers.
+
+    Every published event is folded into a per run summary (counters, current download),
+    subscribers receive the summary with the event fields under "detail".
+
+    The latest state of every run is kept, so a client connecting mid-run
+    gets a snapshot before the live events.
+    """
+
+    def __init__(self, keepFinished=20, subscriberSize=1000):
+        self.keepFinished = keepFinished
+        self.subscriberSize = subscriberSize
+        self._lock = threading.Lock()
+        self._subscribers: list[tuple[asyncio.AbstractEventLoop, asyncio.Queue]] = []
+        self._runs: dict[str, dict] = {}
+        # queue-like, when set events are sent there instead (run processes -> parent bus)
+        self.forward = None
+
+    def publish(self, run, event, **data):
+        if self.forward is not None:
+            self.forward.put((run, event, data))
+            return
+        entry = {"run": run, "event": event, "time": time.time(), **data}
+        with self._lock:
+            state = self._runs.setdefault(run, {"run": run})
+            self._fold(state, entry)
+            # subscribers get the updated run summary plus the event details
+            entry = {**state, "detail": data}
+            self._trim()
+            subscribers = list(self._subscribers)
+        for loop, q in subscribers:
+            try:
+                loop.call_soon_threadsafe(self._offer, q, entry)
+            except RuntimeError:  # loop closed, client is gone
+                self.unsubscribe(q)
+
+    @staticmethod
+    def _fold(state, entry):
+        # run state is a summary, counters plus the track being downloaded
+        event = entry["event"]
+        state["event"] = event
+        state["time"] = entry["time"]
+        if "name" in entry:
+            state["name"] = entry["name"]
+        if event in COUNTED_EVENTS:
+            state[event] = state.get(event, 0) + 1
+        match event:
+            case "started":
+                state["startedAt"] = entry["time"]
+            case "candidates":
+                state["candidates"] = entry["count"]
+            case "downloading":
+                state["current"] = {
+                    k: entry[k]
+                    for k in ("idx", "title", "bytes", "total", "rate")
+                    if k in entry
+                }
+            case "failed":
+                state["error"] = entry.get("error", "")
+        if event in FINAL_EVENTS:
+            state.pop("current", None)
+
+    @staticmethod
+    def _offer(q: asyncio.Queue, entry):
+        try:
+            q.put_nowait(entry)
+        except asyncio.QueueFull:
+            pass  # slow client, drop rather than block runs
+
+    def _trim(self):
+        finished = [r for r, s in self._runs.items() if s["event"] in FINAL_EVENTS]
+        for r in finished[: max(0, len(finished) - self.keepFinished)]:
+            del self._runs[r]
+
+    def subscribe(self) -> asyncio.Queue:
+        """
+        Must be called from the event loop that will consume the queue.
+        """
+        q: asyncio.Queue = asyncio.Queue(self.subscriberSize)
+        with self._lock:
+            self._subscribers.append((asyncio.get_running_loop(), q))
+        return q
+
+    def unsubscribe(self, q):
+        with self._lock:
+            self._subscribers = [s for s in self._subscribers if s[1] is not q]
+
+    def snapshot(self) -> list[dict]:
+        with self._lock:
+            return [dict(s) for s in self._runs.values()]
+
+
+class RunProgress:
+    """
+    Event publisher bound to a single run.
+    """
+
+    def __init__(self, name, eventBus=None):
+        self.name = name
+        self.run = f"{name}-{int(time.time())}"
+        self.bus = eventBus or bus
+
+    def emit(self, event, **data):
+        self.bus.publish(self.run, event, name=self.name, **data)
+
+    def download_callback(self, idx, title, interval=0.5):
+        """
+        Returns a progress(done, total) callback emitting throttled "downloading" events.
+        """
+        started = time.monotonic()
+        last = [0.0]
+
+        def progress(done, total):
+            now = time.monotonic()
+            if now - last[0] < interval and done != total:
+                return
+            last[0] = now
+            elapsed = max(now - started, 1e-6)
+            self.emit(
+                "downloading",
+                idx=idx,
+                title=title,
+                bytes=done,
+                total=total,
+                rate=int(done / elapsed),
+            )
+
+        return progress
+
+
+# shared by every run in the process
+bus = EventBus()
@@ -0,0 +1,121 @@
+# pylint: disable=invalid-name
+"""
+Quantity aware candidate feeding.
+
+Candidates are fed to the run pipeline in batches sized from the expected match rate,
+the next batch only goes out once the previous one is matched, so a run stops searching
+as soon as it holds quantity tracks instead of walking the whole radio.
+"""
+
+import math
+import threading
+
+# observed matches needed before the run's own rate replaces the historical one
+MIN_OBSERVED = 5
+MIN_RATE = 0.05
+
+
+class CandidateFeeder:
+    """
+    Iterating yields (idx, candidate), the stages report back with
+    matched(), accept(), drop() and done() so the feeder knows how many tracks are still needed.
+    """
+
+    def __init__(
+        self, candidates, quantity, matchRate=0.5, overfetch=1.25, onBatch=None
+    ):
+        self.candidates = candidates
+        self.quantity = quantity
+        self.matchRate = matchRate
+        self.overfetch = overfetch
+        # called with every batch before it's fed, ex. to resolve ISRCs
+        self.onBatch = onBatch
+        self.tried = 0
+        self.hits = 0
+        self._accepted = 0
+        self._settled = 0
+        self._finished = 0
+        self._state: dict[int, str] = {}
+        self._cond = threading.Condition()
+
+    def rate(self) -> float:
+        with self._cond:
+            if self.tried >= MIN_OBSERVED:
+                return max(self.hits / self.tried, MIN_RATE)
+        return max(self.matchRate, MIN_RATE)
+
+    def matched(self, hit: bool):
+        with self._cond:
+            self.tried += 1
+            self.hits += int(hit)
+
+    @property
+    def full(self) -> bool:
+        with self._cond:
+            return self._accepted >= self.quantity
+
+    def accept(self, idx) -> bool:
+        """
+        Reserves a playlist slot for a matched track, False once quantity slots are taken.
+        """
+        with self._cond:
+            if self._accepted >= self.quantity:
+                self._leave(idx, "dropped")
+                return False
+            self._accepted += 1
+            self._state[idx] = "accepted"
+            self._settled += 1
+            self._cond.notify_all()
+            return True
+
+    def drop(self, idx):
+        """
+        The candidate left the run without a track, an accepted one frees its slot.
+        """
+        with self._cond:
+            self._leave(idx, "dropped")
+
+    def done(self, idx):
+        """
+        The track is in the playlist.
+        """
+        with self._cond:
+            self._leave(idx, "done")
+
+    def _leave(self, idx, state):
+        previous = self._state.get(idx)
+        if previous in ("done", "dropped"):
+            return
+        if previous == "accepted":
+            if state == "dropped":
+                self._accepted -= 1
+        else:
+            self._settled += 1
+        self._finished += 1
+        self._state[idx] = state
+        self._cond.notify_all()
+
+    def _batch_size(self, need, remaining) -> int:
+        return max(1, min(math.ceil(need / self.rate() * self.overfetch), remaining))
+
+    def __iter__(self):
+        fed = 0
+        while fed < len(self.candidates):
+            with self._cond:
+                self._cond.wait_for(lambda: self._settled >= fed)
+                if self._accepted >= self.quantity:
+                    # accepted tracks can still fail, wait for them before giving up on the rest
+                    self._cond.wait_for(lambda: self._finished >= fed)
+                need = self.quantity - self._accepted
+            if need <= 0:
+                return
+            size = self._batch_size(need, len(self.candidates) - fed)
+            batch = self.candidates[fed : fed + size]
+            if self.onBatch is not None:
+                self.onBatch(batch)
+            with self._cond:
+                for offset in range(size):
+                    self._state[fed + offset] = "fed"
+            for offset, candidate in enumerate(batch):
+                yield fed + offset, candidate
+            fed += size
@@ -0,0 +1,164 @@
+# pylint: disable=invalid-name,broad-exception-caught
+"""
+Hedged requests across mirrors.
+
+When the primary mirror hasn't answered within a latency percentile, a duplicate
+request goes to the next mirror and the first good response wins. Hedges are capped
+to a fraction of the requests so slow periods don't double the load on every mirror.
+"""
+
+import collections
+import concurrent.futures
+import logging
+import threading
+import time
+
+logger = logging.getLogger("Runner")
+
+DEFAULTS = {
+    "enabled": False,
+    "percentile": 0.9,  # hedge after this latency percentile of recent requests
+    "minDelay": 0.2,
+    "maxDelay": 10.0,
+    "initialDelay": 2.0,  # until enough latencies are known
+    "budget": 0.1,  # hedges allowed per request
+    "window": 200,  # latencies kept
+}
+MIN_SAMPLES = 20
+
+
+class Hedger:
+    def __init__(self, maxWorkers=8):
+        self.settings = dict(DEFAULTS)
+        self.latencies: collections.deque = collections.deque(maxlen=DEFAULTS["window"])
+        self.tokens = 0.0
+        self.counters = {
+            "requests": 0,
+            "hedged": 0,
+            "hedgeWins": 0,
+            "budgetDenied": 0,
+            "failovers": 0,
+        }
+        self._lock = threading.Lock()
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            maxWorkers, thread_name_prefix="hedge"
+        )
+
+    def configure(self, hedgeConfig):
+        with self._lock:
+            self.settings = {**DEFAULTS, **hedgeConfig}
+            self.latencies = collections.deque(
+                self.latencies, maxlen=self.settings["window"]
+            )
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.settings["enabled"])
+
+    def delay(self) -> float:
+        s = self.settings
+        with self._lock:
+            if len(self.latencies) < MIN_SAMPLES:
+                return s["initialDelay"]
+            ordered = sorted(self.latencies)
+        value = ordered[min(int(len(ordered) * s["percentile"]), len(ordered) - 1)]
+        return min(max(value, s["minDelay"]), s["maxDelay"])
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def _take_budget(self) -> bool:
+        with self._lock:
+            if self.tokens >= 1:
+                self.tokens -= 1
+                self.counters["hedged"] += 1
+                return True
+            self.counters["budgetDenied"] += 1
+            return False
+
+    def _timed(self, attempt, sent: threading.Event):
+        # the attempt calls mark once its request is on the wire, pacing waits
+        # before that are neither latency nor hedge delay
+        sentAt: list[float] = []
+
+        def mark():
+            sentAt.append(time.monotonic())
+            sent.set()
+
+        try:
+            result = attempt(mark)
+        finally:
+            sent.set()
+        if sentAt:
+            with self._lock:
+                self.latencies.append(time.monotonic() - sentAt[0])
+        return result
+
+    def run(self, attempts):
+        """
+        Runs the attempts (callables taking a sent callback, best mirror first)
+        until one returns, a failed attempt starts the next one right away,
+        a slow one gets one hedge once its request has been sent.
+        """
+        with self._lock:
+            self.counters["requests"] += 1
+            # the budget refills with every request, a few hedges can be saved up
+            self.tokens = min(self.tokens + self.settings["budget"], 5.0)
+        remaining = iter(attempts)
+        running: dict[concurrent.futures.Future, bool] = {}
+        hedgeAvailable = True
+
+        def launch(hedge) -> threading.Event | None:
+            attempt = next(remaining, None)
+            if attempt is None:
+                return None
+            sent = threading.Event()
+            running[self._executor.submit(self._timed, attempt, sent)] = hedge
+            return sent
+
+        primarySent = launch(False)
+        lastError: BaseException | None = None
+        while running:
+            timeout = None
+            if hedgeAvailable:
+                # the hedge delay starts once the primary is sent, not while it's paced
+                primarySent.wait()
+                timeout = self.delay()
+            done, _ = concurrent.futures.wait(
+                running,
+                timeout=timeout,
+                return_when=concurrent.futures.FIRST_COMPLETED,
+            )
+            if not done:
+                # primary is slow, one duplicate to the next mirror if the budget allows
+                hedgeAvailable = False
+                if self._take_budget():
+                    launch(True)
+                continue
+            for future in done:
+                hedge = running.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    lastError = e
+                    continue
+                if hedge:
+                    self._count("hedgeWins")
+                for other in running:
+                    other.cancel()  # the other response is dropped once it lands
+                return result
+            if not running:
+                primarySent = launch(False)
+                if primarySent is None:
+                    break
+                self._count("failovers")
+        raise ConnectionError("Every mirror failed") from lastError
+
+    def status(self) -> dict:
+        with self._lock:
+            counters = dict(self.counters)
+        return {**counters, "delay": round(self.delay(), 3), **self.settings}
+
+
+hedger = Hedger()
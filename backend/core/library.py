@@ -0,0 +1,332 @@
+# pylint: disable=invalid-name,broad-exception-caught
+"""
+Library index and retention.
+
+Every run records which files its playlist references, so the index knows when a track
+was last referenced and by which playlists. Under a disk quota the retention pass evicts
+the least recently referenced tracks that aren't pinned, prunes the emptied directories
+and drops the evicted entries from the playlists still pointing at them.
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+from os import path
+
+from utils.utils import write_atomic
+
+logger = logging.getLogger("Terabithia")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tracks (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL DEFAULT 0,
+    addedAt REAL NOT NULL,
+    lastReferencedAt REAL NOT NULL,
+    pinned INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS tracks_lru ON tracks (pinned, lastReferencedAt);
+CREATE TABLE IF NOT EXISTS refs (
+    path TEXT NOT NULL,
+    playlist TEXT NOT NULL,
+    run TEXT,
+    referencedAt REAL NOT NULL,
+    PRIMARY KEY (path, playlist)
+);
+CREATE INDEX IF NOT EXISTS refs_playlist ON refs (playlist);
+CREATE TABLE IF NOT EXISTS pinned_playlists (
+    playlist TEXT PRIMARY KEY
+);
+"""
+
+DEFAULTS = {
+    "path": "data/library.sqlite",
+    "enabled": False,
+    "maxBytes": 200 * 1024**3,  # disk quota of output/music
+    "lowWater": 0.9,  # evict down to this share of maxBytes
+    "minAge": 7,  # days, tracks referenced more recently are never evicted
+    "interval": 6,  # hours between retention passes
+}
+
+OUTPUT_DIR = "output"
+PLAYLIST_DIR = "output/playlists"
+
+
+class LibraryIndex:
+    def __init__(self):
+        self.settings = dict(DEFAULTS)
+        self.dbPath = None
+        self._lock = threading.Lock()  # one retention pass at a time
+
+    def configure(self, retentionConfig):
+        self.settings = {**DEFAULTS, **retentionConfig}
+        self.dbPath = path.abspath(self.settings["path"])
+        os.makedirs(path.dirname(self.dbPath), exist_ok=True)
+        with self._connect() as db:
+            db.executescript(SCHEMA)
+
+    def _connect(self):
+        db = sqlite3.connect(self.dbPath, timeout=30, isolation_level=None)
+        db.execute("PRAGMA journal_mode=WAL")
+        return db
+
+    @staticmethod
+    def _size(relPath) -> int:
+        try:
+            return path.getsize(path.join(path.abspath(OUTPUT_DIR), relPath))
+        except OSError:
+            return 0
+
+    def record_playlist(self, playlist, relPaths, run=None, pinned=False, now=None):
+        """
+        Replaces the references of a playlist with relPaths (relative to output/)
+        """
+        if self.dbPath is None:
+            return
+        now = now or time.time()
+        rows = [(p, self._size(p), now) for p in relPaths]
+        with self._connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            db.execute("DELETE FROM refs WHERE playlist = ?", (playlist,))
+            db.executemany(
+                "INSERT INTO tracks (path, size, addedAt, lastReferencedAt) "
+                "VALUES (?, ?, ?, ?) ON CONFLICT(path) DO UPDATE SET "
+                "size = excluded.size, lastReferencedAt = excluded.lastReferencedAt",
+                [(p, size, at, at) for p, size, at in rows],
+            )
+            db.executemany(
+                "INSERT OR REPLACE INTO refs (path, playlist, run, referencedAt) "
+                "VALUES (?, ?, ?, ?)",
+                [(p, playlist, run, now) for p in relPaths],
+            )
+            if pinned:
+                db.execute(
+                    "INSERT OR IGNORE INTO pinned_playlists (playlist) VALUES (?)",
+                    (playlist,),
+                )
+            else:
+                db.execute(
+                    "DELETE FROM pinned_playlists WHERE playlist = ?", (playlist,)
+                )
+            db.execute("COMMIT")
+
+    def pin(self, relPath, pinned=True) -> bool:
+        with self._connect() as db:
+            cursor = db.execute(
+                "UPDATE tracks SET pinned = ? WHERE path = ?", (int(pinned), relPath)
+            )
+            return cursor.rowcount == 1
+
+    def contains(self, relPath) -> bool:
+        if self.dbPath is None:
+            return False
+        with self._connect() as db:
+            return (
+                db.execute("SELECT 1 FROM tracks WHERE path = ?", (relPath,)).fetchone()
+                is not None
+            )
+
+    def find(self, artist, title) -> str | None:
+        """
+        Path of an indexed track by artist and title, in any album and format
+        """
+        if self.dbPath is None:
+            return None
+        # same sanitizing as the runner file names, LIKE wildcards escaped
+        fileTitle = "".join(x for x in title if (x.isalnum() or x in "._- "))
+        artistDir, fileName = (
+            p.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            for p in (f"music/{artist}", f"{fileTitle} - {artist}.")
+        )
+        pattern = f"{artistDir}/%/{fileName}%"
+        with self._connect() as db:
+            row = db.execute(
+                "SELECT path FROM tracks WHERE path LIKE ? ESCAPE '\\' LIMIT 1",
+                (pattern,),
+            ).fetchone()
+        return row[0] if row else None
+
+    def scan(self):
+        """
+        Indexes files and playlists already on disk, older files keep their mtime
+        as last reference until a run references them
+        """
+        outputDir = path.abspath(OUTPUT_DIR)
+        rows = []
+        for dirpath, _, filenames in os.walk(path.join(outputDir, "music")):
+            for fileName in filenames:
+                fullPath = path.join(dirpath, fileName)
+                try:
+                    stat = os.stat(fullPath)
+                except OSError:
+                    continue
+                relPath = path.relpath(fullPath, outputDir).replace(os.sep, "/")
+                rows.append((relPath, stat.st_size, stat.st_mtime, stat.st_mtime))
+        refs = []
+        playlistDir = path.abspath(PLAYLIST_DIR)
+        if path.isdir(playlistDir):
+            for fileName in os.listdir(playlistDir):
+                if not fileName.endswith(".m3u8"):
+                    continue
+                fullPath = path.join(playlistDir, fileName)
+                at = path.getmtime(fullPath)
+                for relPath in _playlist_paths(fullPath):
+                    refs.append((relPath, fileName[:-5], None, at))
+        with self._connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            db.executemany(
+                "INSERT OR IGNORE INTO tracks (path, size, addedAt, lastReferencedAt) "
+                "VALUES (?, ?, ?, ?)",
+                rows,
+            )
+            db.executemany(
+                "INSERT OR IGNORE INTO refs (path, playlist, run, referencedAt) "
+                "VALUES (?, ?, ?, ?)",
+                refs,
+            )
+            db.execute(
+                "UPDATE tracks SET lastReferencedAt = ("
+                "SELECT MAX(referencedAt) FROM refs WHERE refs.path = tracks.path) "
+                "WHERE lastReferencedAt < ("
+                "SELECT MAX(referencedAt) FROM refs WHERE refs.path = tracks.path)"
+            )
+            db.execute("COMMIT")
+        return len(rows)
+
+    def status(self) -> dict:
+        if self.dbPath is None:
+            return {}
+        with self._connect() as db:
+            count, total = db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM tracks"
+            ).fetchone()
+            pinned = db.execute(
+                "SELECT COUNT(*) FROM tracks WHERE pinned = 1"
+            ).fetchone()[0]
+            playlists = [
+                r[0] for r in db.execute("SELECT playlist FROM pinned_playlists")
+            ]
+        return {
+            "tracks": count,
+            "bytes": total,
+            "pinnedTracks": pinned,
+            "pinnedPlaylists": playlists,
+            "maxBytes": self.settings["maxBytes"],
+        }
+
+    def _evictable(self, db, before):
+        # pinned tracks and tracks of pinned playlists are never evicted
+        return db.execute(
+            "SELECT path, size FROM tracks WHERE pinned = 0 AND lastReferencedAt < ? "
+            "AND path NOT IN (SELECT refs.path FROM refs "
+            "JOIN pinned_playlists USING (playlist)) "
+            "ORDER BY lastReferencedAt",
+            (before,),
+        )
+
+    def enforce(self, busy=None) -> dict:
+        """
+        Evicts least recently referenced tracks until the library fits the quota.
+        busy: optional callable, the pass stops early while it returns True (runs active)
+        """
+        if not self._lock.acquire(blocking=False):
+            return {"skipped": "retention already running"}
+        try:
+            return self._enforce(busy)
+        finally:
+            self._lock.release()
+
+    def _enforce(self, busy) -> dict:
+        s = self.settings
+        self.scan()
+        outputDir = path.abspath(OUTPUT_DIR)
+        with self._connect() as db:
+            total = db.execute("SELECT COALESCE(SUM(size), 0) FROM tracks").fetchone()[
+                0
+            ]
+            target = s["maxBytes"] * s["lowWater"]
+            if total <= s["maxBytes"]:
+                return {"evicted": 0, "bytes": total}
+            candidates = self._evictable(
+                db, time.time() - s["minAge"] * 86400
+            ).fetchall()
+
+        evicted = []
+        for relPath, size in candidates:
+            if total <= target:
+                break
+            if busy is not None and busy():
+                logger.info("Retention paused, runs are active")
+                break
+            try:
+                os.remove(path.join(outputDir, relPath))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.error("Error evicting %s: %s", relPath, e)
+                continue
+            evicted.append(relPath)
+            total -= size
+
+        if evicted:
+            self._forget(evicted)
+            _prune_dirs(path.join(outputDir, "music"))
+        logger.info(
+            "Retention evicted %d tracks, library now %d bytes", len(evicted), total
+        )
+        return {"evicted": len(evicted), "bytes": total}
+
+    def _forget(self, evicted):
+        evictedSet = set(evicted)
+        with self._connect() as db:
+            playlists = {
+                r[0]
+                for p in evicted
+                for r in db.execute("SELECT playlist FROM refs WHERE path = ?", (p,))
+            }
+            db.execute("BEGIN IMMEDIATE")
+            db.executemany("DELETE FROM refs WHERE path = ?", [(p,) for p in evicted])
+            db.executemany("DELETE FROM tracks WHERE path = ?", [(p,) for p in evicted])
+            db.execute("COMMIT")
+        for playlist in playlists:
+            _rewrite_playlist(playlist, evictedSet)
+
+
+def _playlist_paths(filePath) -> list[str]:
+    with open(filePath, "r", encoding="utf-8") as f:
+        return [
+            line.strip()[3:]  # entries are ../music/...
+            for line in f
+            if line.startswith("../")
+        ]
+
+
+def _rewrite_playlist(playlist, evicted):
+    filePath = path.abspath(path.join(PLAYLIST_DIR, f"{playlist}.m3u8"))
+    try:
+        with open(filePath, "r", encoding="utf-8") as f:
+            lines = f.readlines()
+    except FileNotFoundError:
+        return
+    kept = [l for l in lines if not (l.startswith("../") and l.strip()[3:] in evicted)]
+    if len(kept) != len(lines):
+        write_atomic(filePath, "".join(kept), mode="w", encoding="utf-8")
+        logger.info(
+            "Dropped %d evicted tracks from %s", len(lines) - len(kept), playlist
+        )
+
+
+def _prune_dirs(root):
+    # bottom up, so emptied artist dirs go after their album dirs
+    for dirpath, _, _ in os.walk(root, topdown=False):
+        if dirpath == root:
+            continue
+        try:
+            os.rmdir(dirpath)
+        except OSError:
+            pass  # not empty
+
+
+library = LibraryIndex()
@@ -0,0 +1,160 @@
+# pylint: disable=invalid-name
+"""
+Adaptive request pacing per host.
+
+Every host gets its own request rate, raised additively while responses are fast
+and fine, cut multiplicatively on 429/5xx, errors and slow responses (AIMD).
+Retry-After pauses the host for the requested time.
+"""
+
+import email.utils
+import logging
+import threading
+import time
+
+logger = logging.getLogger("Runner")
+
+DEFAULTS = {
+    "initialInterval": 2.0,  # seconds between requests before any feedback
+    "minInterval": 0.25,
+    "maxInterval": 30.0,
+    "increase": 0.05,  # requests per second added on a good response
+    "decrease": 0.5,  # rate factor on a bad response
+    "targetLatency": 2.0,  # slower responses count as bad
+}
+
+
+def parse_retry_after(value) -> float | None:
+    """
+    Seconds to wait from a Retry-After header, delay seconds or HTTP date
+    """
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        retryAt = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(retryAt.timestamp() - time.time(), 0.0)
+
+
+class HostPacer:
+    def __init__(self, host, settings):
+        self.host = host
+        self.settings = settings
+        self.rate = 1 / settings["initialInterval"]
+        self.nextAt = 0.0
+        self.blockedUntil = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def interval(self) -> float:
+        return 1 / self.rate
+
+    def ready_at(self) -> float:
+        return max(self.nextAt, self.blockedUntil)
+
+    def reserve(self) -> float:
+        """
+        Takes the next request slot and returns how many seconds to wait for it.
+        """
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self.ready_at())
+            self.nextAt = slot + self.interval
+        return slot - now
+
+    def acquire(self):
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    def wait_unblocked(self):
+        """
+        Only honours Retry-After, for requests spaced by a shared limiter.
+        """
+        wait = self.blockedUntil - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+
+    def feedback(self, status=None, latency=None, retryAfter=None):
+        """
+        Adjusts the rate from a response, status None means the request failed.
+        """
+        s = self.settings
+        bad = (
+            status is None
+            or status == 429
+            or status >= 500
+            or (latency is not None and latency > s["targetLatency"])
+        )
+        with self._lock:
+            if bad:
+                self.rate = max(self.rate * s["decrease"], 1 / s["maxInterval"])
+            else:
+                self.rate = min(self.rate + s["increase"], 1 / s["minInterval"])
+            if retryAfter is not None:
+                self.blockedUntil = max(
+                    self.blockedUntil, time.monotonic() + retryAfter
+                )
+            interval = self.interval
+        if bad:
+            logger.debug(
+                "Backing off %s (status %s, %.2fs), interval now %.2fs",
+                self.host,
+                status,
+                latency or 0,
+                interval,
+            )
+
+
+class Pacer:
+    """
+    Registry of the host pacers, settings can be overridden per provider or host.
+    """
+
+    def __init__(self):
+        self.settings = dict(DEFAULTS)
+        self.overrides: dict[str, dict] = {}
+        self._hosts: dict[str, HostPacer] = {}
+        self._lock = threading.Lock()
+
+    def configure(self, pacingConfig):
+        """
+        pacingConfig: DEFAULTS keys, plus "hosts": {provider or host: {keys}}
+        """
+        with self._lock:
+            self.settings = {
+                **DEFAULTS,
+                **{k: v for k, v in pacingConfig.items() if k != "hosts"},
+            }
+            self.overrides = pacingConfig.get("hosts", {})
+            self._hosts.clear()
+
+    def get(self, host, provider=None) -> HostPacer:
+        with self._lock:
+            hostPacer = self._hosts.get(host)
+            if hostPacer is None:
+                settings = {
+                    **self.settings,
+                    **self.overrides.get(provider, {}),
+                    **self.overrides.get(host, {}),
+                }
+                hostPacer = self._hosts[host] = HostPacer(host, settings)
+            return hostPacer
+
+    def status(self) -> dict:
+        with self._lock:
+            return {
+                host: {
+                    "interval": round(p.interval, 3),
+                    "blockedFor": round(max(p.blockedUntil - time.monotonic(), 0), 1),
+                }
+                for host, p in self._hosts.items()
+            }
+
+
+pacer = Pacer()
@@ -0,0 +1,188 @@
+# pylint: disable=invalid-name,broad-exception-caught
+"""
+Streaming stage pipeline.
+
+Every stage runs in its own worker threads and hands items to the next stage
+through a bounded queue, so later stages start working as soon as the first item
+lands and a slow stage blocks the ones before it instead of piling items up in memory.
+"""
+
+import contextlib
+import logging
+import queue
+import threading
+
+logger = logging.getLogger("Runner")
+
+_DONE = object()
+
+
+class Cancelled(Exception):
+    """
+    Passed to onError for the items discarded by a cancelled pipeline.
+    """
+
+
+class Stage:
+    """
+    A pipeline step, func takes an item and returns the item to pass on or None to drop it.
+    """
+
+    def __init__(self, name, func, workers=1):
+        self.name = name
+        self.func = func
+        self.workers = workers
+
+
+class Pipeline:
+    def __init__(
+        self,
+        stages: list[Stage],
+        maxsize=2,
+        name=None,
+        onError=None,
+        profiler=None,
+        cancel: threading.Event | None = None,
+    ):
+        self.stages = stages
+        # called with (stageName, item, exception) when a stage raises, the item is dropped
+        self.onError = onError
+        # RunProfiler of a profiled run, stage threads are profiled and drained stages snapshot memory
+        self.profiler = profiler
+        self.maxsize = maxsize
+        # stage threads are named after the calling thread, run logs follow them
+        self.name = name or threading.current_thread().name
+        self._stop = threading.Event()
+        # once set, nothing is fed and items in flight are discarded before their next stage
+        self._cancel = cancel or threading.Event()
+
+    def stop(self):
+        """
+        Stops feeding new items, items already in flight are still drained.
+        """
+        self._stop.set()
+
+    def cancel(self):
+        """
+        Stops feeding and discards the items in flight, onError gets Cancelled for them.
+        """
+        self._cancel.set()
+
+    @property
+    def stopped(self) -> bool:
+        return self._stop.is_set() or self._cancel.is_set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+    def _profiled(self):
+        return self.profiler.thread() if self.profiler else contextlib.nullcontext()
+
+    def _feed(self, source, inbox, workers):
+        with self._profiled():
+            self._feed_items(source, inbox, workers)
+
+    def _feed_items(self, source, inbox, workers):
+        try:
+            for item in source:
+                if self.stopped:
+                    break
+                inbox.put(item)
+        except Exception as e:
+            logger.error("Error feeding pipeline: %s", e, exc_info=True)
+        finally:
+            for _ in range(workers):
+                inbox.put(_DONE)
+
+    def _work(self, stage, inbox, outbox, nextWorkers, remaining, lock):
+        with self._profiled():
+            self._work_items(stage, inbox, outbox)
+
+        # last worker out closes the next stage
+        with lock:
+            remaining[0] -= 1
+            if remaining[0] == 0:
+                if self.profiler:
+                    self.profiler.snapshot(f"{stage.name} drained")
+                for _ in range(nextWorkers):
+                    outbox.put(_DONE)
+
+    def _on_error(self, stage, item, error):
+        # a failing handler must not kill the worker, the stages before would block on it
+        if self.onError is None:
+            return
+        try:
+            self.onError(stage.name, item, error)
+        except Exception as e:
+            logger.error("Error in %s error handler: %s", stage.name, e, exc_info=True)
+
+    def _work_items(self, stage, inbox, outbox):
+        while True:
+            item = inbox.get()
+            if item is _DONE:
+                break
+            if self.cancelled:
+                self._on_error(stage, item, Cancelled())
+                continue
+            try:
+                result = stage.func(item)
+            except Exception as e:
+                logger.error("Error in stage %s: %s", stage.name, e, exc_info=True)
+                self._on_error(stage, item, e)
+                continue
+            if result is not None:
+                outbox.put(result)
+
+    def run(self, source) -> list:
+        """
+        Pushes every item of source through the stages and returns what comes out of the last one.
+        """
+        queues = [queue.Queue(self.maxsize) for _ in self.stages]
+        results: queue.Queue = queue.Queue()
+        queues.append(results)
+
+        threads = [
+            threading.Thread(
+                target=self._feed,
+                args=(source, queues[0], self.stages[0].workers),
+                name=f"{self.name}/feed",
+                daemon=True,
+            )
+        ]
+        for idx, stage in enumerate(self.stages):
+            nextWorkers = (
+                self.stages[idx + 1].workers if idx + 1 < len(self.stages) else 1
+            )
+            remaining = [stage.workers]
+            lock = threading.Lock()
+            for n in range(stage.workers):
+                threads.append(
+                    threading.Thread(
+                        target=self._work,
+                        args=(
+                            stage,
+                            queues[idx],
+                            queues[idx + 1],
+                            nextWorkers,
+                            remaining,
+                            lock,
+                        ),
+                        name=f"{self.name}/{stage.name}-{n}",
+                        daemon=True,
+                    )
+                )
+
+        for t in threads:
+            t.start()
+
+        output = []
+        while True:
+            item = results.get()
+            if item is _DONE:
+                break
+            output.append(item)
+
+        for t in threads:
+            t.join()
+        return output
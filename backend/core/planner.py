@@ -0,0 +1,144 @@
+# pylint: disable=invalid-name,broad-exception-caught
+"""
+Dry runs of a blueprint.
+
+A plan fetches the candidates and matches them against the library index, the offline
+metadata index and the ISRC cache, without searching the audio provider or downloading.
+Requests, bytes and duration are estimated from the blueprint's recorded runs,
+with the quota ledger costs standing in until it has some.
+"""
+
+import logging
+import math
+
+from core.quota import ledger
+from core.library import library
+from core.pacer import pacer
+from core.stats import stats
+from api.linkapi import MetaLinkApi
+from api.mb_api import MetaMBAPI
+from api.metaindex import get_index
+
+logger = logging.getLogger("Runner")
+
+# download time of a track before the blueprint has any
+DEFAULT_TRACK_SECONDS = 15.0
+
+
+def _walk(candidates, quantity, matchRate):
+    """
+    Candidates a run would search to fill quantity, tracks already in the library
+    count as sure matches, the others at the blueprint match rate.
+    """
+    walked, existing = [], []
+    expected = 0.0
+    for candidate in candidates:
+        if len(existing) + expected >= quantity:
+            break
+        walked.append(candidate)
+        if library.find(candidate.artist, candidate.title):
+            existing.append(candidate)
+        else:
+            expected += matchRate
+    return walked, existing, expected
+
+
+def _resolve_isrcs(candidates, runConfig) -> dict:
+    """
+    ISRCs from the offline index and the cache only, counts what a run would look up
+    """
+    mbApi = MetaMBAPI(
+        index=get_index(runConfig.get("metaIndex", "data/metaindex.sqlite")),
+        offline=True,
+    )
+    mbApi.resolve_candidates(candidates)
+    local = sum(1 for c in candidates if c.isrcs)
+    pending = [c for c in candidates if not c.isrcs and c.mbid]
+    cached = mbApi.cache.get_many([c.mbid for c in pending])
+    for c in pending:
+        c.isrcs = cached.get(c.mbid, [])
+    misses = len(pending) - len(cached)
+    lookups = 0
+    if not runConfig.get("offline", False) and runConfig.get("isrcLookup", True):
+        lookups = math.ceil(misses / mbApi.batchSize)
+    return {
+        "index": local,
+        "cache": len(cached),
+        "misses": misses,
+        "resolved": sum(1 for c in candidates if c.isrcs),
+        "requests": lookups,
+    }
+
+
+def plan(playlist, runConfig) -> dict:
+    """
+    Estimate of a run of the blueprint, nothing is searched, downloaded or written
+    """
+    costs = {
+        **ledger.settings,
+        **ledger.settings["costs"].get(playlist["audioApi"], {}),
+    }
+    runStats = stats.get(playlist["name"])
+    matchRate = max(runStats.get("matchRate", 0.5), 0.05)
+    quantity = playlist.get("quantity", 15)
+    fraction, deferSeconds = ledger.admit(playlist)
+
+    result = {
+        "name": playlist["name"],
+        "quantity": quantity,
+        "budget": {"fraction": round(fraction, 3), "deferSeconds": deferSeconds},
+        "history": {
+            "runs": runStats.get("runs", 0),
+            "matchRate": runStats.get("matchRate"),
+            "trackBytes": runStats.get("trackBytes"),
+            "trackSeconds": runStats.get("trackSeconds"),
+            "candidateSeconds": runStats.get("candidateSeconds"),
+        },
+    }
+
+    if playlist["audioApi"] == "hifi":
+        metaApi = MetaLinkApi(playlist["metaApi"], runConfig["token"])
+        candidates = metaApi.api.get_candidates(playlist)
+        walked, existing, expected = _walk(candidates, quantity, matchRate)
+        isrcs = _resolve_isrcs(walked, runConfig)
+        tracks = min(len(existing) + expected, quantity)
+        newTracks = max(tracks - len(existing), 0)
+        result.update(
+            candidates=len(candidates),
+            searched=len(walked),
+            libraryHits=len(existing),
+            isrcs=isrcs,
+        )
+        metaRequests = 1 + isrcs["requests"]
+    else:
+        # the scl playlist is only known by downloading it, no candidates to check
+        walked = []
+        tracks = newTracks = quantity
+        metaRequests = 0
+
+    # tracks already on disk skip the file and artwork requests
+    requests = (
+        len(walked) * costs["searchesPerCandidate"]
+        + tracks * costs["requestsPerTrack"]
+        - (tracks - newTracks) * min(costs["requestsPerTrack"], 2)
+    )
+    trackBytes = runStats.get("trackBytes", costs["defaultTrackBytes"])
+    trackSeconds = runStats.get("trackSeconds", DEFAULT_TRACK_SECONDS)
+    candidateSeconds = runStats.get(
+        "candidateSeconds",
+        costs["searchesPerCandidate"] * pacer.settings["initialInterval"],
+    )
+    # matching and downloading overlap in the pipeline, the slower one sets the pace
+    matchTime = len(walked) * candidateSeconds / runConfig.get("matchWorkers", 2)
+    downloadTime = newTracks * trackSeconds
+    result["estimate"] = {
+        "tracks": round(tracks),
+        "newTracks": round(newTracks),
+        "requests": math.ceil(requests),
+        "metaRequests": metaRequests,
+        "bytes": int(newTracks * trackBytes),
+        "seconds": round(max(matchTime, downloadTime), 1),
+        "fromHistory": runStats.get("runs", 0) > 0,
+    }
+    logger.info("Planned %s: %s", playlist["name"], result["estimate"])
+    return result
@@ -0,0 +1,56 @@
+# pylint: disable=invalid-name
+"""
+Progressive m3u8 playlist writer
+"""
+
+import threading
+import time
+from os import path
+
+from core import prefetch
+from utils.utils import write_atomic
+
+
+class PlaylistWriter:
+    """
+    Keeps the playlist entries of a run and republishes the whole m3u8 atomically
+    every time a track is added, so a partial or crashed run still leaves a usable playlist.
+    With publishAt (timestamp) the playlist is held in output/pending until then.
+    """
+
+    def __init__(self, name, playlistDir="output/playlists", publishAt=None):
+        self.name = name
+        self.publishAt = publishAt
+        self.filePath = path.abspath(path.join(playlistDir, f"{name}.m3u8"))
+        self.entries: dict[int, str] = {}
+        self._lock = threading.Lock()
+
+    def render(self) -> str:
+        m3u = []
+        m3u.append("#EXTM3U")
+        m3u.append(f"#{self.name}")
+        for idx in sorted(self.entries):
+            m3u.append(self.entries[idx])
+        return "".join(line + "\n" for line in m3u)
+
+    def publish(self):
+        with self._lock:
+            if self.publishAt is not None and time.time() < self.publishAt:
+                prefetch.hold(self.name, self.filePath, self.render(), self.publishAt)
+                return
+            write_atomic(self.filePath, self.render(), mode="w", encoding="utf-8")
+            if self.publishAt is not None:
+                prefetch.release(self.name)
+
+    def add(self, idx, line, publish=True):
+        """
+        Adds a track at its candidate position, entries are always written in idx order.
+        """
+        with self._lock:
+            self.entries[idx] = line
+        if publish:
+            self.publish()
+
+    def lines(self) -> list[str]:
+        with self._lock:
+            return [self.entries[idx] for idx in sorted(self.entries)]
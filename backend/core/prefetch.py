@@ -0,0 +1,146 @@
+# pylint: disable=invalid-name,broad-exception-caught
+# mypy: disable-error-code="import-untyped"
+"""
+Ahead of schedule runs.
+
+A blueprint with a prefetch window (minutes) is triggered that much before its schedule,
+matching and downloading happen in the meantime and the playlist is held in output/pending
+until the scheduled time, then published in place.
+"""
+
+import datetime
+import logging
+import os
+import threading
+import time
+from os import path
+
+from apscheduler.triggers.base import BaseTrigger
+from apscheduler.triggers.cron import CronTrigger
+
+from utils import jsoncodec
+from utils.utils import write_atomic
+
+logger = logging.getLogger("Terabithia")
+
+PENDING_DIR = "output/pending"
+_pendingLock = threading.Lock()
+
+
+class PrefetchTrigger(BaseTrigger):
+    """
+    Fires offset before every fire time of the wrapped trigger.
+    """
+
+    def __init__(self, trigger: BaseTrigger, offset: datetime.timedelta):
+        self.trigger = trigger
+        self.offset = offset
+
+    def get_next_fire_time(self, previous_fire_time, now):
+        if previous_fire_time is not None:
+            previous_fire_time = previous_fire_time + self.offset
+        nextFireTime = self.trigger.get_next_fire_time(
+            previous_fire_time, now + self.offset
+        )
+        if nextFireTime is None:
+            return None
+        return nextFireTime - self.offset
+
+    def __str__(self):
+        return f"prefetch[{self.trigger}, -{self.offset}]"
+
+    def __repr__(self):
+        return f"<PrefetchTrigger (trigger={self.trigger!r}, offset={self.offset!r})>"
+
+
+def blueprint_trigger(playlistEntry) -> BaseTrigger | None:
+    """
+    Cron trigger of the blueprint schedule, wrapped in a PrefetchTrigger with a prefetch window
+    """
+    match playlistEntry.get("every"):
+        case "weekly":
+            trigger = CronTrigger(
+                day_of_week=playlistEntry["weekday"],
+                hour=playlistEntry["hour"],
+                minute=playlistEntry["minute"],
+            )
+        case "monthly":
+            trigger = CronTrigger(
+                day=playlistEntry["day"],
+                month=playlistEntry["month"],
+                hour=playlistEntry["hour"],
+            )
+        case _:
+            return None
+    prefetch = playlistEntry.get("prefetch", 0)
+    if prefetch:
+        return PrefetchTrigger(trigger, datetime.timedelta(minutes=prefetch))
+    return trigger
+
+
+def publish_time(playlistEntry, now=None) -> float | None:
+    """
+    Scheduled time the run publishes at, None unless the run falls in the prefetch window
+    """
+    prefetch = playlistEntry.get("prefetch", 0)
+    trigger = blueprint_trigger(playlistEntry)
+    if not prefetch or trigger is None:
+        return None
+    now = now or datetime.datetime.now().astimezone()
+    scheduled = trigger.trigger.get_next_fire_time(None, now)
+    if scheduled is None or scheduled - now > datetime.timedelta(minutes=prefetch):
+        return None  # manual or late run, nothing to wait for
+    return scheduled.timestamp()
+
+
+def _pending_path(name):
+    return path.abspath(path.join(PENDING_DIR, f"{name}.json"))
+
+
+def hold(name, filePath, content, publishAt):
+    """
+    Stores the rendered playlist until publishAt
+    """
+    os.makedirs(path.abspath(PENDING_DIR), exist_ok=True)
+    entry = {"publishAt": publishAt, "filePath": filePath, "content": content}
+    with _pendingLock:
+        write_atomic(_pending_path(name), jsoncodec.dumps(entry))
+
+
+def release(name):
+    """
+    Drops the held playlist of name, once it has been published directly
+    """
+    with _pendingLock:
+        try:
+            os.remove(_pending_path(name))
+        except FileNotFoundError:
+            pass
+
+
+def publish_due(now=None):
+    """
+    Publishes every held playlist whose time has come, runs on an interval in the API process
+    """
+    now = now or time.time()
+    pendingDir = path.abspath(PENDING_DIR)
+    if not path.isdir(pendingDir):
+        return
+    for fileName in os.listdir(pendingDir):
+        if not fileName.endswith(".json"):
+            continue
+        pendingPath = path.join(pendingDir, fileName)
+        try:
+            with _pendingLock:
+                entry = jsoncodec.load_file(pendingPath)
+                if entry["publishAt"] > now:
+                    continue
+                write_atomic(
+                    entry["filePath"], entry["content"], mode="w", encoding="utf-8"
+                )
+                os.remove(pendingPath)
+            logger.info("Published prefetched playlist %s", fileName[:-5])
+        except FileNotFoundError:
+            pass  # published by the run itself
+        except Exception as e:
+            logger.error("Error publishing %s: %s", fileName, e, exc_info=True)
@@ -0,0 +1,188 @@
+# pylint: disable=invalid-name,broad-exception-caught
+"""
+Process executor for runs.
+
+Every run executes in a fresh spawned process, so tagging, artwork encoding,
+report serialization and yt-dlp post-processing don't contend for the GIL with
+the API threads. Log records and progress events are sent back to the parent
+through queues, the outcome through a pipe.
+"""
+
+import logging
+import multiprocessing
+import signal
+import threading
+import time
+
+from core.events import bus
+
+logger = logging.getLogger("Terabithia")
+
+_STOP = None
+
+# seconds between checks of the cancel event while a run process works
+POLL_INTERVAL = 1.0
+
+
+def _child_main(playlistName, config, logQueue, eventQueue, resultConn, memoryLimit):
+    # imports stay here, the parent doesn't need the child setup
+    # pylint: disable=import-outside-toplevel
+    from core import runner
+    from utils import jsoncodec
+    from utils.logsetup import LogRouter
+
+    if memoryLimit:
+        import resource
+
+        limit = int(memoryLimit) * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+    jsoncodec.set_codec(config.get("jsonCodec", "auto"))
+    logRouter = LogRouter(config)
+    logRouter.get_logger("Runner")
+    logRouter.get_logger("Terabithia")
+    logRouter.forward_to(logQueue)
+    logRouter.start()
+    bus.forward = eventQueue
+    if config.get("mode") == "distributed":
+        from api.hifi_api import AudioHifiAPI
+        from core.workqueue import WorkQueue, SharedRateLimiter
+
+        workerConfig = {**config.get("dispatch", {}), **config.get("worker", {})}
+        AudioHifiAPI.rateLimiter = SharedRateLimiter(
+            WorkQueue(workerConfig), workerConfig.get("requestInterval", 2)
+        )
+    runner.init(config, logRouter)
+
+    result = {"ok": True, "error": None}
+    try:
+        runner.fetch(playlistName)
+    except MemoryError:
+        result = {"ok": False, "error": f"memory limit of {memoryLimit} MB exceeded"}
+    except Exception as e:
+        result = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+    finally:
+        logRouter.stop()
+    resultConn.send(result)
+    resultConn.close()
+
+
+class ProcessExecutor:
+    """
+    config keys (all optional):
+        jobTimeout: seconds before a run process is killed, 0 disables it
+        jobMemoryLimit: address space limit in MB for a run process, 0 disables it
+    """
+
+    def __init__(self, config, logRouter):
+        self.config = config
+        self.logRouter = logRouter
+        self.timeout = config.get("jobTimeout", 0) or None
+        self.memoryLimit = config.get("jobMemoryLimit", 0)
+        self.context = multiprocessing.get_context("spawn")
+
+    def _pump_logs(self, logQueue):
+        while (record := logQueue.get()) is not _STOP:
+            self.logRouter.queue.put(record)
+
+    @staticmethod
+    def _pump_events(eventQueue):
+        while (entry := eventQueue.get()) is not _STOP:
+            run, event, data = entry
+            bus.publish(run, event, **data)
+
+    def _wait_result(self, resultRecv, cancel):
+        """
+        Waits for the run outcome, returns (result or None, "cancelled", "timeout" or None)
+        """
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        while True:
+            wait = POLL_INTERVAL
+            if deadline is not None:
+                wait = min(wait, max(deadline - time.monotonic(), 0))
+            if resultRecv.poll(wait):
+                try:
+                    return resultRecv.recv(), None
+                except EOFError:
+                    return None, None  # died before sending a result
+            if cancel is not None and cancel.is_set():
+                return None, "cancelled"
+            if deadline is not None and time.monotonic() >= deadline:
+                return None, "timeout"
+
+    def _exit_error(self, stopReason, exitcode) -> str:
+        if stopReason == "timeout":
+            return f"timed out after {self.timeout}s"
+        if exitcode is not None and exitcode < 0:
+            error = f"killed by signal {-exitcode}"
+            if self.memoryLimit and -exitcode == signal.SIGKILL:
+                # RLIMIT_AS and the OOM killer end runs with SIGKILL
+                error += f", memory limit is {self.memoryLimit} MB"
+            return error
+        return f"exited with code {exitcode}"
+
+    def run(self, playlistName, cancel: threading.Event | None = None):
+        """
+        Runs the blueprint in a child process and waits for it,
+        raises RuntimeError if the run failed, timed out, was killed or cancelled.
+        Setting cancel terminates the process right away.
+        """
+        logQueue = self.context.Queue()
+        eventQueue = self.context.Queue()
+        resultRecv, resultSend = self.context.Pipe(duplex=False)
+        pumps = [
+            threading.Thread(target=self._pump_logs, args=(logQueue,), daemon=True),
+            threading.Thread(target=self._pump_events, args=(eventQueue,), daemon=True),
+        ]
+        for t in pumps:
+            t.start()
+
+        process = self.context.Process(
+            target=_child_main,
+            args=(
+                playlistName,
+                self.config,
+                logQueue,
+                eventQueue,
+                resultSend,
+                self.memoryLimit,
+            ),
+            name=f"run-{playlistName}",
+            daemon=True,
+        )
+        process.start()
+        resultSend.close()
+        logger.info("Run %s started in process %s", playlistName, process.pid)
+
+        result, stopReason = self._wait_result(resultRecv, cancel)
+        # the parent only terminates the process itself on cancel or timeout
+        process.join(0 if stopReason else 5)
+        if process.is_alive():
+            process.terminate()
+            process.join(5)
+            if process.is_alive():
+                process.kill()
+                process.join()
+        resultRecv.close()
+
+        logQueue.put(_STOP)
+        eventQueue.put(_STOP)
+        for t in pumps:
+            t.join()
+
+        if stopReason == "cancelled":
+            logger.warning("Run %s cancelled, process terminated", playlistName)
+            raise RuntimeError(f"Run {playlistName} cancelled")
+        if result is None:
+            error = self._exit_error(stopReason, process.exitcode)
+            bus.publish(
+                f"{playlistName}-process-{process.pid}",
+                "failed",
+                name=playlistName,
+                error=error,
+            )
+            raise RuntimeError(f"Run {playlistName} {error}")
+        if not result["ok"]:
+            raise RuntimeError(f"Run {playlistName} failed: {result['error']}")
+        logger.info("Run %s process finished", playlistName)
+        return result
@@ -0,0 +1,231 @@
+# pylint: disable=invalid-name,broad-exception-caught
+"""
+On demand run profiling.
+
+A blueprint is armed for profiling through the api, its next run (manual or scheduled)
+runs under cProfile, pipeline stage threads included, and takes tracemalloc snapshots
+at the start, at the end and whenever a pipeline stage drains.
+Reports are written to output/profiles/{run}/.
+Arming is a marker file, so it reaches runs in child processes and other workers too.
+"""
+
+import contextlib
+import cProfile
+import io
+import logging
+import pstats
+import re
+import sys
+import threading
+import time
+import tracemalloc
+from os import path, makedirs, listdir, remove
+
+from utils import jsoncodec
+from utils.utils import write_atomic
+
+logger = logging.getLogger("Runner")
+
+PROFILE_FILES = ("profile.pstats", "profile.txt", "memory.txt", "summary.json")
+
+# from 3.12 cProfile runs on sys.monitoring, a single profiler sees every thread
+# and only one can be enabled per process
+PER_THREAD = sys.version_info < (3, 12)
+
+
+class RunProfiler:
+    def __init__(self, name, run, outDir, topLines=40, memoryTop=15):
+        self.name = name
+        self.run = run
+        self.outDir = path.join(outDir, run)
+        self.topLines = topLines
+        self.memoryTop = memoryTop
+        self._lock = threading.Lock()
+        self._main = cProfile.Profile()
+        self._threads: list[cProfile.Profile] = []
+        self._snapshots: list[tuple[str, float, tracemalloc.Snapshot]] = []
+        self._startedTracing = False
+        self._enabled = False
+        self._started = 0.0
+
+    def start(self):
+        self._started = time.monotonic()
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(10)
+            self._startedTracing = True
+        self.snapshot("start")
+        self._enabled = self._enable(self._main)
+
+    def _enable(self, profile) -> bool:
+        # another profiler already active (an overlapping profiled run), the run
+        # goes on without cpu stats rather than failing
+        try:
+            profile.enable()
+            return True
+        except ValueError as e:
+            logger.warning("cProfile not enabled for run %s: %s", self.run, e)
+            return False
+
+    @contextlib.contextmanager
+    def thread(self):
+        """
+        Profiles the calling thread for the duration of the block,
+        a no-op where the run profiler already covers every thread.
+        """
+        profile = cProfile.Profile()
+        if not PER_THREAD or not self._enable(profile):
+            yield
+            return
+        try:
+            yield
+        finally:
+            profile.disable()
+            with self._lock:
+                self._threads.append(profile)
+
+    def snapshot(self, label):
+        if not tracemalloc.is_tracing():
+            return
+        snap = tracemalloc.take_snapshot().filter_traces(
+            (tracemalloc.Filter(False, tracemalloc.__file__),)
+        )
+        with self._lock:
+            self._snapshots.append((label, time.monotonic() - self._started, snap))
+
+    def finish(self):
+        if self._enabled:
+            self._main.disable()
+        self.snapshot("end")
+        if self._startedTracing:
+            tracemalloc.stop()
+        try:
+            self._write()
+        except Exception as e:
+            logger.error("Error writing profile %s: %s", self.run, e, exc_info=True)
+
+    def _write(self):
+        makedirs(self.outDir, exist_ok=True)
+        stats = pstats.Stats(self._main)
+        for profile in self._threads:
+            stats.add(profile)
+        stats.dump_stats(path.join(self.outDir, "profile.pstats"))
+
+        text = io.StringIO()
+        stats.stream = text
+        stats.sort_stats("cumulative").print_stats(self.topLines)
+        write_atomic(
+            path.join(self.outDir, "profile.txt"), text.getvalue(), "w", "utf-8"
+        )
+
+        write_atomic(
+            path.join(self.outDir, "memory.txt"), self._memory_report(), "w", "utf-8"
+        )
+        write_atomic(
+            path.join(self.outDir, "summary.json"),
+            jsoncodec.dumps(
+                {
+                    "name": self.name,
+                    "run": self.run,
+                    "seconds": round(time.monotonic() - self._started, 3),
+                    "threads": len(self._threads) + 1,
+                    "snapshots": [
+                        {
+                            "label": label,
+                            "at": round(at, 3),
+                            "bytes": sum(s.size for s in snap.statistics("filename")),
+                        }
+                        for label, at, snap in self._snapshots
+                    ],
+                }
+            ),
+        )
+        logger.info("Profile written to %s", self.outDir)
+
+    def _memory_report(self):
+        lines = []
+        previous = None
+        for label, at, snap in self._snapshots:
+            top = snap.statistics("lineno")
+            total = sum(s.size for s in top)
+            lines.append(f"== {label} at {at:.2f}s, {total / 1024:.1f} KiB traced ==")
+            lines.extend(str(s) for s in top[: self.memoryTop])
+            if previous is not None:
+                lines.append(f"-- growth since {previous[0]} --")
+                lines.extend(
+                    str(s)
+                    for s in snap.compare_to(previous[1], "lineno")[: self.memoryTop]
+                )
+            lines.append("")
+            previous = (label, snap)
+        return "\n".join(lines)
+
+
+class Profiling:
+    def __init__(self, outDir="output/profiles"):
+        self.outDir = path.abspath(outDir)
+        self._local = threading.local()
+
+    def _marker(self, name):
+        return path.join(self.outDir, ".armed", re.sub(r"[\\/*?:\"<>|]", "-", name))
+
+    def arm(self, name):
+        """
+        Profiles the next run of the blueprint.
+        """
+        makedirs(path.dirname(self._marker(name)), exist_ok=True)
+        with open(self._marker(name), "w", encoding="utf-8") as f:
+            f.write(str(int(time.time())))
+
+    def disarm(self, name) -> bool:
+        try:
+            remove(self._marker(name))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def armed(self) -> list:
+        armedDir = path.dirname(self._marker("x"))
+        return sorted(listdir(armedDir)) if path.isdir(armedDir) else []
+
+    @contextlib.contextmanager
+    def maybe_profile(self, name, run):
+        """
+        Profiles the block when the blueprint is armed, consuming the mark.
+        """
+        if not self.disarm(name):
+            yield None
+            return
+        profiler = RunProfiler(name, run, self.outDir)
+        logger.info("Profiling run %s", run)
+        self._local.current = profiler
+        profiler.start()
+        try:
+            yield profiler
+        finally:
+            self._local.current = None
+            profiler.finish()
+
+    def current(self) -> RunProfiler | None:
+        """
+        The profiler of the run in the calling thread, if any.
+        """
+        return getattr(self._local, "current", None)
+
+    def runs(self) -> list:
+        if not path.isdir(self.outDir):
+            return []
+        runs = []
+        for run in sorted(listdir(self.outDir), reverse=True):
+            summaryPath = path.join(self.outDir, run, "summary.json")
+            if path.isfile(summaryPath):
+                runs.append(jsoncodec.load_file(summaryPath))
+        return runs
+
+    def file(self, run, fileName) -> str | None:
+        if fileName not in PROFILE_FILES or path.basename(run) != run:
+            return None
+        filePath = path.join(self.outDir, run, fileName)
+        return filePath if path.isfile(filePath) else None
+
+
+profiling = Profiling()
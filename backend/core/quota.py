@@ -0,0 +1,250 @@
+# pylint: disable=invalid-name,broad-exception-caught
+"""
+Provider quota ledger.
+
+Requests and bytes sent to every provider are stored in a sqlite ledger over a rolling
+window (a day by default). Before a run starts its cost is estimated from the blueprint
+stats: runs that fit go ahead, runs that only partly fit are shrunk and the rest are
+deferred until enough usage has rolled out of the window. A share of every budget is
+kept for high priority blueprints.
+"""
+
+import logging
+import math
+import sqlite3
+import threading
+import time
+from os import makedirs, path
+
+from core.stats import stats
+from utils import jsoncodec
+
+logger = logging.getLogger("Terabithia")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS usage (
+    provider TEXT NOT NULL,
+    at REAL NOT NULL,
+    requests INTEGER NOT NULL,
+    bytes INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS usage_provider ON usage (provider, at);
+"""
+
+DEFAULTS = {
+    "path": "data/quota.sqlite",
+    "window": 86400,  # seconds
+    "reserve": 0.2,  # budget share only high priority runs can use
+    "reservePriority": 5,  # blueprints from this priority up can use the reserve
+    "minFraction": 0.25,  # smaller partial runs are deferred instead
+    "searchesPerCandidate": 2,
+    "requestsPerTrack": 4,  # album, manifest, file and artwork
+    "defaultTrackBytes": 30_000_000,
+    # per provider overrides of the three cost keys above
+    "costs": {
+        "scl": {
+            "searchesPerCandidate": 0,
+            "requestsPerTrack": 1,
+            "defaultTrackBytes": 5_000_000,
+        }
+    },
+    "providers": {},  # {"hifi": {"requests": 20000, "bytes": 50000000000}}
+}
+
+# buffered usage is written after this many requests or seconds
+FLUSH_REQUESTS = 50
+FLUSH_SECONDS = 30
+
+
+class QuotaLedger:
+    def __init__(self):
+        self.settings = dict(DEFAULTS)
+        self.dbPath = None
+        self._pending: dict[str, list[int]] = {}
+        self._pendingRequests = 0
+        self._lastFlush = time.time()
+        self._lock = threading.Lock()
+
+    def configure(self, quotaConfig):
+        with self._lock:
+            self.settings = {**DEFAULTS, **quotaConfig}
+            self.dbPath = path.abspath(self.settings["path"])
+        makedirs(path.dirname(self.dbPath), exist_ok=True)
+        with self._connect() as db:
+            db.executescript(SCHEMA)
+
+    def _connect(self):
+        db = sqlite3.connect(self.dbPath, timeout=30, isolation_level=None)
+        db.execute("PRAGMA journal_mode=WAL")
+        return db
+
+    def limits(self, provider) -> dict:
+        return self.settings["providers"].get(provider, {})
+
+    def record(self, provider, requests=1, nbytes=0):
+        """
+        Counts usage of a limited provider, written to the ledger in batches.
+        """
+        if self.dbPath is None or not self.limits(provider):
+            return
+        with self._lock:
+            pending = self._pending.setdefault(provider, [0, 0])
+            pending[0] += requests
+            pending[1] += nbytes
+            self._pendingRequests += requests
+            due = (
+                self._pendingRequests >= FLUSH_REQUESTS
+                or time.time() - self._lastFlush >= FLUSH_SECONDS
+            )
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._pendingRequests = 0
+            self._lastFlush = time.time()
+        if not pending:
+            return
+        now = time.time()
+        try:
+            with self._connect() as db:
+                db.executemany(
+                    "INSERT INTO usage (provider, at, requests, bytes) VALUES (?, ?, ?, ?)",
+                    [(p, now, r, b) for p, (r, b) in pending.items()],
+                )
+                db.execute(
+                    "DELETE FROM usage WHERE at < ?", (now - self.settings["window"],)
+                )
+        except sqlite3.Error as e:
+            logger.error("Error writing quota ledger %s", e)
+
+    def used(self, provider) -> tuple[int, int]:
+        since = time.time() - self.settings["window"]
+        with self._connect() as db:
+            requests, nbytes = db.execute(
+                "SELECT COALESCE(SUM(requests), 0), COALESCE(SUM(bytes), 0) "
+                "FROM usage WHERE provider = ? AND at >= ?",
+                (provider, since),
+            ).fetchone()
+        with self._lock:
+            pending = self._pending.get(provider, [0, 0])
+        return requests + pending[0], nbytes + pending[1]
+
+    def estimate(self, playlistEntry) -> tuple[int, int]:
+        """
+        Expected requests and bytes of a run, from the blueprint match rate and track sizes
+        """
+        s = {
+            **self.settings,
+            **self.settings["costs"].get(playlistEntry.get("audioApi"), {}),
+        }
+        quantity = playlistEntry.get("quantity", 15)
+        runStats = stats.get(playlistEntry["name"])
+        matchRate = max(runStats.get("matchRate", 0.5), 0.05)
+        requests = (
+            math.ceil(quantity / matchRate) * s["searchesPerCandidate"]
+            + quantity * s["requestsPerTrack"]
+        )
+        nbytes = quantity * runStats.get("trackBytes", s["defaultTrackBytes"])
+        return requests, int(nbytes)
+
+    def _available(self, provider, priority) -> dict:
+        limits = self.limits(provider)
+        share = (
+            1
+            if priority >= self.settings["reservePriority"]
+            else 1 - self.settings["reserve"]
+        )
+        usedRequests, usedBytes = self.used(provider)
+        available = {}
+        if "requests" in limits:
+            available["requests"] = limits["requests"] * share - usedRequests
+        if "bytes" in limits:
+            available["bytes"] = limits["bytes"] * share - usedBytes
+        return available
+
+    def _defer_for(self, provider, needed: dict) -> float:
+        """
+        Seconds until enough usage rolls out of the window to free needed
+        """
+        now = time.time()
+        freed = {key: 0 for key in needed}
+        with self._connect() as db:
+            rows = db.execute(
+                "SELECT at, requests, bytes FROM usage WHERE provider = ? AND at >= ? "
+                "ORDER BY at",
+                (provider, now - self.settings["window"]),
+            ).fetchall()
+        for at, requests, nbytes in rows:
+            freed["requests"] = freed.get("requests", 0) + requests
+            freed["bytes"] = freed.get("bytes", 0) + nbytes
+            if all(freed[key] >= value for key, value in needed.items()):
+                return max(at + self.settings["window"] - now, 1)
+        return self.settings["window"]
+
+    def admit(self, playlistEntry) -> tuple[float, float]:
+        """
+        Returns (fraction of the run that fits the budget, seconds to defer it),
+        (1, 0) for providers without limits.
+        """
+        provider = playlistEntry["audioApi"]
+        if self.dbPath is None or not self.limits(provider):
+            return 1.0, 0.0
+        estimate = dict(zip(("requests", "bytes"), self.estimate(playlistEntry)))
+        # an empty run costs nothing, only limits it would spend count
+        available = {
+            key: value
+            for key, value in self._available(
+                provider, playlistEntry.get("priority", 0)
+            ).items()
+            if estimate[key] > 0
+        }
+        if not available:
+            return 1.0, 0.0
+        fraction = min(
+            [max(value, 0) / estimate[key] for key, value in available.items()] + [1.0]
+        )
+        if fraction >= self.settings["minFraction"]:
+            return fraction, 0.0
+        minFraction = self.settings["minFraction"]
+        needed = {
+            key: estimate[key] * minFraction - max(value, 0)
+            for key, value in available.items()
+        }
+        return 0.0, self._defer_for(provider, needed)
+
+    def status(self) -> dict:
+        if self.dbPath is None:
+            return {}
+        result = {}
+        for provider, limits in self.settings["providers"].items():
+            usedRequests, usedBytes = self.used(provider)
+            result[provider] = {
+                "requests": usedRequests,
+                "bytes": usedBytes,
+                "limits": limits,
+            }
+        return result
+
+
+ledger = QuotaLedger()
+
+
+def blueprint_defer(playlistName) -> float:
+    """
+    Seconds a queued run has to wait for its provider budget, 0 to start now
+    """
+    try:
+        playlistEntry = jsoncodec.load_file(
+            path.abspath(f"blueprints/{playlistName}.json")
+        )
+        fraction, deferFor = ledger.admit(playlistEntry)
+    except Exception as e:
+        logger.error("Error checking quota for %s: %s", playlistName, e)
+        return 0.0
+    if fraction == 0:
+        logger.info(
+            "Run %s deferred %.0fs, provider budget exhausted", playlistName, deferFor
+        )
+    return deferFor
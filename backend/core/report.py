@@ -0,0 +1,88 @@
+# pylint: disable=invalid-name
+"""
+Run reports built from the in-memory run state.
+
+The entries keep the tag layout of the files (lowercase tag lists, LENGTH, ARTWORK)
+so reports look the same as the ones read back from disk.
+"""
+
+import base64
+import threading
+
+from core import tagger
+from models.models import AlbumItemSlot, CandidateTrack, TrackItemSlot
+
+# outcomes of tracks that made it to the playlist
+PLAYLIST_OUTCOMES = ("downloaded", "existing", "untagged")
+
+
+def track_entry(
+    track: TrackItemSlot, outcome, relPath="", artworkBytes=None, **extra
+) -> dict:
+    """
+    Report entry for a matched track, tags as written by the tagger.
+    """
+    if isinstance(track.album, AlbumItemSlot):
+        tags = tagger.flac_tags(track)
+    else:
+        # yt-dlp tracks, tags are embedded by yt-dlp itself
+        tags = {
+            "TITLE": [track.title],
+            "ALBUM": [track.album.title if track.album else ""],
+            "ARTIST": [track.artist.name],
+            "ARTISTS": [a.name for a in track.artists],
+        }
+    entry = {name.lower(): value for name, value in tags.items()}
+    entry["LENGTH"] = track.duration or 0
+    entry["ARTWORK"] = base64.b64encode(artworkBytes).decode() if artworkBytes else ""
+    entry["ARTWORKURL"] = track.thumbnail or ""
+    entry["outcome"] = outcome
+    entry["path"] = relPath
+    entry.update(extra)
+    return entry
+
+
+def candidate_entry(candidate: CandidateTrack, outcome, **extra) -> dict:
+    """
+    Report entry for a candidate that never became a track (unmatched or failed).
+    """
+    return {
+        "title": [candidate.title],
+        "artist": [candidate.artist],
+        "album": [candidate.album or ""],
+        "LENGTH": 0,
+        "ARTWORK": "",
+        "outcome": outcome,
+        **extra,
+    }
+
+
+class RunReport:
+    """
+    Collects per track outcomes while the run goes, stages can add entries from any thread.
+    """
+
+    def __init__(self, name, blueprint):
+        self.name = name
+        self.blueprint = blueprint
+        self.entries: dict[int, dict] = {}
+        self._lock = threading.Lock()
+
+    def add(self, idx, entry):
+        with self._lock:
+            self.entries[idx] = entry
+
+    def build(self, runnedAt) -> dict:
+        with self._lock:
+            entries = [self.entries[idx] for idx in sorted(self.entries)]
+        summary: dict[str, int] = {}
+        for entry in entries:
+            summary[entry["outcome"]] = summary.get(entry["outcome"], 0) + 1
+        return {
+            "name": self.name,
+            "runnedAt": runnedAt,
+            "blueprint": self.blueprint,
+            "tracklist": [e for e in entries if e["outcome"] in PLAYLIST_OUTCOMES],
+            "skipped": [e for e in entries if e["outcome"] not in PLAYLIST_OUTCOMES],
+            "summary": summary,
+        }
@@ -0,0 +1,580 @@
+# pylint: disable=invalid-name,broad-exception-caught
+# mypy: disable-error-code="import-untyped"
+"""
+Blueprint runs, shared by the API process and the worker processes
+"""
+
+import datetime
+import io
+import logging
+import math
+import re
+import sqlite3
+import threading
+import time
+from os import path, makedirs
+
+from core import planner, prefetch, tagger
+from core.hedge import hedger
+from core.pacer import pacer
+from core.quota import ledger
+from core.pipeline import Cancelled, Pipeline, Stage
+from core.playlist import PlaylistWriter
+from core.singleflight import inflight
+from core.events import RunProgress
+from core.report import RunReport, track_entry, candidate_entry
+from core.bandwidth import bandwidth, quality_ladder
+from core.feeder import CandidateFeeder
+from core.library import library
+from core.profiling import profiling
+from core.stats import stats
+from models.models import TrackJob
+from api import httpclient
+from api.lbz_api import radioCache
+from api.linkapi import MetaLinkApi, AudioLinkApi
+from api.mb_api import MetaMBAPI
+from api.metaindex import get_index
+from utils import jsoncodec
+from utils.logsetup import LogRouter
+from utils.utils import (
+    match_candidate_to_track,
+    generate_report,
+    get_blueprint_match,
+    write_atomic,
+)
+
+runlogger = logging.getLogger("Runner")
+
+# set by init() in the process hosting the runs
+config: dict = {}
+logRouter: LogRouter | None = None
+
+
+def init(runConfig, router: LogRouter):
+    global config, logRouter  # pylint: disable=global-statement
+    config = runConfig
+    logRouter = router
+    httpclient.configure(config.get("http", {}))
+    pacer.configure(config.get("pacing", {}))
+    hedger.configure(config.get("hedging", {}))
+    ledger.configure(config.get("quota", {}))
+    bandwidth.configure(config.get("bandwidth", {}))
+    library.configure(config.get("retention", {}))
+    radioCache.configure(config.get("radioCache", {}))
+
+
+def error_callback(e):
+    runlogger.error("Error in Scan Directory %s", e, exc_info=True)
+
+
+def write_report(playlistName, runnedAt, blueprint, alogger=runlogger, report=None):
+    """
+    Writes the run report, built from the run state when given
+    or read back from the playlist and audio files otherwise (reportReadFiles)
+    """
+    if report is None or config.get("reportReadFiles", False):
+        response = generate_report(
+            playlistName, runnedAt, blueprint, alogger, error_callback
+        )
+    else:
+        response = report.build(runnedAt)
+
+    with open(
+        f"output/reports/{playlistName}-{str(runnedAt)[:10]}.json",
+        "wb",
+    ) as f:
+        f.write(jsoncodec.dumps(response))
+    return response
+
+
+def build_logger(playlist):
+    # runs can be concurrent, the run log only follows the current thread and its stages
+    threading.current_thread().name = f"run-{playlist}"
+    return logRouter.add_run_handler(
+        "Runner",
+        f"run-{playlist}-{int(time.time())}.log",
+        threadName=threading.current_thread().name,
+    )
+
+
+def build_playlist_writer(playlist, progress: RunProgress) -> PlaylistWriter:
+    # prefetch runs hold the playlist until the scheduled time
+    publishAt = prefetch.publish_time(playlist)
+    if publishAt is not None:
+        runlogger.info(
+            "Prefetching %s, publishing at %s",
+            playlist["name"],
+            datetime.datetime.fromtimestamp(publishAt),
+        )
+        progress.emit("prefetch", publishAt=publishAt)
+    return PlaylistWriter(playlist["name"], publishAt=publishAt)
+
+
+def budget_quantity(playlist, progress: RunProgress) -> int:
+    # a run only partly fitting the provider budget builds a shorter playlist
+    fraction, _ = ledger.admit(playlist)
+    if fraction >= 1:
+        return playlist["quantity"]
+    quantity = max(1, math.floor(playlist["quantity"] * fraction))
+    runlogger.warning(
+        "Provider budget low, building %d of %d tracks", quantity, playlist["quantity"]
+    )
+    progress.emit("partial", quantity=quantity)
+    return quantity
+
+
+def index_playlist(playlist, playlistWriter: PlaylistWriter, progress: RunProgress):
+    # the library index tracks which playlists reference which files, for retention
+    try:
+        library.record_playlist(
+            playlist["name"],
+            [line[3:] for line in playlistWriter.lines()],  # entries are ../music/...
+            run=progress.run,
+            pinned=playlist.get("pinned", False),
+        )
+    except sqlite3.Error as e:
+        runlogger.error("Error indexing playlist %s", e, exc_info=True)
+
+
+def check_cancelled(cancel: threading.Event | None):
+    # a cancelled run stops before it publishes anything else
+    if cancel is not None and cancel.is_set():
+        raise Cancelled("Run cancelled")
+
+
+def t_title(track) -> str:
+    return f"{track.artist.name} - {track.title}"
+
+
+def fetchhifi(playlist, progress: RunProgress, cancel=None):
+    runlogger.info("Building playlist: %s", playlist["name"])
+
+    metaApi = MetaLinkApi(playlist["metaApi"], config["token"])
+    audioApi = AudioLinkApi(playlist["audioApi"])
+
+    # get candidate tracks from api
+    candidateList = metaApi.api.get_candidates(playlist)
+    progress.emit("candidates", count=len(candidateList))
+    if profiling.current():
+        profiling.current().snapshot("candidates")
+
+    def resolve_isrcs(batch):
+        # resolve recording ids to ISRCs, lets the audio api look tracks up directly
+        if not config.get("isrcLookup", True):
+            return
+        try:
+            MetaMBAPI(
+                index=get_index(config.get("metaIndex", "data/metaindex.sqlite")),
+                offline=config.get("offline", False),
+            ).resolve_candidates(batch)
+        except Exception as e:
+            runlogger.error("Error resolving ISRCs %s", e, exc_info=True)
+
+    # a shorter run or lower qualities when the provider budget is tight
+    quantity = budget_quantity(playlist, progress)
+    budgetTight = quantity < playlist["quantity"]
+
+    # candidates go out in batches sized from the blueprint's past match rate
+    feeder = CandidateFeeder(
+        candidateList,
+        quantity,
+        matchRate=stats.match_rate(playlist["name"]),
+        overfetch=config.get("overfetch", 1.25),
+        onBatch=resolve_isrcs,
+    )
+    downloads = {"count": 0, "bytes": 0, "seconds": 0.0, "matchSeconds": 0.0}
+    downloadsLock = threading.Lock()
+    report = RunReport(playlist["name"], playlist)
+
+    def match_stage(job: TrackJob):
+        # search time per candidate, plans estimate run durations from it
+        started = time.monotonic()
+        try:
+            return match_job(job)
+        finally:
+            with downloadsLock:
+                downloads["matchSeconds"] += time.monotonic() - started
+
+    def match_job(job: TrackJob):
+        # matches candidates to available tracks
+        if feeder.full:
+            feeder.drop(job.idx)
+            return None
+
+        # exact lookup by ISRC first, no fuzzy matching needed
+        for isrc in job.candidate.isrcs:
+            try:
+                trackSlotList = audioApi.api.search_track(isrc, mode="i")
+            except ConnectionError as e:
+                runlogger.error("Error searching ISRC %s: %s", isrc, e)
+                break
+            for trackSlot in trackSlotList:
+                if trackSlot.isrc == isrc:
+                    runlogger.info(
+                        "Matched by ISRC %s: %s - %s\n",
+                        isrc,
+                        trackSlot.title,
+                        trackSlot.artist.name,
+                    )
+                    job.track = trackSlot
+                    job.matchedBy = "isrc"
+                    feeder.matched(True)
+                    progress.emit(
+                        "matched", idx=job.idx, title=t_title(trackSlot), isrc=isrc
+                    )
+                    return job
+
+        # requests are paced per mirror by the audio api (core.pacer)
+        # API returns a list of TrackItemSlot from a prompt
+        trackSlotList = audioApi.api.search_track(
+            f"{job.candidate.title} {job.candidate.artist}"
+        )
+        for trackSlot in trackSlotList:
+            # append only if name + artist is in the track infos
+            if runlogger.isEnabledFor(logging.INFO):
+                runlogger.info(
+                    "Checking Item: Title: %s Artist: %s With: Title: %s Artist: %s Feat: %s",
+                    job.candidate.title,
+                    job.candidate.artist,
+                    trackSlot.title,
+                    trackSlot.artist.name,
+                    [t.name for t in trackSlot.artists],
+                )
+            if match_candidate_to_track(job.candidate, trackSlot):
+                runlogger.info(
+                    "Matched: %s - %s\n", trackSlot.title, trackSlot.artist.name
+                )
+                job.track = trackSlot
+                job.matchedBy = "search"
+                feeder.matched(True)
+                progress.emit("matched", idx=job.idx, title=t_title(trackSlot))
+                return job  # returns after the first match
+
+        runlogger.warning(
+            "No Match For: %s - %s\n", job.candidate.title, job.candidate.artist
+        )
+        progress.emit(
+            "unmatched",
+            idx=job.idx,
+            title=f"{job.candidate.artist} - {job.candidate.title}",
+        )
+        feeder.matched(False)
+        feeder.drop(job.idx)
+        report.add(job.idx, candidate_entry(job.candidate, "unmatched", idx=job.idx))
+        return None
+
+    def album_stage(job: TrackJob):
+        # get additional album info for the matching track
+        if feeder.full:
+            feeder.drop(job.idx)
+            return None
+        try:
+            job.track.album = audioApi.api.get_album_info(job.track.album.id)
+        except ConnectionError as e:
+            runlogger.error("Error Getting album info %s", e)
+            stage_error("album", job, e)
+            return None
+        # takes one of the quantity slots, extra matches of the batch are dropped
+        if not feeder.accept(job.idx):
+            return None
+        return job
+
+    def manifest_stage(job: TrackJob):
+        t = job.track
+        # get file manifest and info, best quality the blueprint policy allows first
+        pressure = budgetTight or bandwidth.congested()
+        lastError = None
+        for quality in quality_ladder(playlist, t.audioQuality, pressure):
+            try:
+                job.trackInfo = inflight.do(
+                    ("hifi-manifest", t.id, quality),
+                    audioApi.api.get_track_manifest,
+                    t.id,
+                    quality,
+                )
+                job.quality = quality
+                break
+            except (ConnectionError, FileNotFoundError, KeyError) as e:
+                runlogger.warning("No %s manifest for %s: %s", quality, t.title, e)
+                lastError = e
+        else:
+            stage_error("manifest", job, lastError)
+            return None
+
+        # make dirs recursively
+        # sanitize album name
+        albumTitle = "".join(x for x in t.album.title if (x.isalnum() or x in "._- "))
+        try:
+            dirPath = path.abspath(f"output/music/{t.artist.name}/{albumTitle}")
+            makedirs(dirPath, exist_ok=True)
+        except OSError as e:
+            runlogger.error(
+                "Error Making Directory: %s \nWith Error: %s",
+                dirPath,
+                e,
+                exc_info=True,
+            )
+            stage_error("manifest", job, e)
+            return None
+
+        # sanitize filename
+        fileTitle = "".join(x for x in t.title if (x.isalnum() or x in "._- "))
+        job.relPath = f"music/{t.artist.name}/{albumTitle}/{fileTitle} - {t.artist.name}.{job.trackInfo.extension}"
+        job.filePath = path.abspath(f"output/{job.relPath}")
+        return job
+
+    def download_stage(job: TrackJob):
+        t = job.track
+        # check existing files
+        if path.exists(job.filePath):
+            runlogger.info("Track %s already exists, skipping download", t.title)
+            job.outcome = "existing"
+            return job
+
+        # get artwork and audio file
+        runlogger.info(
+            "Downloading Item: Title: %s - Artist: %s", t.title, t.artist.name
+        )
+        # runs resolving the same track or cover share a single fetch
+        started = time.monotonic()
+        job.trackBytes = inflight.do(
+            ("hifi-track", t.id, job.quality),
+            audioApi.api.get_track_file,
+            job.trackInfo.url,
+            progress.download_callback(job.idx, t_title(t)),
+        )
+        with downloadsLock:
+            downloads["count"] += 1
+            downloads["bytes"] += len(job.trackBytes)
+            downloads["seconds"] += time.monotonic() - started
+        job.artworkBytes = inflight.do(
+            ("hifi-artwork", t.album.cover), audioApi.api.get_album_art, t.album.cover
+        )
+        job.outcome = "downloaded"
+        return job
+
+    def write_track(job: TrackJob):
+        if path.exists(job.filePath):
+            runlogger.info("Track %s written by another run", job.track.title)
+            return
+        t = job.track
+
+        # tag in memory so the file hits the disk once, fully tagged
+        trackBuffer = io.BytesIO(job.trackBytes)
+        try:
+            tagger.tag_audio(trackBuffer, job.trackInfo.extension, t, job.artworkBytes)
+            runlogger.info("Tagged Track: %s - %s \n", t.title, t.artist.name)
+            progress.emit("tagged", idx=job.idx, title=t_title(t))
+        except Exception as e:
+            job.outcome = "untagged"
+            runlogger.error(
+                "ERROR: Can't tag: %s - %s \nError: %s",
+                t.title,
+                t.artist.name,
+                e,
+                exc_info=True,
+            )
+
+        # write file to disk
+        write_atomic(job.filePath, trackBuffer.getbuffer())
+
+    def tag_stage(job: TrackJob):
+        if job.trackBytes is None:
+            return job  # file already on disk
+
+        # one writer per destination path, concurrent runs wait for it
+        try:
+            inflight.do(("file", job.filePath), write_track, job)
+        except OSError as e:
+            runlogger.error(
+                "ERROR: Can't write: %s \nError: %s",
+                job.filePath,
+                e,
+                exc_info=True,
+            )
+            stage_error("tag", job, e)
+            return None
+        finally:
+            job.trackBytes = None
+        return job
+
+    def playlist_stage(job: TrackJob):
+        # republish the playlist as soon as the track is on disk
+        try:
+            playlistWriter.add(job.idx, f"../{job.relPath}")
+        except OSError as e:
+            runlogger.error("Error publishing playlist %s", e, exc_info=True)
+        progress.emit("track", idx=job.idx, title=t_title(job.track))
+        report.add(
+            job.idx,
+            track_entry(
+                job.track,
+                job.outcome,
+                relPath=job.relPath,
+                artworkBytes=job.artworkBytes,
+                idx=job.idx,
+                matchedBy=job.matchedBy,
+                quality=job.quality,
+            ),
+        )
+        job.artworkBytes = None
+        feeder.done(job.idx)
+        return job
+
+    def stage_error(stageName, job: TrackJob, e):
+        # failed tracks free their slot and keep their reason in the report
+        feeder.drop(job.idx)
+        entry = {"idx": job.idx, "stage": stageName, "error": str(e)}
+        if job.track is None:
+            report.add(job.idx, candidate_entry(job.candidate, "failed", **entry))
+        else:
+            report.add(
+                job.idx,
+                track_entry(job.track, "failed", matchedBy=job.matchedBy, **entry),
+            )
+
+    playlistWriter = build_playlist_writer(playlist, progress)
+    pipeline = Pipeline(
+        [
+            Stage("match", match_stage, workers=config.get("matchWorkers", 2)),
+            Stage("album", album_stage),
+            Stage("manifest", manifest_stage),
+            Stage("download", download_stage),
+            Stage("tag", tag_stage),
+            Stage("playlist", playlist_stage),
+        ],
+        onError=stage_error,
+        profiler=profiling.current(),
+        cancel=cancel,
+    )
+    pipeline.run(TrackJob(idx, candidate) for idx, candidate in feeder)
+    check_cancelled(cancel)
+
+    try:
+        runStats = stats.record(
+            playlist["name"],
+            feeder.tried,
+            feeder.hits,
+            downloads["count"],
+            downloads["bytes"],
+            downloads["seconds"],
+            downloads["matchSeconds"],
+        )
+        runlogger.info(
+            "Matched %d of %d searched candidates, match rate now %.2f",
+            feeder.hits,
+            feeder.tried,
+            runStats.get("matchRate", 0),
+        )
+    except OSError as e:
+        runlogger.error("Error writing stats %s", e, exc_info=True)
+
+    index_playlist(playlist, playlistWriter, progress)
+    runlogger.info("Playlist %s downloaded - Generating Report..", playlist["name"])
+    write_report(
+        playlistName=playlist["name"],
+        runnedAt=str(datetime.datetime.now()),
+        blueprint=playlist,
+        alogger=runlogger,
+        report=report,
+    )
+
+
+def fetchscl(playlist, progress: RunProgress, cancel=None):
+    runlogger.info("Building playlist: %s", playlist["name"])
+    # setting global path, the rest of the path is build by yt_dlp
+    dirPath = path.abspath("output/music")
+
+    audioApi = AudioLinkApi(playlist["audioApi"], path=dirPath)
+    # yt_dlp takes care of embedding metadata and thumbnail, as well as downloading to the set path
+    # return the list of tracks to pass to the playlist builder
+    trackList = audioApi.api.get_info_url(url=playlist["prompt"], logger=runlogger)
+    ledger.record(playlist["audioApi"])
+    if trackList:
+        trackList = trackList[
+            : budget_quantity({**playlist, "quantity": len(trackList)}, progress)
+        ]
+    progress.emit("candidates", count=len(trackList))
+    # get track files from queue list and
+    # republishes the playlist after every downloaded track
+    playlistWriter = build_playlist_writer(playlist, progress)
+    report = RunReport(playlist["name"], playlist)
+
+    for idx, t in enumerate(trackList, start=1):
+        check_cancelled(cancel)
+        safe_filename = re.sub(r"[\\/*?:\"<>|]", "-", t.title)
+        safe_artist = re.sub(r"[\\/*?:\"<>|]", "-", t.artist.name)
+        safe_album = re.sub(r"[\\/*?:\"<>|]", "-", t.album.title)
+        relfilepath = f"/{safe_artist}/{safe_album}/{safe_filename}"  # not adding extension to allow yt-dlp to add it's own
+        progress.emit("downloading", idx=idx, title=t_title(t))
+        audioApi.api.let_download_url(
+            playlist["prompt"], runlogger, relfilepath, idx
+        )  # keeping main playlist url to keep metadata
+        ledger.record(playlist["audioApi"])
+        relPath = f"music{relfilepath}.{t.trackinfoslot.codecs}"
+        try:
+            playlistWriter.add(idx, f"../{relPath}")
+            progress.emit("track", idx=idx, title=t_title(t))
+            report.add(idx, track_entry(t, "downloaded", relPath=relPath, idx=idx))
+        except Exception as e:
+            runlogger.error(
+                "ERROR: Error: %s",
+                e,
+                exc_info=True,
+            )
+            report.add(idx, track_entry(t, "failed", idx=idx, error=str(e)))
+
+    check_cancelled(cancel)
+    index_playlist(playlist, playlistWriter, progress)
+    runlogger.info("Playlist %s downloaded - Generating Report..", playlist["name"])
+    write_report(
+        playlistName=playlist["name"],
+        runnedAt=str(datetime.datetime.now()),
+        blueprint=playlist,
+        alogger=runlogger,
+        report=report,
+    )
+
+
+def fetch(playlistName, cancel: threading.Event | None = None):
+    """
+    Runs the blueprint, setting cancel stops it before it publishes anything else
+    """
+    threadName = threading.current_thread().name
+    rfh = build_logger(playlistName)
+    runlogger.info("Running Job %s", playlistName)
+    progress = RunProgress(playlistName)
+    progress.emit("started")
+    try:
+        with profiling.maybe_profile(playlistName, progress.run):
+            _fetch(playlistName, progress, cancel)
+    except Exception as e:
+        progress.emit("failed", error=str(e))
+        raise
+    finally:
+        ledger.flush()
+        logRouter.remove_handler(rfh)
+        threading.current_thread().name = threadName
+
+
+def plan(playlistName) -> dict | None:
+    """
+    Dry run of fetch, estimates the run cost without downloading anything
+    """
+    playlist = get_blueprint_match(playlistName, runlogger, error_callback)
+    if playlist is None:
+        return None
+    return planner.plan(playlist, config)
+
+
+def _fetch(playlistName, progress: RunProgress, cancel=None):
+    playlist = get_blueprint_match(playlistName, runlogger, error_callback)
+    if playlist is None:
+        progress.emit("failed", error="No Playlist Found")
+        return
+
+    if playlist["audioApi"] == "scl":
+        fetchscl(playlist, progress, cancel)
+    if playlist["audioApi"] == "hifi":
+        fetchhifi(playlist, progress, cancel)
+    progress.emit("done")
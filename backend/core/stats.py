@@ -0,0 +1,84 @@
+# pylint: disable=invalid-name,broad-exception-caught
+"""
+Per blueprint run statistics, kept in data/stats.json
+
+Match rates size the candidate batches of the next runs,
+download sizes and times are used to estimate run costs.
+"""
+
+import logging
+import threading
+from os import path, makedirs
+
+from utils import jsoncodec
+from utils.utils import write_atomic
+
+logger = logging.getLogger("Runner")
+
+# weight of the latest run in the moving averages
+ALPHA = 0.3
+
+
+def _average(old, new):
+    return new if old is None else old + ALPHA * (new - old)
+
+
+class RunStats:
+    def __init__(self, statsPath="data/stats.json"):
+        self.statsPath = path.abspath(statsPath)
+        self._lock = threading.Lock()
+
+    def _load(self) -> dict:
+        if not path.exists(self.statsPath):
+            return {}
+        try:
+            return jsoncodec.load_file(self.statsPath)
+        except Exception as e:
+            logger.error("Error reading stats %s", e)
+            return {}
+
+    def get(self, name) -> dict:
+        with self._lock:
+            return self._load().get(name, {})
+
+    def match_rate(self, name, default=0.5) -> float:
+        rate = self.get(name).get("matchRate")
+        return default if rate is None else rate
+
+    def record(
+        self,
+        name,
+        tried,
+        matched,
+        downloads=0,
+        downloadBytes=0,
+        seconds=0.0,
+        matchSeconds=0.0,
+    ):
+        """
+        Folds a run into the blueprint averages, runs that tried nothing only count downloads.
+        """
+        with self._lock:
+            allStats = self._load()
+            entry = allStats.setdefault(name, {"runs": 0})
+            entry["runs"] += 1
+            if tried:
+                entry["matchRate"] = _average(entry.get("matchRate"), matched / tried)
+                entry["tried"] = entry.get("tried", 0) + tried
+                entry["matched"] = entry.get("matched", 0) + matched
+                entry["candidateSeconds"] = _average(
+                    entry.get("candidateSeconds"), matchSeconds / tried
+                )
+            if downloads:
+                entry["trackBytes"] = _average(
+                    entry.get("trackBytes"), downloadBytes / downloads
+                )
+                entry["trackSeconds"] = _average(
+                    entry.get("trackSeconds"), seconds / downloads
+                )
+            makedirs(path.dirname(self.statsPath), exist_ok=True)
+            write_atomic(self.statsPath, jsoncodec.dumps(allStats))
+        return entry
+
+
+stats = RunStats()
@@ -3,8 +3,8 @@
 import logging
 import base64
 
-import music_tag
-from mutagen.flac import FLAC
+from mutagen.flac import FLAC, Picture
+from mutagen.mp4 import MP4, MP4Cover, MP4FreeForm
 import mutagen
 
 from models.models import TrackItemSlot
@@ -12,8 +12,28 @@ from models.models import TrackItemSlot
 logger = logging.getLogger("Runner")
 
 
-def tag_flac(filePath, trackItemSlot: TrackItemSlot):
-    trackTags = {
+# reserved metadata padding, big enough to absorb later tag edits without rewriting the audio
+FLAC_PADDING = 16 * 1024
+
+
+def _flac_padding(info):
+    return max(info.get_default_padding(), FLAC_PADDING)
+
+
+def _flac_picture(artworkBytes) -> Picture:
+    picture = Picture()
+    picture.type = 3  # front cover
+    picture.mime = "image/png" if artworkBytes[:4] == b"\x89PNG" else "image/jpeg"
+    picture.desc = "Album cover"
+    picture.data = artworkBytes
+    return picture
+
+
+def flac_tags(trackItemSlot: TrackItemSlot) -> dict:
+    """
+    Vorbis comments of a matched track with album info, also used by the run reports.
+    """
+    return {
         "TITLE": [trackItemSlot.title],
         "ALBUM": [trackItemSlot.album.title],
         "ALBUMARTIST": [trackItemSlot.album.artist.name],
@@ -30,21 +50,113 @@ def tag_flac(filePath, trackItemSlot: TrackItemSlot):
         "REPLAYGAIN_TRACK_GAIN": [str(trackItemSlot.replayGain)],
         "COPYRIGHT": [trackItemSlot.copyright],
     }
-    track = FLAC(filePath)
+
+
+def tag_flac(fileThing, trackItemSlot: TrackItemSlot, artworkBytes=None):
+    """
+    Writes vorbis comments and the cover picture in a single save.
+
+    :param fileThing: path or seekable file object (ex. BytesIO of the downloaded track)
+    :param trackItemSlot: matched track with album info
+    :param artworkBytes: cover image bytes, skipped if None
+    """
+    trackTags = flac_tags(trackItemSlot)
+    track = FLAC(fileThing)
     for idx, tag in trackTags.items():
         track[idx] = tag
-        logging.info(
-            "Wrote Tag: %s With Value: %s \nFor Track File: %s", idx, tag, filePath
+    if artworkBytes:
+        track.clear_pictures()
+        track.add_picture(_flac_picture(artworkBytes))
+
+    if hasattr(fileThing, "seek"):
+        fileThing.seek(0)
+        track.save(fileThing, padding=_flac_padding)
+    else:
+        track.save(padding=_flac_padding)
+    logger.debug(
+        "Tagged %s - %s (%d tags, cover: %s)",
+        trackItemSlot.title,
+        trackItemSlot.artist.name,
+        len(trackTags),
+        bool(artworkBytes),
+    )
+
+
+def _int_or_zero(value) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+def tag_mp4(fileThing, trackItemSlot: TrackItemSlot, artworkBytes=None):
+    """
+    Writes the mp4 atoms of AAC tracks (HIGH/LOW quality), same fields as tag_flac.
+    """
+    album = trackItemSlot.album
+    track = MP4(fileThing)
+    if track.tags is None:
+        track.add_tags()
+    track["\xa9nam"] = [trackItemSlot.title]
+    track["\xa9alb"] = [album.title]
+    track["aART"] = [album.artist.name]
+    track["\xa9day"] = [album.date or ""]
+    track["\xa9ART"] = [trackItemSlot.artist.name]
+    track["trkn"] = [
+        (
+            _int_or_zero(trackItemSlot.trackNumber),
+            _int_or_zero(album.numberOfTracks),
         )
-    track.save()
+    ]
+    track["disk"] = [
+        (
+            _int_or_zero(trackItemSlot.volumeNumber),
+            _int_or_zero(album.numberOfVolumes),
+        )
+    ]
+    track["cprt"] = [trackItemSlot.copyright or ""]
+    for name, value in (
+        ("ISRC", trackItemSlot.isrc),
+        ("BARCODE", album.upc),
+        ("ARTISTS", "; ".join(a.name for a in trackItemSlot.artists)),
+        ("REPLAYGAIN_TRACK_GAIN", str(trackItemSlot.replayGain)),
+    ):
+        if value:
+            track[f"----:com.apple.iTunes:{name}"] = [
+                MP4FreeForm(str(value).encode("utf-8"))
+            ]
+    if artworkBytes:
+        imageFormat = (
+            MP4Cover.FORMAT_PNG
+            if artworkBytes[:4] == b"\x89PNG"
+            else MP4Cover.FORMAT_JPEG
+        )
+        track["covr"] = [MP4Cover(artworkBytes, imageformat=imageFormat)]
 
+    if hasattr(fileThing, "seek"):
+        fileThing.seek(0)
+        track.save(fileThing)
+    else:
+        track.save()
+    logger.debug(
+        "Tagged %s - %s (mp4, cover: %s)",
+        trackItemSlot.title,
+        trackItemSlot.artist.name,
+        bool(artworkBytes),
+    )
 
-def add_cover(FilePath, artworkBytes):
-    track = music_tag.load_file(FilePath)
 
-    # Add a new picture
-    track["artwork"] = artworkBytes
-    track.save()
+def tag_audio(fileThing, extension, trackItemSlot: TrackItemSlot, artworkBytes=None):
+    """
+    Tags a downloaded track by its file extension
+    """
+    match extension:
+        case "flac":
+            tag_flac(fileThing, trackItemSlot, artworkBytes)
+        case "m4a":
+            tag_mp4(fileThing, trackItemSlot, artworkBytes)
+        case _:
+            raise ValueError(f"Can't tag .{extension} files")
 
 
 def get_mp3_info(filePath):
@@ -97,3 +209,29 @@ def get_flac_info(filePath):
     artbytes = track.pictures[0].data
     trackTags["ARTWORK"] = base64.b64encode(artbytes).decode()
     return trackTags
+
+
+def get_mp4_info(filePath):
+    trackTags = {
+        "title": [],
+        "album": [],
+        "albumartist": [],
+        "date": [],
+        "artist": [],
+        "tracknumber": [],
+        "discnumber": [],
+    }
+    track = MP4(filePath)
+    tags = track.tags or {}
+    trackTags["title"] = list(tags.get("\xa9nam", []))
+    trackTags["album"] = list(tags.get("\xa9alb", []))
+    trackTags["albumartist"] = list(tags.get("aART", []))
+    trackTags["date"] = list(tags.get("\xa9day", []))
+    trackTags["artist"] = list(tags.get("\xa9ART", []))
+    trackTags["tracknumber"] = [str(n) for n, _ in tags.get("trkn", [])]
+    trackTags["discnumber"] = [str(n) for n, _ in tags.get("disk", [])]
+
+    trackTags["LENGTH"] = track.info.length
+    covers = tags.get("covr", [])
+    trackTags["ARTWORK"] = base64.b64encode(bytes(covers[0])).decode() if covers else ""
+    return trackTags
@@ -0,0 +1,284 @@
+# pylint: disable=invalid-name
+"""
+Durable sqlite run queue for the distributed worker mode.
+
+The API/scheduler node enqueues runs, worker processes (same host or nodes sharing
+the database file) claim them under a lease and keep it alive with heartbeats.
+A run whose lease expires is handed to the next worker, so a dead worker doesn't
+lose the run. The same database holds the rate limiter slots shared by every worker.
+"""
+
+import random
+import socket
+import sqlite3
+import threading
+import time
+import os
+from os import makedirs, path
+
+from utils import jsoncodec
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    provider TEXT NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 0,
+    state TEXT NOT NULL DEFAULT 'queued',
+    enqueuedAt REAL NOT NULL,
+    readyAt REAL NOT NULL,
+    worker TEXT,
+    leaseUntil REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    progress TEXT,
+    error TEXT,
+    finishedAt REAL
+);
+CREATE INDEX IF NOT EXISTS runs_state ON runs (state, priority, readyAt);
+CREATE TABLE IF NOT EXISTS rate_slots (
+    key TEXT PRIMARY KEY,
+    nextAt REAL NOT NULL
+);
+"""
+
+# states a run can be claimed from
+ACTIVE_STATES = ("queued", "running")
+
+
+def worker_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class WorkQueue:
+    """
+    config keys (all optional):
+        queuePath: sqlite file, must be reachable by every worker
+        lease: seconds a claim stays valid without heartbeat
+        maxAttempts: claims before a run is marked failed
+        providerConcurrency: {"hifi": 1} max runs per provider across all workers
+    """
+
+    def __init__(self, config=None):
+        config = config or {}
+        self.dbPath = path.abspath(config.get("queuePath", "data/queue.sqlite"))
+        self.lease = config.get("lease", 120)
+        self.maxAttempts = config.get("maxAttempts", 3)
+        self.providerConcurrency = config.get("providerConcurrency", {})
+        self.defaultConcurrency = config.get("defaultConcurrency", 1)
+        makedirs(path.dirname(self.dbPath), exist_ok=True)
+        with self._connect() as db:
+            db.executescript(SCHEMA)
+
+    def _connect(self):
+        db = sqlite3.connect(self.dbPath, timeout=30, isolation_level=None)
+        db.execute("PRAGMA journal_mode=WAL")
+        return db
+
+    def _transaction(self, db):
+        # IMMEDIATE takes the write lock up front, claims can't interleave
+        db.execute("BEGIN IMMEDIATE")
+
+    def enqueue(self, name, provider, priority=0, delay=0.0) -> bool:
+        """
+        Queues a run, a run already queued or running is coalesced and returns False.
+        """
+        now = time.time()
+        db = self._connect()
+        try:
+            self._transaction(db)
+            existing = db.execute(
+                "SELECT id FROM runs WHERE name = ? AND state IN (?, ?)",
+                (name, *ACTIVE_STATES),
+            ).fetchone()
+            if existing is not None:
+                db.execute("COMMIT")
+                return False
+            db.execute(
+                "INSERT INTO runs (name, provider, priority, enqueuedAt, readyAt) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (name, provider, priority, now, now + delay),
+            )
+            db.execute("COMMIT")
+            return True
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        finally:
+            db.close()
+
+    def claim(self, worker) -> dict | None:
+        """
+        Claims the best ready run: queued ones or running ones with an expired lease.
+        """
+        now = time.time()
+        db = self._connect()
+        try:
+            self._transaction(db)
+            busy = dict(
+                db.execute(
+                    "SELECT provider, COUNT(*) FROM runs "
+                    "WHERE state = 'running' AND leaseUntil >= ? GROUP BY provider",
+                    (now,),
+                ).fetchall()
+            )
+            rows = db.execute(
+                "SELECT id, name, provider, attempts FROM runs "
+                "WHERE readyAt <= ? AND (state = 'queued' "
+                "OR (state = 'running' AND leaseUntil < ?)) "
+                "ORDER BY priority DESC, readyAt",
+                (now, now),
+            ).fetchall()
+            for runId, name, provider, attempts in rows:
+                if attempts >= self.maxAttempts:
+                    db.execute(
+                        "UPDATE runs SET state = 'failed', error = ?, finishedAt = ? "
+                        "WHERE id = ?",
+                        ("lease expired too many times", now, runId),
+                    )
+                    continue
+                limit = self.providerConcurrency.get(provider, self.defaultConcurrency)
+                if busy.get(provider, 0) >= limit:
+                    continue
+                db.execute(
+                    "UPDATE runs SET state = 'running', worker = ?, leaseUntil = ?, "
+                    "attempts = attempts + 1 WHERE id = ?",
+                    (worker, now + self.lease, runId),
+                )
+                db.execute("COMMIT")
+                return {"id": runId, "name": name, "provider": provider}
+            db.execute("COMMIT")
+            return None
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        finally:
+            db.close()
+
+    def heartbeat(self, runId, worker, progress=None) -> bool:
+        """
+        Extends the lease, returns False if the run was taken over by another worker.
+        """
+        with self._connect() as db:
+            cursor = db.execute(
+                "UPDATE runs SET leaseUntil = ?, progress = COALESCE(?, progress) "
+                "WHERE id = ? AND worker = ? AND state = 'running'",
+                (
+                    time.time() + self.lease,
+                    None if progress is None else jsoncodec.dumps(progress).decode(),
+                    runId,
+                    worker,
+                ),
+            )
+            return cursor.rowcount == 1
+
+    def defer(self, runId, worker, seconds):
+        """
+        Puts a claimed run back in the queue for later, the claim doesn't count as an attempt.
+        """
+        with self._connect() as db:
+            db.execute(
+                "UPDATE runs SET state = 'queued', readyAt = ?, worker = NULL, "
+                "leaseUntil = NULL, attempts = attempts - 1 WHERE id = ? AND worker = ?",
+                (time.time() + seconds, runId, worker),
+            )
+
+    def finish(self, runId, worker, error=None):
+        with self._connect() as db:
+            db.execute(
+                "UPDATE runs SET state = ?, error = ?, finishedAt = ?, leaseUntil = NULL "
+                "WHERE id = ? AND worker = ?",
+                ("failed" if error else "done", error, time.time(), runId, worker),
+            )
+
+    def status(self, finished=20) -> dict:
+        with self._connect() as db:
+            db.row_factory = sqlite3.Row
+            active = db.execute(
+                "SELECT * FROM runs WHERE state IN (?, ?) ORDER BY priority DESC, readyAt",
+                ACTIVE_STATES,
+            ).fetchall()
+            done = db.execute(
+                "SELECT * FROM runs WHERE state NOT IN (?, ?) "
+                "ORDER BY finishedAt DESC LIMIT ?",
+                (*ACTIVE_STATES, finished),
+            ).fetchall()
+        return {
+            "active": [dict(r) for r in active],
+            "finished": [dict(r) for r in done],
+        }
+
+    def reserve_slot(self, key, interval) -> float:
+        """
+        Reserves the next free slot for key, spaced interval seconds apart across
+        every worker, and returns how many seconds to wait for it.
+        """
+        now = time.time()
+        db = self._connect()
+        try:
+            self._transaction(db)
+            row = db.execute(
+                "SELECT nextAt FROM rate_slots WHERE key = ?", (key,)
+            ).fetchone()
+            slot = max(now, row[0] if row else 0)
+            db.execute(
+                "INSERT OR REPLACE INTO rate_slots (key, nextAt) VALUES (?, ?)",
+                (key, slot + interval),
+            )
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        finally:
+            db.close()
+        return slot - now
+
+
+class SharedRateLimiter:
+    """
+    Request spacing per key shared by every worker through the queue database.
+    """
+
+    def __init__(self, workQueue: WorkQueue, interval=2.0):
+        self.workQueue = workQueue
+        self.interval = interval
+
+    def acquire(self, key, interval=None):
+        wait = self.workQueue.reserve_slot(
+            key, self.interval if interval is None else interval
+        )
+        if wait > 0:
+            time.sleep(wait)
+
+
+class Heartbeat:
+    """
+    Background lease renewal for a claimed run.
+    """
+
+    def __init__(self, workQueue: WorkQueue, runId, worker, interval, progress=None):
+        self.workQueue = workQueue
+        self.runId = runId
+        self.worker = worker
+        self.interval = interval
+        self.progress = progress  # callable returning the run progress to store
+        self.lost = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._beat, name=f"heartbeat-{runId}", daemon=True
+        )
+
+    def _beat(self):
+        # small jitter so workers started together don't beat in lockstep
+        while not self._stop.wait(self.interval * random.uniform(0.9, 1.1)):
+            progress = self.progress() if self.progress is not None else None
+            if not self.workQueue.heartbeat(self.runId, self.worker, progress):
+                self.lost.set()
+                return
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
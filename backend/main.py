@@ -4,18 +4,17 @@ Main fastAPI module for Terabithia
 
 # pylint: disable=invalid-name,broad-exception-caught
 # mypy: disable-error-code="import-untyped"
-import time
+import asyncio
 import datetime
 import os
-import re
-import json
-from os import path, makedirs, walk
+import random
+from os import path, walk
 from pathlib import Path
-import logging
 from contextlib import asynccontextmanager
 
 
-from fastapi import HTTPException, FastAPI
+from fastapi import HTTPException, FastAPI, Request
+from fastapi.responses import FileResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.encoders import jsonable_encoder
 from pydantic import ValidationError
@@ -24,43 +23,42 @@ from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.events import EVENT_JOB_EXECUTED, EVENT_JOB_ERROR
 from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
 
-from core import tagger
+from api import httpclient
+from api.lbz_api import radioCache, warm_radios
+from api.metaindex import MetaIndex, get_index
+from core import prefetch, quota, runner
+from core.events import bus
+from core.bandwidth import bandwidth
+from core.hedge import hedger
+from core.library import library
+from core.pacer import pacer
+from core.profiling import profiling
+from core.dispatcher import Dispatcher
+from core.workqueue import WorkQueue
+from core.procexec import ProcessExecutor
 from models.models import BlueprintSlot, BlueprintSlotUpdate, TrackItemSlot, RunItem
-from api.linkapi import MetaLinkApi, AudioLinkApi
-from utils.utils import match_candidate_to_track, generate_report
+from utils import jsoncodec
+from utils.config import load_config
+from utils.logsetup import LogRouter
 from local_ffmpeg import is_installed, install
 
-
 # Load configuration
 
 WEBUI_URL = os.getenv("WEBUI_URL", "http://localhost:8989")
 
-try:
-    with open("data/config.json", "rb") as conf:
-        config = json.loads(conf.read())
-except OSError:
-    with open("data/config.example", "rb") as conf:
-        config = json.loads(conf.read())
+config = load_config()
 # Setup logging
-formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+logRouter = LogRouter(config)
+logRouter.prune()
 # Main Logger
-logger = logging.getLogger("Terabithia")
-mfh = logging.FileHandler(f"data/logs/main-{int(time.time())}.log")
-logger.setLevel(config["logLevel"])
-mfh.setFormatter(formatter)
-logger.addHandler(mfh)
+logger = logRouter.get_logger("Terabithia", "main.log")
 # Scheduler Log
-schedlogger = logging.getLogger("APScheduler")
-fh = logging.FileHandler(f"data/logs/scheduler-{int(time.time())}.log")
-schedlogger.setLevel(config["logLevel"])
-fh.setFormatter(formatter)
-schedlogger.addHandler(fh)
+schedlogger = logRouter.get_logger("APScheduler", "scheduler.log")
 
 # Dynamic Run Logger Builder
-run_handlers = []
-
-runlogger = logging.getLogger("Runner")
-runlogger.setLevel(config["logLevel"])
+runlogger = logRouter.get_logger("Runner", "runner.log")
+logRouter.start()
+runner.init(config, logRouter)
 
 # Check if FFmpeg is already installed
 if not is_installed("/usr/local/bin/"):
@@ -74,13 +72,6 @@ else:
     logger.info("ffmpeg already installed")
 
 
-def build_logger(playlist):
-    rfh = logging.FileHandler(f"data/logs/run-{playlist}-{int(time.time())}.log")
-    rfh.setFormatter(formatter)
-    runlogger.addHandler(rfh)
-    run_handlers.append(rfh)
-
-
 # Scheduler callback functions
 def error_callback(e):
     logger.error("Error in Scan Blueprint Directory %s", e, exc_info=True)
@@ -91,240 +82,55 @@ def job_callback(event):
         logger.error("Error in job: %s", event.exception)
     else:
         logger.info("Job %s Runned Succesfully", event.job_id)
-    # removes custom runner handler after job run, we don't use concurrence so we can safely remove all handlers
-    for h in run_handlers:
-        runlogger.removeHandler(h)
-
-
-def fetchhifi(playlist):
-    runlogger.info("Building playlist: %s", playlist["name"])
-
-    metaApi = MetaLinkApi(playlist["metaApi"], config["token"])
-    audioApi = AudioLinkApi(playlist["audioApi"])
-
-    # get candidate tracks from api
-    candidateList = metaApi.api.get_candidates(playlist)
-
-    # matches candidates to available tracks
-    for i in candidateList:
-        time.sleep(4)
-        # API returns a list of TrackItemSlot from a prompt
-        trackSlotList = audioApi.api.search_track(f"{i.title} {i.artist}")
-        match = False
-        for trackSlot in trackSlotList:
-            time.sleep(4)
-
-            # append only if name + artist is in the track infos
-            runlogger.info(
-                "\nChecking Item: Title: %s Artist: %s\nWith: Title: %s Artist: %s Feat: %s\n",
-                i.title,
-                i.artist,
-                trackSlot.title,
-                trackSlot.artist.name,
-                [t.name for t in trackSlot.artists],
-            )
-            if match_candidate_to_track(i, trackSlot):
-                # get additional album info if matching
-                try:
-                    trackSlot.album = audioApi.api.get_album_info(trackSlot.album.id)
-                    trackList.append(trackSlot)
-                except ConnectionError as e:
-                    runlogger.error("Error Getting album info %s", e)
-                    continue
-                runlogger.info(
-                    "Matched: %s - %s\n", trackSlot.title, trackSlot.artist.name
-                )
-                match = True
-                break  # breaks after the first match
-
-        if not match:
-            runlogger.warning("No Match For: %s - %s\n", i.title, i.artist)
-
-        # Breaks if reached the number of tracks requested
-        if len(trackList) > playlist["quantity"]:
-            break
-
-    # get track files from queue list and
-    # builds playlist appending tracks to the m3u
-    m3u = []
-    m3u.append("#EXTM3U")
-    m3u.append(f"#{playlist['name']}")
-    for t in trackList:
-        time.sleep(10)
-        # get file manifest and info
-        trackInfoSlot = audioApi.api.get_track_manifest(t.id, t.audioQuality)
-
-        # get artwork and audio file
-        runlogger.info(
-            "Downloading Item: Title: %s - Artist: %s", t.title, t.artist.name
-        )
-
-        # make dirs recursively
-        # sanitize album name
-        albumTitle = "".join(x for x in t.album.title if (x.isalnum() or x in "._- "))
-        try:
-            dirPath = path.abspath(f"output/music/{t.artist.name}/{albumTitle}")
-            makedirs(dirPath, exist_ok=True)
-        except OSError as e:
-            runlogger.error(
-                "Error Making Directory: %s \nWith Error: %s",
-                dirPath,
-                e,
-                exc_info=True,
-            )
-
-        # sanitize filename
-        fileTitle = "".join(x for x in t.title if (x.isalnum() or x in "._- "))
-
-        filePath = path.abspath(
-            f"output/music/{t.artist.name}/{albumTitle}/{fileTitle} - {t.artist.name}.{trackInfoSlot.codecs}"
-        )
-
-        # check existing files
-        try:
-            with open(filePath, "rb") as f:
-                if f:
-                    pass
-            logger.info("Track %s already exists, skipping download", fileTitle)
-            break  # file Exists
-        except OSError:
-            pass
-
-        # Get file and artwork
-        time.sleep(5)
-        trackBytes = audioApi.api.get_track_file(trackInfoSlot.url)
-        time.sleep(5)
-        trackArtworkBytes = audioApi.api.get_album_art(t.album.cover)
-
-        # write files to disk and append relative path to m3u
-        time.sleep(2)
-        try:
-            with open(
-                filePath,
-                mode="wb",
-            ) as file:
-                file.write(trackBytes)
-            m3u.append(
-                f"../music/{t.artist.name}/{albumTitle}/{fileTitle} - {t.artist.name}.{trackInfoSlot.codecs}"
-            )
-        except OSError as e:
-            runlogger.error(
-                "ERROR: Can't write: %s - %s.%s \nError: %s",
-                fileTitle,
-                t.artist.name,
-                trackInfoSlot.codecs,
-                e,
-                exc_info=True,
-            )
-
-        # tag succesfully written files
-        tagger.tag_flac(filePath, t)
-        tagger.add_cover(filePath, trackArtworkBytes)
-        runlogger.info("Cover Added to Track: %s - %s \n", t.title, t.artist.name)
-
-    # write m3u8 playlist file to disk
-    with open(
-        f"output/playlists/{playlist['name']}.m3u8",
-        encoding="utf-8",
-        mode="w",
-    ) as file:
-        for line in m3u:
-            file.write(line + "\n")
-    runlogger.info("Playlist %s downloaded - Generating Report..", playlist["name"])
-    make_report(
-        playlistName=playlist["name"],
-        runnedAt=str(datetime.datetime.now()),
-        blueprint=playlist,
-        alogger=runlogger,
-    )
-
-
-def fetchscl(playlist):
-    runlogger.info("Building playlist: %s", playlist["name"])
-    # setting global path, the rest of the path is build by yt_dlp
-    dirPath = path.abspath("output/music")
-
-    audioApi = AudioLinkApi(playlist["audioApi"], path=dirPath)
-    # yt_dlp takes care of embedding metadata and thumbnail, as well as downloading to the set path
-    # return the list of tracks to pass to the playlist builder
-    trackList = audioApi.api.get_info_url(url=playlist["prompt"], logger=runlogger)
-    # get track files from queue list and
-    # builds playlist appending tracks to the m3u
-    m3u = []
-    m3u.append("#EXTM3U")
-    m3u.append(f"#{playlist['name']}")
-
-    for idx, t in enumerate(trackList, start=1):
-        safe_filename = re.sub(r"[\\/*?:\"<>|]", "-", t.title)
-        safe_artist = re.sub(r"[\\/*?:\"<>|]", "-", t.artist.name)
-        safe_album = re.sub(r"[\\/*?:\"<>|]", "-", t.album.title)
-        relfilepath = f"/{safe_artist}/{safe_album}/{safe_filename}"  # not adding extension to allow yt-dlp to add it's own
-        audioApi.api.let_download_url(
-            playlist["prompt"], runlogger, relfilepath, idx
-        )  # keeping main playlist url to keep metadata
-        try:
-            m3u.append(f"../music{relfilepath}.{t.trackinfoslot.codecs}")
-        except Exception as e:
-            runlogger.error(
-                "ERROR: Error: %s",
-                e,
-                exc_info=True,
-            )
-
-    # write m3u8 playlist file to disk
-    with open(
-        f"output/playlists/{playlist['name']}.m3u8",
-        encoding="utf-8",
-        mode="w",
-    ) as file:
-        for line in m3u:
-            file.write(line + "\n")
-    runlogger.info("Playlist %s downloaded - Generating Report..", playlist["name"])
-    make_report(
-        playlistName=playlist["name"],
-        runnedAt=str(datetime.datetime.now()),
-        blueprint=playlist,
-        alogger=runlogger,
-    )
 
 
 def fetch(playlistName):
-    build_logger(playlistName)
-    runlogger.info("Running Job %s", playlistName)
-    blueprints = []
-    playlist = None
-    # pylint: disable-next=unused-variable
-    for dirpath, dirnames, filenames in walk(
-        path.abspath("blueprints"),
-        onerror=error_callback,
-    ):
-        runlogger.debug("Scanning %s", dirpath)
-        for file in filenames:
-            blueprints.append(path.join(dirpath, file))
-            runlogger.debug("Found Blueprint %s", file)
-        break  # return only root bp folder
+    """
+    Runs a blueprint, in a child process with the "process" executor
+    or in the current thread, kept as job target for stored schedules
+    """
+    if processExecutor is not None:
+        processExecutor.run(playlistName)
+        return
+    runner.fetch(playlistName)
 
-    for p in blueprints:
-        with open(p, "rb") as item:
-            playlistEntry = json.loads(item.read())
-            if playlistEntry["name"] == playlistName:
-                playlist = playlistEntry
-                break
-    if playlist is None:
-        runlogger.error("No Playlist Found for %s", playlistName)
-        return HTTPException(447, "No Playlist Found")
 
-    if playlist["audioApi"] == "scl":
-        fetchscl(playlist)
-    if playlist["audioApi"] == "hifi":
-        fetchhifi(playlist)
+def dispatch_fetch(playlistName):
+    """
+    Scheduled job target, queues the run on the dispatcher instead of running it
+    """
+    try:
+        playlistEntry = jsoncodec.load_file(
+            path.abspath(f"blueprints/{playlistName}.json")
+        )
+    except OSError as e:
+        logger.error("No Blueprint Found for %s: %s", playlistName, e)
+        return
+    if workQueue is not None:
+        # distributed mode, a worker process claims it
+        workQueue.enqueue(
+            playlistName,
+            provider=playlistEntry["audioApi"],
+            priority=playlistEntry.get("priority", 0),
+            delay=random.uniform(0, dispatchConfig.get("jitter", 0)),
+        )
+        return
+    dispatcher.submit(
+        playlistName,
+        provider=playlistEntry["audioApi"],
+        priority=playlistEntry.get("priority", 0),
+    )
 
 
 # Initialize scheduler
 jbs_name = "jbs_name"
 schedule_store_path = path.abspath("data/schedule.json")
 job_defaults_config = {"coalesce": True}
-executors_default = {"default": {"type": "threadpool", "max_workers": 1}}
+executors_default = {
+    "default": {"type": "threadpool", "max_workers": 1},
+    # long maintenance jobs, they don't hold up the scheduled runs
+    "background": {"type": "threadpool", "max_workers": 1},
+}
 jobstore_config = {"jbs_name": SQLAlchemyJobStore(url="sqlite:///data/schedule.sqlite")}
 scheduler = BackgroundScheduler(
     job_defaults=job_defaults_config,
@@ -335,6 +141,101 @@ scheduler = BackgroundScheduler(
 scheduler.start()
 scheduler.add_listener(job_callback, EVENT_JOB_EXECUTED | EVENT_JOB_ERROR)
 
+# Run executor, "thread" runs in the dispatcher threads, "process" in a child process per run
+processExecutor = None
+if config.get("executor", "thread") == "process":
+    processExecutor = ProcessExecutor(config, logRouter)
+
+# Initialize run dispatcher, scheduled jobs only queue runs on it
+# in "distributed" mode runs go to the sqlite work queue and worker.py processes run them
+dispatchConfig = config.get("dispatch", {})
+dispatcher = Dispatcher(fetch, dispatchConfig, admit=quota.blueprint_defer)
+workQueue = None
+if config.get("mode", "local") == "distributed":
+    workQueue = WorkQueue({**dispatchConfig, **config.get("worker", {})})
+else:
+    dispatcher.start()
+# prefetched playlists held until their scheduled time
+scheduler.add_job(
+    prefetch.publish_due,
+    trigger="interval",
+    seconds=30,
+    id="publish-prefetched",
+    replace_existing=True,
+)
+
+
+def runs_active() -> bool:
+    if workQueue is not None:
+        return any(r["state"] == "running" for r in workQueue.status()["active"])
+    return bool(dispatcher.status()["running"])
+
+
+def run_retention():
+    """
+    Retention pass, skipped while runs are active and paused when one starts
+    """
+    if runs_active():
+        logger.info("Retention skipped, runs are active")
+        return
+    library.enforce(busy=runs_active)
+
+
+# library retention, low priority in its own executor
+if library.settings["enabled"]:
+    scheduler.add_job(
+        run_retention,
+        trigger="interval",
+        hours=library.settings["interval"],
+        id="retention",
+        executor="background",
+        replace_existing=True,
+    )
+
+
+def pregenerate_radios():
+    """
+    Generates the LB radios of the blueprints due within the lead time,
+    so their runs start from the cache
+    """
+    radioCache.prune()
+    dueBefore = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(
+        minutes=radioCache.settings["lead"]
+    )
+    pairs = []
+    for job in scheduler.get_jobs(jbs_name):
+        if job.next_run_time is None or job.next_run_time > dueBefore:
+            continue
+        try:
+            playlistEntry = jsoncodec.load_file(
+                path.abspath(f"blueprints/{job.id}.json")
+            )
+        except OSError:
+            continue
+        if playlistEntry.get("metaApi") == "lbz":
+            pairs.append((playlistEntry["prompt"], playlistEntry["mode"]))
+    if pairs:
+        ready = warm_radios(pairs, config["token"])
+        logger.info("Pre-generated %d of %d due radios", ready, len(set(pairs)))
+
+
+# radios of due blueprints are generated ahead, together
+if radioCache.settings["ttl"] > 0:
+    if radioCache.settings["ttl"] < radioCache.settings["lead"] * 60:
+        logger.warning("radioCache ttl is shorter than its lead, radios expire early")
+    scheduler.add_job(
+        pregenerate_radios,
+        trigger="interval",
+        minutes=radioCache.settings["interval"],
+        id="pregenerate-radios",
+        executor="background",
+        replace_existing=True,
+    )
+# jobs stored before the dispatcher existed still point to fetch
+for storedJob in scheduler.get_jobs(jbs_name):
+    if storedJob.func is fetch:
+        scheduler.modify_job(storedJob.id, jbs_name, func=dispatch_fetch)
+
 
 # Initialize FastAPI
 # Ensure the scheduler shuts down properly on application exit.
@@ -342,7 +243,10 @@ scheduler.add_listener(job_callback, EVENT_JOB_EXECUTED | EVENT_JOB_ERROR)
 async def lifespan(app: FastAPI):
     yield
     scheduler.shutdown()
+    dispatcher.stop()
+    httpclient.close()
     logger.info("Scheduler shutdown")
+    logRouter.stop()
 
 
 app = FastAPI(lifespan=lifespan, title="Terabithia API")
@@ -380,7 +284,7 @@ def get_blueprints() -> list[BlueprintSlot]:
     blueprintSlots: list[BlueprintSlot] = []
     for playlist in blueprints:
         with open(playlist, "rb") as item:
-            playlistEntry = json.loads(item.read())
+            playlistEntry = jsoncodec.loads(item.read())
             try:
                 blueprintSlots.append(BlueprintSlot(**playlistEntry))
             except ValidationError as e:
@@ -412,7 +316,7 @@ def get_blueprint(playlistName) -> BlueprintSlot:
     blueprintSlot: BlueprintSlot
     for playlist in blueprints:
         with open(playlist, "rb") as item:
-            playlistEntry = json.loads(item.read())
+            playlistEntry = jsoncodec.loads(item.read())
             if playlistEntry.name == playlistName:
                 try:
                     blueprintSlot = BlueprintSlot(**playlistEntry)
@@ -448,7 +352,7 @@ def set_blueprint(name: str, item: BlueprintSlotUpdate) -> BlueprintSlot:
     updated_item: BlueprintSlot
     for playlist in blueprints:
         with open(playlist, "rb") as p:
-            playlistEntry = json.loads(p.read())
+            playlistEntry = jsoncodec.loads(p.read())
             if playlistEntry["name"] != name:
                 continue
 
@@ -466,8 +370,8 @@ def set_blueprint(name: str, item: BlueprintSlotUpdate) -> BlueprintSlot:
             raise HTTPException(445, "Error editing blueprint, check Logs") from e
 
         try:
-            with open(playlist, "w", encoding="utf-8") as p:
-                json.dump(jsonable_encoder(updated_item), p, ensure_ascii=False)
+            with open(playlist, "wb") as p:
+                p.write(jsoncodec.dumps(jsonable_encoder(updated_item)))
                 break
         except Exception as e:
             logger.error("Error on writing blueprint %s", e, exc_info=True)
@@ -487,10 +391,8 @@ def make_blueprint(item: BlueprintSlot) -> BlueprintSlot:
     try:
         updated_item = item.model_dump()
         try:
-            with open(
-                path.abspath(f"blueprints/{item.name}.json"), "x", encoding="utf-8"
-            ) as p:
-                json.dump(jsonable_encoder(updated_item), p, ensure_ascii=False)
+            with open(path.abspath(f"blueprints/{item.name}.json"), "xb") as p:
+                p.write(jsoncodec.dumps(jsonable_encoder(updated_item)))
         except FileExistsError as e:
             logger.error("Blueprint Already Existing")
             raise HTTPException(499, "Blueprint Already existing") from e
@@ -540,42 +442,27 @@ def set_job(playlistName: str):
     every: str = "weekly" for weekly cadence, "monthly" for monthly cadence\n
     in "weekly" mode you have weekday, hour and minute as extra args\n
     in "montly" mode you have day ( of month ) and month as extra args\n
+    prefetch: int = minutes the run starts early, the playlist is published at the scheduled time\n
 
     returns: 201 for created entry or 404 for mode not found
     """
     with open(path.abspath(f"blueprints/{playlistName}.json"), "rb") as item:
-        playlistEntry = json.loads(item.read())
-    if playlistEntry["every"] == "weekly":
-        scheduler.add_job(
-            fetch,
-            args=[playlistName],
-            trigger="cron",
-            day_of_week=playlistEntry["weekday"],
-            hour=playlistEntry["hour"],
-            minute=playlistEntry["minute"],
-            id=playlistName,
-            name=playlistName,
-            misfire_grace_time=None,  # ensure old schedules are coalesced and runned one time
-            replace_existing=True,
-            jobstore=jbs_name,
-        )
-        return
-    if playlistEntry.every == "monthly":
-        scheduler.add_job(
-            fetch,
-            args=[playlistName],
-            trigger="cron",
-            day=playlistEntry["day"],
-            month=playlistEntry["month"],
-            hour=playlistEntry["hour"],
-            id=playlistName,
-            name=playlistName,
-            misfire_grace_time=None,  # ensure old schedules are coalesced and runned one time
-            replace_existing=True,
-            jobstore=jbs_name,
-        )
-        return
-    return 404
+        playlistEntry = jsoncodec.loads(item.read())
+    # with a prefetch window the job fires that many minutes before the schedule
+    trigger = prefetch.blueprint_trigger(playlistEntry)
+    if trigger is None:
+        return 404
+    scheduler.add_job(
+        dispatch_fetch,
+        args=[playlistName],
+        trigger=trigger,
+        id=playlistName,
+        name=playlistName,
+        misfire_grace_time=None,  # ensure old schedules are coalesced and runned one time
+        replace_existing=True,
+        jobstore=jbs_name,
+    )
+    return
 
 
 @app.post("/schedule/clear/{playlistName}")
@@ -603,6 +490,48 @@ def toggle_scheduler(enabled: bool):
     scheduler.pause()
 
 
+@app.get("/scheduler/queue")
+def get_run_queue():
+    """
+    returns the runs waiting on the dispatcher and the ones executing
+    """
+    if workQueue is not None:
+        return workQueue.status()
+    return dispatcher.status()
+
+
+@app.get("/scheduler/pacing")
+def get_pacing():
+    """
+    returns the current request interval of every host this process talks to
+    """
+    return pacer.status()
+
+
+@app.get("/scheduler/quota")
+def get_quota():
+    """
+    returns the requests and bytes used per limited provider in the current window
+    """
+    return quota.ledger.status()
+
+
+@app.get("/scheduler/bandwidth")
+def get_bandwidth():
+    """
+    returns the current download limit and whether downloads are being throttled hard
+    """
+    return bandwidth.status()
+
+
+@app.get("/scheduler/hedging")
+def get_hedging():
+    """
+    returns the hedged request settings and counters, hedgeWins are the hedges that answered first
+    """
+    return hedger.status()
+
+
 @app.get("/scheduler/state")
 def heartbeat():
     match scheduler.state:
@@ -616,6 +545,159 @@ def heartbeat():
             return "Status Unknown"
 
 
+## Run Progress Methods ##
+@app.get("/runs/active")
+def get_active_runs():
+    """
+    returns the latest state of running and recently finished runs
+    """
+    return bus.snapshot()
+
+
+@app.get("/runs/events")
+async def stream_run_events(request: Request):
+    """
+    Server-Sent Events stream of run progress
+
+    sends the current state of every run first, then the updated state on every event:
+    started, candidates, matched, unmatched, downloading (bytes, total, rate), tagged, track, done, failed
+    """
+    queue = bus.subscribe()
+
+    async def event_stream():
+        try:
+            for state in bus.snapshot():
+                yield f"data: {jsoncodec.dumps(state).decode()}\n\n"
+            while not await request.is_disconnected():
+                try:
+                    entry = await asyncio.wait_for(queue.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"data: {jsoncodec.dumps(entry).decode()}\n\n"
+        finally:
+            bus.unsubscribe(queue)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+## Library Methods ##
+@app.get("/library/status")
+def get_library_status():
+    """
+    returns the indexed tracks, their size and the disk quota
+    """
+    return library.status()
+
+
+@app.post("/library/pin")
+def pin_track(trackPath: str, pinned: bool = True):
+    """
+    Pins a track (path relative to output/, ex. music/Artist/Album/Title - Artist.flac)
+    so retention never evicts it
+    """
+    if not library.pin(trackPath, pinned):
+        raise HTTPException(404, "Track not in library index")
+    return 200
+
+
+@app.post("/library/retention", status_code=202)
+def start_retention():
+    """
+    Starts a retention pass in the background
+    """
+    scheduler.add_job(
+        run_retention, executor="background", id="retention-now", replace_existing=True
+    )
+
+
+## Metadata Index Methods ##
+@app.get("/metaindex/status")
+def get_metaindex_status():
+    """
+    returns the recordings in the offline metadata index and the imported dumps
+    """
+    index = get_index(config.get("metaIndex", "data/metaindex.sqlite"))
+    return {"recordings": 0, "imports": []} if index is None else index.status()
+
+
+@app.post("/metaindex/import", status_code=202)
+def import_metaindex(dumpPath: str):
+    """
+    Imports a recordings dump (path on the server) in the background, resumes partial imports
+    """
+    if not path.exists(dumpPath):
+        raise HTTPException(404, "Dump not found")
+    index = MetaIndex(config.get("metaIndex", "data/metaindex.sqlite"))
+    scheduler.add_job(
+        index.import_dump,
+        args=[dumpPath],
+        executor="background",
+        id="metaindex-import",
+        replace_existing=True,
+    )
+
+
+@app.get("/blueprint/plan/{playlistName}")
+def plan_blueprint(playlistName: str):
+    """
+    Dry run of the blueprint, nothing is downloaded
+
+    returns the candidates, library and ISRC cache hits and the estimated
+    tracks, requests, bytes and seconds of a real run
+    """
+    result = runner.plan(playlistName)
+    if result is None:
+        raise HTTPException(404, "Blueprint not found")
+    return result
+
+
+## Profiling Methods ##
+@app.post("/profiles/{playlistName}", status_code=202)
+def profile_run(playlistName: str, now: bool = False):
+    """
+    Profiles the next run of the blueprint, scheduled or manual
+
+    now: bool = queues a profiled run right away\n
+    the cProfile and tracemalloc reports land in output/profiles/{run}/
+    """
+    if not path.isfile(path.abspath(f"blueprints/{playlistName}.json")):
+        raise HTTPException(404, "Blueprint not found")
+    profiling.arm(playlistName)
+    if now:
+        dispatch_fetch(playlistName)
+
+
+@app.post("/profiles/{playlistName}/cancel")
+def cancel_profile(playlistName: str):
+    if not profiling.disarm(playlistName):
+        raise HTTPException(404, "No profiled run pending")
+    return 200
+
+
+@app.get("/profiles")
+def get_profiles():
+    """
+    returns the blueprints waiting for a profiled run and the stored profiles
+    """
+    return {"armed": profiling.armed(), "runs": profiling.runs()}
+
+
+@app.get("/profiles/{run}/{fileName}")
+def download_profile(run: str, fileName: str):
+    """
+    fileName: str = profile.pstats, profile.txt, memory.txt or summary.json
+    """
+    filePath = profiling.file(run, fileName)
+    if filePath is None:
+        raise HTTPException(404, "Profile not found")
+    return FileResponse(filePath, filename=f"{run}-{fileName}")
+
+
 ## Report Methods ##
 @app.get("/reports/all")
 def get_reports() -> list[RunItem]:
@@ -634,7 +716,7 @@ def get_reports() -> list[RunItem]:
     RunItems: list[RunItem] = []
     for report in reports:
         with open(report, "rb") as item:
-            reportlist = json.loads(item.read())
+            reportlist = jsoncodec.loads(item.read())
             try:
                 RunItems.append(
                     RunItem(
@@ -662,17 +744,7 @@ def make_report(playlistName, runnedAt="", blueprint=None, alogger=logger):
     if blueprint is None:
         blueprint = get_blueprint(playlistName)
 
-    response = generate_report(
-        playlistName, runnedAt, blueprint, alogger, error_callback
-    )
-
-    with open(
-        f"output/reports/{playlistName}-{str(runnedAt)[:10]}.json",
-        "w",
-        encoding="utf-8",
-    ) as f:
-        f.write(json.dumps(response))
-    return response
+    return runner.write_report(playlistName, runnedAt, blueprint, alogger)
 
 
 logger.info("App Started")
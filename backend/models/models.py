@@ -2,6 +2,26 @@ from pydantic import BaseModel
 
 
 class TrackItemSlot:
+    __slots__ = (
+        "id",
+        "title",
+        "duration",
+        "replayGain",
+        "trackNumber",
+        "volumeNumber",
+        "popularity",
+        "copyright",
+        "url",
+        "isrc",
+        "explicit",
+        "audioQuality",
+        "artist",
+        "_artists",
+        "album",
+        "thumbnail",
+        "trackinfoslot",
+    )
+
     def __init__(
         self,
         title,
@@ -35,13 +55,42 @@ class TrackItemSlot:
         self.explicit = explicit
         self.audioQuality = audioQuality
         self.artist: ArtistSubSlot = artist
-        self.artists: dict[ArtistSubSlot] = artists
+        self.artists = artists
         self.album: AlbumSubSlot | AlbumItemSlot = album
         self.thumbnail = thumbnail
         self.trackinfoslot = trackinfoslot
 
+    @property
+    def artists(self) -> list["ArtistSubSlot"]:
+        # decoders may pass a builder, most search results are never asked for it
+        if callable(self._artists):
+            self._artists = self._artists()
+        return self._artists
+
+    @artists.setter
+    def artists(self, value):
+        self._artists = value
+
 
 class AlbumItemSlot:
+    __slots__ = (
+        "id",
+        "title",
+        "duration",
+        "cover",
+        "date",
+        "numberOfTracks",
+        "numberOfVolumes",
+        "popularity",
+        "copyright",
+        "url",
+        "upc",
+        "explicit",
+        "audioQuality",
+        "artist",
+        "_artists",
+    )
+
     def __init__(
         self,
         id,
@@ -74,10 +123,31 @@ class AlbumItemSlot:
         self.explicit = explicit
         self.audioQuality = audioQuality
         self.artist: ArtistSubSlot = artist
-        self.artists: dict[ArtistSubSlot] = artists
+        self.artists = artists
+
+    @property
+    def artists(self) -> list["ArtistSubSlot"]:
+        if callable(self._artists):
+            self._artists = self._artists()
+        return self._artists
+
+    @artists.setter
+    def artists(self, value):
+        self._artists = value
 
 
 class TrackInfoSlot:
+    __slots__ = (
+        "trackId",
+        "trackReplayGain",
+        "albumReplayGain",
+        "bitDepth",
+        "sampleRate",
+        "manifest",
+        "url",
+        "codecs",
+    )
+
     def __init__(
         self,
         trackId,
@@ -98,8 +168,17 @@ class TrackInfoSlot:
         self.url = url
         self.codecs = codec
 
+    @property
+    def extension(self) -> str:
+        # AAC streams (HIGH/LOW) come in an mp4 container
+        if self.codecs.startswith("mp4a"):
+            return "m4a"
+        return self.codecs
+
 
 class ArtistSubSlot:
+    __slots__ = ("id", "name", "picture")
+
     def __init__(self, id, name, picture):
         self.id = id
         self.name = name
@@ -107,6 +186,8 @@ class ArtistSubSlot:
 
 
 class AlbumSubSlot:
+    __slots__ = ("id", "title", "cover")
+
     def __init__(self, id, title, cover):
         self.id = id
         self.title = title
@@ -114,11 +195,25 @@ class AlbumSubSlot:
 
 
 class CandidateTrack:
-    def __init__(self, title, artist, album=None, id=None):
+    __slots__ = ("title", "artist", "album", "id", "mbid", "identifiers", "isrcs")
+
+    def __init__(
+        self,
+        title,
+        artist,
+        album=None,
+        id=None,
+        mbid=None,
+        identifiers=None,
+        isrcs=None,
+    ):
         self.title = title
         self.artist = artist
         self.album = album
         self.id = id
+        self.mbid = mbid  # musicbrainz recording id
+        self.identifiers: list[str] = identifiers or []
+        self.isrcs: list[str] = isrcs or []
 
 
 class BlueprintSlot(BaseModel):
@@ -137,6 +232,11 @@ class BlueprintSlot(BaseModel):
     description: str = ""
     mode: str = "easy"
     quantity: int = 15
+    priority: int = 0
+    prefetch: int = 0  # minutes the run starts before the schedule
+    quality: str = "LOSSLESS"  # max quality, LOSSLESS, HIGH or LOW
+    qualityFallback: bool = True  # lower quality under bandwidth or budget pressure
+    pinned: bool = False  # tracks of pinned blueprints are never evicted
 
 
 class BlueprintSlotUpdate(BaseModel):
@@ -155,6 +255,11 @@ class BlueprintSlotUpdate(BaseModel):
     description: str | None = None
     mode: str | None = None
     quantity: int | None = None
+    priority: int | None = None
+    prefetch: int | None = None
+    quality: str | None = None
+    qualityFallback: bool | None = None
+    pinned: bool | None = None
 
 
 class RunItem(BaseModel):
@@ -162,3 +267,38 @@ class RunItem(BaseModel):
     runnedAt: str
     blueprint: BlueprintSlot
     tracklist: list
+    skipped: list = []
+    summary: dict = {}
+
+
+class TrackJob:
+    """
+    Per candidate run state, filled in by the pipeline stages.
+    """
+
+    __slots__ = (
+        "idx",
+        "candidate",
+        "track",
+        "trackInfo",
+        "filePath",
+        "relPath",
+        "trackBytes",
+        "artworkBytes",
+        "matchedBy",
+        "outcome",
+        "quality",
+    )
+
+    def __init__(self, idx, candidate):
+        self.idx = idx
+        self.candidate: CandidateTrack = candidate
+        self.track: TrackItemSlot | None = None
+        self.trackInfo: TrackInfoSlot | None = None
+        self.filePath = ""
+        self.relPath = ""
+        self.trackBytes: bytes | None = None
+        self.artworkBytes: bytes | None = None
+        self.matchedBy = ""  # "isrc" or "search"
+        self.outcome = ""  # download outcome, see core.report
+        self.quality = ""  # manifest quality, see core.bandwidth
@@ -0,0 +1,56 @@
+# pylint: disable=invalid-name
+"""
+Offline metadata index lookups.
+"""
+
+import json
+
+import pytest
+
+from api.metaindex import MetaIndex
+
+
+@pytest.fixture(name="index")
+def fixture_index(tmp_path):
+    dump = tmp_path / "recordings.jsonl"
+    recordings = [
+        {
+            "id": "mbid-3",
+            "title": "Song 3",
+            "artist-credit": [{"name": "Some Artist", "joinphrase": ""}],
+            "isrcs": ["ISRC3"],
+        },
+        {
+            "id": "mbid-4",
+            "title": "Song 4 (Live)",
+            "artist-credit": [{"name": "Some Artist", "joinphrase": ""}],
+            "isrcs": ["ISRC4"],
+        },
+    ]
+    dump.write_text("\n".join(json.dumps(r) for r in recordings), encoding="utf-8")
+    index = MetaIndex(str(tmp_path / "metaindex.sqlite"))
+    index.import_dump(str(dump))
+    return index
+
+
+def test_lookup_plain_title(index):
+    assert index.lookup("Song 3", "Some Artist") == ("mbid-3", ["ISRC3"])
+
+
+def test_lookup_ignores_candidate_decorations(index):
+    assert index.lookup("Song 3 - Remastered 2011", "Some Artist") == (
+        "mbid-3",
+        ["ISRC3"],
+    )
+    assert index.lookup("Song 3 (feat. Other)", "Some Artist (Band)") == (
+        "mbid-3",
+        ["ISRC3"],
+    )
+
+
+def test_lookup_ignores_indexed_decorations(index):
+    assert index.lookup("Song 4", "Some Artist") == ("mbid-4", ["ISRC4"])
+
+
+def test_lookup_without_match(index):
+    assert index.lookup("Other Song", "Some Artist") is None
@@ -0,0 +1,34 @@
+# pylint: disable=invalid-name
+"""
+Playlist publishing.
+"""
+
+import os
+import stat
+
+from core.playlist import PlaylistWriter
+
+
+def test_published_playlist_is_world_readable(tmp_path):
+    umask = os.umask(0o022)
+    try:
+        writer = PlaylistWriter("weekly", playlistDir=str(tmp_path))
+        writer.add(0, "../music/a/b/c.flac")
+    finally:
+        os.umask(umask)
+    mode = stat.S_IMODE(os.stat(writer.filePath).st_mode)
+    assert mode & stat.S_IROTH, oct(mode)
+    assert writer.lines() == ["../music/a/b/c.flac"]
+
+
+def test_republish_keeps_mode(tmp_path):
+    writer = PlaylistWriter("weekly", playlistDir=str(tmp_path))
+    writer.add(0, "../music/a/b/c.flac")
+    os.chmod(writer.filePath, 0o640)
+    writer.add(1, "../music/a/b/d.flac")
+    assert stat.S_IMODE(os.stat(writer.filePath).st_mode) == 0o640
+    with open(writer.filePath, encoding="utf-8") as f:
+        assert f.read().splitlines()[2:] == [
+            "../music/a/b/c.flac",
+            "../music/a/b/d.flac",
+        ]
@@ -0,0 +1,61 @@
+# pylint: disable=invalid-name
+"""
+Profiled pipeline runs.
+
+Run from the backend folder:
+    python -m pytest tests
+"""
+
+import cProfile
+import threading
+from os import path
+
+from core import profiling as profilingModule
+from core.pipeline import Pipeline, Stage
+from core.profiling import Profiling
+
+
+def run_pipeline(profiler, items=20):
+    results = {}
+
+    def target():
+        pipeline = Pipeline(
+            [
+                Stage("double", lambda x: x * 2, workers=2),
+                Stage("inc", lambda x: x + 1),
+            ],
+            profiler=profiler,
+        )
+        results["out"] = sorted(pipeline.run(range(items)))
+
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    thread.join(timeout=10)
+    assert not thread.is_alive(), "profiled pipeline did not finish"
+    return results["out"]
+
+
+def test_armed_pipeline_completes(tmp_path):
+    profiling = Profiling(str(tmp_path))
+    profiling.arm("blueprint")
+    with profiling.maybe_profile("blueprint", "run-1") as profiler:
+        assert profiler is not None
+        out = run_pipeline(profiler)
+    assert out == [x * 2 + 1 for x in range(20)]
+    for fileName in profilingModule.PROFILE_FILES:
+        assert path.isfile(path.join(str(tmp_path), "run-1", fileName))
+
+
+def test_stage_threads_survive_busy_profiler(tmp_path, monkeypatch):
+    # what 3.12 does when a second profiler is enabled in the process
+    def busy(self):
+        raise ValueError("Another profiling tool is already active")
+
+    monkeypatch.setattr(profilingModule, "PER_THREAD", True)
+    profiling = Profiling(str(tmp_path))
+    profiling.arm("blueprint")
+    with profiling.maybe_profile("blueprint", "run-1") as profiler:
+        monkeypatch.setattr(cProfile.Profile, "enable", busy)
+        out = run_pipeline(profiler)
+    assert out == [x * 2 + 1 for x in range(20)]
+    assert path.isfile(path.join(str(tmp_path), "run-1", "summary.json"))
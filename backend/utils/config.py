@@ -0,0 +1,17 @@
+# pylint: disable=invalid-name
+"""
+Config loading shared by the API and the worker processes
+"""
+
+from utils import jsoncodec
+
+
+def load_config(configPath="data/config.json", examplePath="data/config.example"):
+    try:
+        with open(configPath, "rb") as conf:
+            config = jsoncodec.loads(conf.read())
+    except OSError:
+        with open(examplePath, "rb") as conf:
+            config = jsoncodec.loads(conf.read())
+    jsoncodec.set_codec(config.get("jsonCodec", "auto"))
+    return config
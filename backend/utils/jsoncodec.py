@@ -0,0 +1,99 @@
+# pylint: disable=invalid-name
+# mypy: disable-error-code="import-untyped"
+"""
+Pluggable JSON codec, uses orjson when installed and falls back to the stdlib json.
+
+Every provider response, blueprint and report goes through here so the backend
+can be swapped in one place.
+"""
+
+import json
+
+try:
+    import orjson
+except ImportError:  # optional speedup, see the "speed" extra
+    orjson = None
+
+
+class _StdlibCodec:
+    name = "json"
+
+    @staticmethod
+    def loads(raw):
+        return json.loads(raw)
+
+    @staticmethod
+    def dumps(obj) -> bytes:
+        return json.dumps(obj, ensure_ascii=False).encode("utf-8")
+
+
+class _OrjsonCodec:
+    name = "orjson"
+
+    @staticmethod
+    def loads(raw):
+        if isinstance(raw, memoryview):
+            raw = bytes(raw)
+        return orjson.loads(raw)
+
+    @staticmethod
+    def dumps(obj) -> bytes:
+        return orjson.dumps(obj)
+
+
+CODECS = {"json": _StdlibCodec}
+if orjson is not None:
+    CODECS["orjson"] = _OrjsonCodec
+
+_codec = CODECS.get("orjson", _StdlibCodec)
+
+
+def set_codec(name="auto"):
+    """
+    Selects the codec by name, "auto" picks the fastest installed one.
+    Unknown or missing codecs fall back to the stdlib.
+    """
+    global _codec  # pylint: disable=global-statement
+    if name == "auto":
+        _codec = CODECS.get("orjson", _StdlibCodec)
+    else:
+        _codec = CODECS.get(name, _StdlibCodec)
+    return _codec.name
+
+
+def codec_name() -> str:
+    return _codec.name
+
+
+def loads(raw):
+    """
+    Decodes bytes or str.
+    """
+    return _codec.loads(raw)
+
+
+def dumps(obj) -> bytes:
+    """
+    Encodes to utf-8 bytes, non ascii characters are kept as is.
+    """
+    return _codec.dumps(obj)
+
+
+def dumps_canonical(obj) -> bytes:
+    """
+    Encodes with sorted keys and no whitespace, the same bytes whichever codec is active,
+    for hashing.
+    """
+    return json.dumps(
+        obj, ensure_ascii=False, sort_keys=True, separators=(",", ":")
+    ).encode("utf-8")
+
+
+def load_file(filePath):
+    with open(filePath, "rb") as f:
+        return _codec.loads(f.read())
+
+
+def dump_file(filePath, obj):
+    with open(filePath, "wb") as f:
+        f.write(_codec.dumps(obj))
@@ -0,0 +1,202 @@
+# pylint: disable=invalid-name
+"""
+Queue based logging.
+
+Loggers only put records on an in-memory queue, a background listener thread
+formats them and does the file I/O, so workers never block on disk writes.
+"""
+
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
+from os import path
+
+from utils import jsoncodec
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per line, for log shippers and grep-free parsing.
+    """
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "logger": record.name,
+            "level": record.levelname,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return jsoncodec.dumps(entry).decode("utf-8")
+
+
+class ThreadFilter(logging.Filter):
+    """
+    Passes records of the named logger emitted by the given thread or its children,
+    children are threads named "<threadName>/<anything>".
+    """
+
+    def __init__(self, name, threadName):
+        super().__init__(name)
+        self.threadName = threadName
+        self.childPrefix = threadName + "/"
+
+    def filter(self, record):
+        if not super().filter(record):
+            return False
+        return record.threadName == self.threadName or record.threadName.startswith(
+            self.childPrefix
+        )
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """
+    Enqueues the record as is, message interpolation happens in the listener thread.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+class DynamicQueueListener(logging.handlers.QueueListener):
+    """
+    QueueListener whose handlers can be added and removed while it runs.
+    """
+
+    def __init__(self, logQueue, *handlers):
+        super().__init__(logQueue, *handlers, respect_handler_level=True)
+        self._handlersLock = threading.Lock()
+
+    def add_handler(self, handler):
+        with self._handlersLock:
+            self.handlers = self.handlers + (handler,)
+
+    def remove_handler(self, handler):
+        with self._handlersLock:
+            self.handlers = tuple(h for h in self.handlers if h is not handler)
+        handler.close()
+
+
+class LogRouter:
+    """
+    Owns the log queue and the listener, builds handlers from the config.
+
+    config keys:
+        logLevel: level for every logger
+        logFormat: "text" | "json"
+        logRotation: "size" | "time"
+        logMaxBytes: max size of a log file before rotating (size rotation)
+        logBackupCount: rotated files kept per log
+        logRetentionDays: run logs older than this are deleted
+    """
+
+    def __init__(self, config, logDir="data/logs"):
+        self.config = config
+        self.logDir = logDir
+        self.level = config.get("logLevel", "WARNING")
+        self.queue: queue.Queue = queue.Queue(-1)
+        self.listener = DynamicQueueListener(self.queue)
+        self.formatter = self._build_formatter()
+
+    def _build_formatter(self):
+        if self.config.get("logFormat", "text") == "json":
+            return JsonFormatter()
+        return logging.Formatter(TEXT_FORMAT)
+
+    def _file_handler(self, fileName):
+        filePath = path.join(self.logDir, fileName)
+        if self.config.get("logRotation", "size") == "time":
+            handler = logging.handlers.TimedRotatingFileHandler(
+                filePath,
+                when="midnight",
+                backupCount=self.config.get("logBackupCount", 7),
+                encoding="utf-8",
+                delay=True,
+            )
+        else:
+            handler = logging.handlers.RotatingFileHandler(
+                filePath,
+                maxBytes=self.config.get("logMaxBytes", 5 * 1024 * 1024),
+                backupCount=self.config.get("logBackupCount", 7),
+                encoding="utf-8",
+                delay=True,
+            )
+        handler.setFormatter(self.formatter)
+        return handler
+
+    def get_logger(self, name, fileName=None):
+        """
+        Returns the named logger, its records end up in fileName through the queue.
+        Without fileName records only reach the run and forward handlers.
+        """
+        if fileName is not None:
+            handler = self._file_handler(fileName)
+            handler.addFilter(logging.Filter(name))
+            self.listener.add_handler(handler)
+
+        namedLogger = logging.getLogger(name)
+        namedLogger.setLevel(self.level)
+        namedLogger.addHandler(LazyQueueHandler(self.queue))
+        namedLogger.propagate = False
+        return namedLogger
+
+    def add_run_handler(self, name, fileName, threadName=None) -> logging.Handler:
+        """
+        Adds a per run log file for the named logger, remove it with remove_handler.
+        With threadName only records from that thread and its children are written,
+        so concurrent runs get their own files.
+        """
+        handler = logging.FileHandler(
+            path.join(self.logDir, fileName), encoding="utf-8", delay=True
+        )
+        handler.setFormatter(self.formatter)
+        if threadName is None:
+            handler.addFilter(logging.Filter(name))
+        else:
+            handler.addFilter(ThreadFilter(name, threadName))
+        self.listener.add_handler(handler)
+        return handler
+
+    def forward_to(self, logQueue) -> logging.Handler:
+        """
+        Forwards every record to another queue, ex. from a run process to the parent.
+        The record is fully formatted here so it can be pickled.
+        """
+        handler = logging.handlers.QueueHandler(logQueue)
+        self.listener.add_handler(handler)
+        return handler
+
+    def remove_handler(self, handler):
+        self.listener.remove_handler(handler)
+
+    def prune(self, prefix="run-"):
+        """
+        Deletes run logs older than logRetentionDays.
+        """
+        oldest = time.time() - self.config.get("logRetentionDays", 30) * 86400
+        try:
+            entries = os.scandir(self.logDir)
+        except OSError:
+            return
+        with entries:
+            for entry in entries:
+                if not entry.name.startswith(prefix) or not entry.is_file():
+                    continue
+                try:
+                    if entry.stat().st_mtime < oldest:
+                        os.remove(entry.path)
+                except OSError:
+                    pass
+
+    def start(self):
+        self.listener.start()
+
+    def stop(self):
+        self.listener.stop()
@@ -1,15 +1,56 @@
-import json
 import base64
+import os
+import tempfile
 from os import path, walk
 
-from core.tagger import get_flac_info, get_mp3_info
+from core.tagger import get_flac_info, get_mp3_info, get_mp4_info
+from utils import jsoncodec
 
 
 def json_from_base64(base64_bytes):
-    return json.loads(base64.b64decode(base64_bytes).decode("utf-8"))
+    return jsoncodec.loads(base64.b64decode(base64_bytes))
+
+
+# read once, setting the umask to query it is process wide and races other threads
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+def _file_mode(filePath) -> int:
+    # mode of the file being replaced, or what open() would give a new one
+    try:
+        return os.stat(filePath).st_mode & 0o7777
+    except FileNotFoundError:
+        return 0o666 & ~_UMASK
+
+
+def write_atomic(filePath, data, mode="wb", encoding=None):
+    """
+    Writes data to a temp file in the target directory and renames it over filePath,
+    readers never see a partially written file.
+    """
+    fd, tmpPath = tempfile.mkstemp(
+        dir=path.dirname(filePath), prefix=".", suffix=".part"
+    )
+    try:
+        with os.fdopen(fd, mode, encoding=encoding) as f:
+            f.write(data)
+        # mkstemp files are owner only, the media server must still read them
+        os.chmod(tmpPath, _file_mode(filePath))
+        os.replace(tmpPath, filePath)
+    except BaseException:
+        try:
+            os.remove(tmpPath)
+        except OSError:
+            pass
+        raise
 
 
 def match_candidate_to_track(candidateTrack, trackSlot) -> bool:
+    # same recording, no need to compare names
+    if trackSlot.isrc and trackSlot.isrc in getattr(candidateTrack, "isrcs", []):
+        return True
+
     # clean up titles to avoid punctuation differences between tidal and musicbrainz suggestions
     # it will miss some tracks if the title includes other infos
     trackTitle = "".join(x for x in trackSlot.title if (x.isalnum() or x in "._- "))
@@ -59,8 +100,8 @@ def generate_report(playlistName, runnedAt, blueprint, logger, error_callback):
         logger.info("reading %s", p)
         with open(p, "r", encoding="utf-8") as item:
             lines = item.readlines()
-            logger.info("reading %s", lines[1])
-            if playlistName in lines[1]:
+            # exact header match, names can be substrings of each other
+            if len(lines) > 1 and lines[1].strip() == f"#{playlistName}":
                 for t in lines[2:]:
                     filelist.append(
                         t[3:-1]
@@ -76,6 +117,8 @@ def generate_report(playlistName, runnedAt, blueprint, logger, error_callback):
             data = get_flac_info(full_path)
         if ext == "mp3":
             data = get_mp3_info(full_path)
+        if ext == "m4a":
+            data = get_mp4_info(full_path)
 
         tracklist.append(data)
 
@@ -107,7 +150,7 @@ def get_blueprint_match(playlistName, logger, error_callback):
 
     for p in blueprints:
         with open(p, "rb") as item:
-            playlistEntry = json.loads(item.read())
+            playlistEntry = jsoncodec.loads(item.read())
             if playlistEntry["name"] == playlistName:
                 playlist = playlistEntry
                 break
@@ -0,0 +1,107 @@
+"""
+Worker process for the distributed mode
+
+Claims runs queued by the API node in the shared sqlite queue and executes them.
+Start as many as needed, on the same host or on nodes sharing data/, output/ and blueprints/:
+
+    uv run python worker.py
+"""
+
+# pylint: disable=invalid-name,broad-exception-caught
+# mypy: disable-error-code="import-untyped"
+import signal
+import threading
+
+from core import quota, runner
+from core.events import bus
+from core.procexec import ProcessExecutor
+from core.workqueue import WorkQueue, SharedRateLimiter, Heartbeat, worker_id
+from api.hifi_api import AudioHifiAPI
+from utils.config import load_config
+from utils.logsetup import LogRouter
+
+# the setup only runs in the worker itself, "process" executor children re-import this module
+if __name__ == "__main__":
+    config = load_config()
+    workerConfig = {**config.get("dispatch", {}), **config.get("worker", {})}
+    workerId = worker_id()
+
+    # Setup logging
+    logRouter = LogRouter(config)
+    logger = logRouter.get_logger("Terabithia", f"worker-{workerId}.log")
+    runlogger = logRouter.get_logger("Runner", f"runner-{workerId}.log")
+    logRouter.start()
+    runner.init(config, logRouter)
+
+    workQueue = WorkQueue(workerConfig)
+    # mirror pacing is shared by every worker through the queue database
+    AudioHifiAPI.rateLimiter = SharedRateLimiter(
+        workQueue, workerConfig.get("requestInterval", 2)
+    )
+
+    processExecutor = None
+    if config.get("executor", "thread") == "process":
+        processExecutor = ProcessExecutor(config, logRouter)
+
+stopping = threading.Event()
+
+
+def run_progress(name):
+    # latest progress of the run, stored with the heartbeat for the API node
+    states = [s for s in bus.snapshot() if s.get("name") == name]
+    return max(states, key=lambda s: s.get("startedAt", 0)) if states else None
+
+
+def work():
+    poll = workerConfig.get("poll", 5)
+    heartbeat = workerConfig.get("heartbeat", 30)
+    logger.info("Worker %s started", workerId)
+    while not stopping.is_set():
+        try:
+            claimed = workQueue.claim(workerId)
+        except Exception as e:
+            logger.error("Error claiming run %s", e, exc_info=True)
+            claimed = None
+        if claimed is None:
+            stopping.wait(poll)
+            continue
+
+        logger.info("Claimed run %s (%s)", claimed["name"], claimed["id"])
+        deferFor = quota.blueprint_defer(claimed["name"])
+        if deferFor > 0:
+            workQueue.defer(claimed["id"], workerId, deferFor)
+            continue
+        error = None
+        with Heartbeat(
+            workQueue,
+            claimed["id"],
+            workerId,
+            heartbeat,
+            progress=lambda: run_progress(claimed["name"]),
+        ) as beat:
+            try:
+                # a lost lease stops the run, the worker that reclaimed it carries on
+                if processExecutor is not None:
+                    processExecutor.run(claimed["name"], cancel=beat.lost)
+                else:
+                    runner.fetch(claimed["name"], cancel=beat.lost)
+            except Exception as e:
+                logger.error("Error in run %s: %s", claimed["name"], e, exc_info=True)
+                error = str(e)
+        if beat.lost.is_set():
+            logger.warning("Lease lost for run %s", claimed["name"])
+            continue
+        workQueue.finish(claimed["id"], workerId, error)
+        logger.info("Finished run %s", claimed["name"])
+    logRouter.stop()
+
+
+def shutdown(signum, frame):  # pylint: disable=unused-argument
+    # the current run is finished first, its lease would expire otherwise
+    stopping.set()
+
+
+if __name__ == "__main__":
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+    work()
@@ -37,7 +37,7 @@ export const ReportInfo: React.FC<ReportInfoProps> = ({ reportItem, onCancel })
                         return (
                             <div className="flex border-b border-zinc-800">
                                 <div className="h-10 w-10 rounded-full bg-primary-100 dark:bg-primary-900/30 flex items-center justify-center text-primary-600 dark:text-primary-400 mr-4 shrink-0">
-                                    <img className="rounded-full" src={"data:image/png;base64," + runitem["ARTWORK"]}></img>
+                                    {(runitem["ARTWORK"] || runitem["ARTWORKURL"]) && <img className="rounded-full" src={runitem["ARTWORK"] ? "data:image/png;base64," + runitem["ARTWORK"] : runitem["ARTWORKURL"]}></img>}
                                 </div>
                                 <div className="flex h-10 font-light items-center justify-between w-full mb-2">
                                     <div className=""><b>{runitem["title"]}</b> <div className="text-sm">{runitem["artist"]}</div></div>
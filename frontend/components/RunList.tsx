@@ -1,8 +1,11 @@
-import React, { useState } from 'react';
+import React, { useState, useEffect } from 'react';
 import { Card, Badge } from './ui/Common';
 import { Icons } from './ui/Icons';
-import { RunItem } from '../types';
+import { RunItem, RunProgress } from '../types';
 import { ReportInfo } from './ReportInfo';
+import { api } from '../services/api';
+
+const formatBytes = (value?: number) => value === undefined ? '-' : (value / 1024 / 1024).toFixed(1) + ' MB';
 
 
 
@@ -18,6 +21,12 @@ export const RunsList: React.FC<RunListProps> = ({ runs }) => {
         setIsModalOpen(true)
     }
     const lastrun = runs.at(0)
+    const [liveRuns, setLiveRuns] = useState<Record<string, RunProgress>>({});
+    useEffect(() => {
+        const close = api.subscribeRunEvents((event) => setLiveRuns((current) => ({ ...current, [event.run]: event })));
+        return close;
+    }, []);
+    const activeRuns = Object.values(liveRuns).filter((r) => r.event !== 'done' && r.event !== 'failed');
     return (
         <div className="max-w-4xl mx-auto space-y-6">
 
@@ -34,6 +43,31 @@ export const RunsList: React.FC<RunListProps> = ({ runs }) => {
 
             </Card>
 
+            {/* Live Runs */}
+            {activeRuns.length > 0 && (
+                <div className="space-y-4">
+                    <h3 className="text-md font-medium text-gray-900 dark:text-gray-200 uppercase tracking-wider text-xs ml-1 flex items-center gap-2">
+                        <Icons.Clock size={14} /> Running Now
+                    </h3>
+                    {activeRuns.map((live) => (
+                        <Card key={live.run} className="flex flex-col gap-1">
+                            <div className="flex items-center justify-between">
+                                <span className="text-base text-gray-900 dark:text-white">{live.name}</span>
+                                <Badge>{live.event}</Badge>
+                            </div>
+                            <p className="text-sm text-gray-500 dark:text-gray-400">
+                                Candidates: {live.candidates ?? '-'} • Matched: {live.matched ?? 0} • Done: {live.track ?? 0}
+                            </p>
+                            {live.current && (
+                                <p className="text-sm text-gray-500 dark:text-gray-400 truncate">
+                                    {live.current.title}: {formatBytes(live.current.bytes)} / {formatBytes(live.current.total)} @ {formatBytes(live.current.rate)}/s
+                                </p>
+                            )}
+                        </Card>
+                    ))}
+                </div>
+            )}
+
             {/* Schedule Items */}
             <div className="space-y-4">
                 <h3 className="text-md font-medium text-gray-900 dark:text-gray-200 uppercase tracking-wider text-xs ml-1 flex items-center gap-2">
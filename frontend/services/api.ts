@@ -1,4 +1,4 @@
-import { Blueprint, RunItem, SchedulerState } from '../types';
+import { Blueprint, RunItem, RunProgress, SchedulerState } from '../types';
 
 let API_BASE_URL = "";
 
@@ -82,5 +82,14 @@ export const api = {
     const res = await fetch(API_BASE_URL + `/reports/all`);
     if (!res.ok) throw new Error("Failed to fetch reports");
     return (res.json());
+  },
+
+  // --- Run Progress --- //
+
+  // Opens one SSE connection, returns a function closing it
+  subscribeRunEvents: (onEvent: (event: RunProgress) => void): (() => void) => {
+    const source = new EventSource(API_BASE_URL + `/runs/events`);
+    source.onmessage = (msg) => onEvent(JSON.parse(msg.data));
+    return () => source.close();
   }
 };
\ No newline at end of file
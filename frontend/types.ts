@@ -25,6 +25,11 @@ export interface Blueprint {
   description: string;
   mode: 'easy' | 'medium' | 'hard';
   quantity: number;
+  priority?: number;
+  prefetch?: number;
+  quality?: "LOSSLESS" | "HIGH" | "LOW";
+  qualityFallback?: boolean;
+  pinned?: boolean;
 }
 
 export type SchedulerState = 'Running and processing' | 'Processing Paused' | 'Not Running' | 'Status Unknown';
@@ -43,4 +48,26 @@ export interface RunItem {
   blueprint: Blueprint;
   tracklist: [];
 
-}
\ No newline at end of file
+}
+
+export interface RunProgress {
+  run: string;
+  name: string;
+  event: string;
+  time: number;
+  startedAt?: number;
+  candidates?: number;
+  matched?: number;
+  unmatched?: number;
+  tagged?: number;
+  track?: number;
+  error?: string;
+  detail?: Record<string, unknown>;
+  current?: {
+    idx: number;
+    title: string;
+    bytes?: number;
+    total?: number;
+    rate?: number;
+  };
+}